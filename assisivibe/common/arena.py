@@ -3,8 +3,7 @@
 
 from __future__ import print_function
 
-import PIL.Image
-import PIL.ImageChops
+import os.path
 import subprocess
 import time
 
@@ -50,13 +49,16 @@ class BasicArena:
         CASU temperature must be below a minimum threshold.  The suitability is
         a function of the CASU ring temperature sensor.
         """
+        return arenas_status ([self]) [0]
+
+    def status_from_temperatures (self, temps):
+        """
+        Return the suitability of this arena given the temperatures of its CASUs.
+        """
         import worker
         value = 0
-        temps = []
         good = True
-        for ws in self.list_workers_stubs:
-            temperature = zmq_sock_utils.send_recv (ws.socket, [worker.CASU_STATUS])
-            temps.append (temperature)
+        for temperature in temps:
             if temperature > worker.CASU_TEMPERATURE + 1 or temperature < worker.CASU_TEMPERATURE - 1:
                 good = False
             else:
@@ -71,25 +73,53 @@ class BasicArena:
         return (value, temps)
             
 
-    def run_vibration_model (self, config, *parameters):
+    def run_vibration_model (self, config, candidate, start_time = None):
         """
         Pick a random worker and ask it to run the vibration pattern.
         Waits for the response from the selected worker.  Workers respond when they finish their role.
         """
+        self.start_vibration_model (config, candidate, start_time)
+        return self.wait_vibration_model (config)
+
+    def start_vibration_model (self, config, candidate, start_time = None):
+        """
+        Ask the workers of this arena to run the vibration pattern without waiting for their response.
+        This allows several arenas to run vibration patterns at the same time.
+        If a start time in the master clock is given, the workers start at that instant, otherwise they start when they receive the request.
+        """
         import worker
         for i in xrange (len (self.list_workers_stubs)):
             worker_stub = self.list_workers_stubs [i]
+            if start_time is None:
+                start = []
+            else:
+                start = [worker_stub.worker_time (start_time)]
             if i == self.selected_region_of_interest_index or i < self.number_active_CASUs:
-                zmq_sock_utils.send (worker_stub.socket, [worker.ACTIVE_CASU] + list (parameters))
+                zmq_sock_utils.send (worker_stub.socket, [worker.ACTIVE_CASU, candidate] + start)
             else:
-                zmq_sock_utils.send (worker_stub.socket, [worker.PASSIVE_CASU])
+                zmq_sock_utils.send (worker_stub.socket, [worker.PASSIVE_CASU] + start)
+
+    def wait_vibration_model (self, config):
+        """
+        Wait for the response of the workers of this arena after they were asked to run the vibration pattern.
+        Workers that do not respond some time after the evaluation should have finished raise zmq_sock_utils.WorkerTimeout.
+        Returns a tuple with the time, in the master clock, when the vibration pattern started and the actual start of each segment reported by the active worker.
+        """
+        timeout = zmq_sock_utils.DEFAULT_TIMEOUT + 1000 * sum ([sd ['duration'] for sd in config.evaluation_proceeding])
+        (answers, missing) = zmq_sock_utils.gather (self.list_workers_stubs, timeout)
+        if len (missing) > 0:
+            for ws in missing:
+                zmq_sock_utils.reconnect (ws)
+            raise zmq_sock_utils.WorkerTimeout (missing)
         time_start_vibration_pattern = None
-        for ws in self.list_workers_stubs:
-            answer = zmq_sock_utils.recv (ws.socket)
-            if len (answer) == 2:
-                time_start_vibration_pattern = answer [1]
+        segment_starts = None
+        for ws, answer in zip (self.list_workers_stubs, answers):
+            if len (answer) >= 2:
+                time_start_vibration_pattern = ws.master_time (answer [1])
+            if len (answer) == 3:
+                segment_starts = answer [2]
             print ("Worker responsible for casu #%d responded with: %s" % (ws.casu_number, str (answer)))
-        return time_start_vibration_pattern
+        return (time_start_vibration_pattern, segment_starts)
 
     @staticmethod
     def __ask_casu_number_ (name, dict_workers_stubs):
@@ -111,6 +141,32 @@ class BasicArena:
             except ValueError:
                 print ("Invalid number")
 
+def arenas_status (arenas):
+    """
+    Return the suitability of each of the given arenas to run a vibration pattern.
+    The temperatures are read from the most recent telemetry snapshots.
+    The temperatures of the CASUs without a recent snapshot are requested concurrently.
+    """
+    import worker
+    stubs = [ws for an_arena in arenas for ws in an_arena.list_workers_stubs]
+    temperatures = [None] * len (stubs)
+    for index, ws in enumerate (stubs):
+        if ws.telemetry is not None:
+            snapshot = ws.telemetry.snapshot (ws.casu_number)
+            if snapshot is not None:
+                temperatures [index] = snapshot.wax_temperature
+    missing = [index for index in xrange (len (stubs)) if temperatures [index] is None]
+    if len (missing) > 0:
+        replies = zmq_sock_utils.fan_out ([stubs [index] for index in missing], [[worker.CASU_STATUS]] * len (missing))
+        for index, reply in zip (missing, replies):
+            temperatures [index] = reply [1]
+    result = []
+    for an_arena in arenas:
+        number_stubs = len (an_arena.list_workers_stubs)
+        result.append (an_arena.status_from_temperatures (temperatures [:number_stubs]))
+        temperatures = temperatures [number_stubs:]
+    return result
+
 class AbstractVideoTapeableArena (BasicArena):
     """
     An arena that can be video taped, that has regions of interest, and that has controllable CASUs.
@@ -124,29 +180,47 @@ class AbstractVideoTapeableArena (BasicArena):
         self.number_ROIs = number_ROIs
         self.same_colour_threshold_int = int (config.same_colour_threshold * 255 / 100)
         self.delta_frame = int (config.frames_per_second / config.interval_current_previous_frame)
-        self.frame_template = 'tmp/iteration-frame-%04d.jpg'
         self.roi_template = '%sMask-%%d.jpg' % (self.img_path)
-        self.background_filename = "%sBackground.jpg" % (episode_path)
-
-    def compare_frames (self, ith_frame):
+        self.background_filename = "%sBackground.png" % (episode_path)
+        self.analysis_scale = config.analysis_scale
+        if self.analysis_scale > 1:
+            self.roi_index_filename = '%sROI-index-scale-%d.npz' % (self.img_path, self.analysis_scale)
+        else:
+            self.roi_index_filename = '%sROI-index.npz' % (self.img_path)
+        self.pixel_difference_engine = None
+
+    def compile_ROI_index (self):
         """
-        Compare the background frame with the ith frame from an iteration video
-        and compare frames that are delta_frame apart.
-        Returns a list with number of pixels that are different,
-        meaning the pixel value difference is higher than threshold.
-        The contents of the list are:
+        Compile the region-of-interest masks of this arena into the index used to compare frames.
+        """
+        return image_processing_functions.ROIIndex.compile (
+            [self.roi_template % (index_ROI) for index_ROI in xrange (self.number_ROIs)],
+            self.roi_index_filename,
+            self.analysis_scale)
 
-        [
-          pixel count difference background ith frame region-of-interest 1,
-          pixel count difference frames delta_frame apart region-of-interest 1,
-          pixel count difference background ith frame region-of-interest 2,
-          pixel count difference frames delta_frame apart region-of-interest 2,
-          ...
-        ]
+    def get_pixel_difference_engine (self):
+        """
+        Return the engine that compares frames in the regions of interest of this arena.
+        The engine is created on first use because the masks are only available after the user picks the regions of interest.
         """
-        return image_processing_functions.compare_frames (
-            ith_frame, self.delta_frame, self.number_ROIs, self.frame_template,
-            self.roi_template, self.background_filename, self.same_colour_threshold_int)
+        if self.pixel_difference_engine is None:
+            if os.path.isfile (self.roi_index_filename):
+                roi_index = image_processing_functions.ROIIndex.load (self.roi_index_filename)
+            else:
+                roi_index = self.compile_ROI_index ()
+            self.pixel_difference_engine = image_processing_functions.PixelDifferenceEngine (
+                roi_index,
+                image_processing_functions.load_grey_image (self.background_filename, scale = self.analysis_scale),
+                self.same_colour_threshold_int)
+        return self.pixel_difference_engine
+
+    def set_background (self, background_filename):
+        """
+        Use the background image in the given file to compare frames from now on.
+        """
+        self.background_filename = background_filename
+        if self.pixel_difference_engine is not None:
+            self.pixel_difference_engine.set_background (image_processing_functions.load_grey_image (background_filename, scale = self.analysis_scale))
 
     def write_properties (self, list_casu_names):
         '''
@@ -159,6 +233,55 @@ class AbstractVideoTapeableArena (BasicArena):
             yaml.dump (data, fp, default_flow_style = False)
             fp.close ()
 
+class ArenaGroup:
+    """
+    Arenas that are evaluated at the same time and recorded in the same iteration video.
+    The image processing data of the group has the columns of each arena, in order.
+    The engines of the groups already evaluated are kept in the given dictionary, indexed by method key.
+    """
+    def __init__ (self, arenas, engines):
+        self.arenas = arenas
+        self.engines = engines
+        self.delta_frame = arenas [0].delta_frame
+        self.number_ROIs = sum ([an_arena.number_ROIs for an_arena in arenas])
+        self.pixel_difference_engine = None
+
+    def column_slices (self):
+        """
+        Return the slice of the image processing data columns of each arena.
+        """
+        result = []
+        first_column = 0
+        for an_arena in self.arenas:
+            result.append (slice (first_column, first_column + 2 * an_arena.number_ROIs))
+            first_column += 2 * an_arena.number_ROIs
+        return result
+
+    def key (self):
+        """
+        Return a key that identifies the arenas of this group and their background image.
+        """
+        return (tuple ([an_arena.img_path for an_arena in self.arenas]), self.arenas [0].background_filename)
+
+    def get_pixel_difference_engine (self):
+        """
+        Return the engine that compares frames in the regions of interest of all the arenas.
+        The arenas of an episode share the background image.
+        The region-of-interest indexes of the arenas are merged, and the engine is reused by later groups with the same arenas.
+        """
+        if self.pixel_difference_engine is None:
+            key = self.key ()
+            if key not in self.engines:
+                first_arena = self.arenas [0]
+                roi_index = image_processing_functions.ROIIndex.merge (
+                    [an_arena.get_pixel_difference_engine ().roi_index for an_arena in self.arenas])
+                self.engines [key] = image_processing_functions.PixelDifferenceEngine (
+                    roi_index,
+                    image_processing_functions.load_grey_image (first_arena.background_filename, scale = first_arena.analysis_scale),
+                    first_arena.same_colour_threshold_int)
+            self.pixel_difference_engine = self.engines [key]
+        return self.pixel_difference_engine
+
 class CircularArena (AbstractVideoTapeableArena):
     """
     A circular arena with a single casu.  Region of interest is circular
@@ -169,10 +292,6 @@ class CircularArena (AbstractVideoTapeableArena):
         """
         AbstractVideoTapeableArena.__init__ (self, dict_workers_stubs, CircularArena.ROI_names (), 1, CircularArena.number_ROIs (), episode_path, img_path, index, config)
 
-    @staticmethod
-    def image_processing_header ():
-        return ["background", "previous_iteration"]
-
     @staticmethod
     def number_ROIs ():
         return 1
@@ -214,10 +333,6 @@ class TwoCircularArenas (AbstractVideoTapeableArena):
     def __init__ (self, dict_workers_stubs, episode_path, img_path, index, config):
         AbstractVideoTapeableArena.__init__ (self, dict_workers_stubs, TwoCircularArenas.ROI_names (), 1, TwoCircularArenas.number_ROIs (), episode_path, img_path, index, config)
 
-    @staticmethod
-    def image_processing_header ():
-        return ["active_background", "active_previous_iteration", "passive_background", "passive_previous_iteration"]
-
     @staticmethod
     def number_ROIs ():
         return 2
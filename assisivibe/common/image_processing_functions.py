@@ -8,55 +8,461 @@
 # This module contains the functions that compare images in order to
 # compute the pixel count difference between them.
 
+import copy
+import csv
+import numpy
+import os.path
 import PIL.Image
-import PIL.ImageChops
+
+# scales at which frames can be analysed
+ANALYSIS_SCALES = [1, 2, 4, 8]
+
+def scaled_size (size, scale):
+    """
+    Return the size of an image, or of a box, decoded at the given scale.  Partial blocks of pixels are kept.
+    """
+    return tuple ([-(-length // scale) for length in size])
+
+def load_grey_image (filename, box = None, scale = 1):
+    """
+    Decode an image file and return it as a NumPy array with one uint8 grey level per pixel.
+    If a box (left, upper, right, lower) is given, only that part of the image is returned.
+    Images are reduced at the given scale by function downsample, and the box is in reduced coordinates.
+    """
+    result = PIL.Image.open (filename)
+    if result.mode != 'L':
+        result = result.convert (mode = 'L')
+    result = numpy.asarray (result, dtype = numpy.uint8)
+    if scale > 1:
+        result = downsample (result, scale)
+    if box is not None:
+        (left, upper, right, lower) = box
+        result = result [upper:lower, left:right]
+    return result
+
+def save_grey_image (filename, image):
+    """
+    Save a NumPy array with one uint8 grey level per pixel in an image file.  The format is given by the file name extension, PNG files are lossless.
+    """
+    PIL.Image.fromarray (image, mode = 'L').save (filename)
+
+def read_grey_image (filename, out):
+    """
+    Decode an image file into the given uint8 array, which must have the image size.
+    """
+    numpy.copyto (out, load_grey_image (filename))
+    return out
+
+def mask_frame (mask, frame):
+    """
+    Apply a region-of-interest mask to a frame.  The mask should be an
+    uint16 array so that the product does not overflow.  This is the same
+    operation as PIL.ImageChops.multiply.
+    """
+    result = numpy.multiply (mask, frame, dtype = numpy.uint16)
+    result //= 255
+    return result.astype (numpy.uint8)
+
+def count_different_pixels (masked_frame1, masked_frame2, same_colour_threshold):
+    """
+    Return the number of pixels whose absolute difference between two masked frames is equal or higher than the threshold.
+    """
+    difference = numpy.subtract (masked_frame1, masked_frame2, dtype = numpy.int16)
+    numpy.absolute (difference, out = difference)
+    return numpy.count_nonzero (difference >= same_colour_threshold)
 
 def number_different_pixels_ROI (ROI_filename, frame1_filename, frame2_filename, same_colour_threshold):
     """
     Compare two frames to see how many pixels are different in a specific region of interest.
     """
-    def open_image (filename_filename):
-        result = PIL.Image.open (filename_filename)
-        if result.mode != 'L':
-            result = result.convert (mode = 'L')
+    mask = load_grey_image (ROI_filename)
+    # pixels outside the mask are black in both masked frames
+    if same_colour_threshold > 0:
+        box = mask_bounding_box ([mask])
+        mask = mask [box [1]:box [3], box [0]:box [2]]
+    else:
+        box = None
+    mask = mask.astype (numpy.uint16)
+    return count_different_pixels (
+        mask_frame (mask, load_grey_image (frame1_filename, box)),
+        mask_frame (mask, load_grey_image (frame2_filename, box)),
+        same_colour_threshold)
+
+# grey level above which a pixel of a mask image belongs to the region-of-interest
+MASK_THRESHOLD = 128
+
+# number of absolute differences between grey levels
+DIFFERENCE_LEVELS = 256
+
+def downsample (image, scale):
+    """
+    Return an image whose pixels are the mean grey level, rounded, of blocks of scale by scale pixels of the given image.
+    This is the area filter that reduces the frames decoded by ffmpeg.  Blocks at the right and lower borders may be partial.
+    """
+    (scaled_height, scaled_width) = scaled_size (image.shape, scale)
+    sums = numpy.zeros ((scaled_height * scale, scaled_width * scale), dtype = numpy.uint32)
+    sums [:image.shape [0], :image.shape [1]] = image
+    counts = numpy.zeros (sums.shape, dtype = numpy.uint32)
+    counts [:image.shape [0], :image.shape [1]] = 1
+    sums = sums.reshape (scaled_height, scale, scaled_width, scale).sum (axis = (1, 3))
+    counts = counts.reshape (scaled_height, scale, scaled_width, scale).sum (axis = (1, 3))
+    return ((sums + counts // 2) // counts).astype (numpy.uint8)
+
+def mask_bounding_box (masks, threshold = 1):
+    """
+    Return the box (left, upper, right, lower) of the mask pixels that are equal or higher than the threshold.
+    If the masks are empty, the box is the whole mask.
+    """
+    union = numpy.zeros (masks [0].shape, dtype = numpy.bool_)
+    for mask in masks:
+        union |= mask >= threshold
+    rows = numpy.flatnonzero (union.any (axis = 1))
+    columns = numpy.flatnonzero (union.any (axis = 0))
+    if len (rows) == 0:
+        return (0, 0, union.shape [1], union.shape [0])
+    return (int (columns [0]), int (rows [0]), int (columns [-1]) + 1, int (rows [-1]) + 1)
+
+class ROIIndex:
+    """
+    The flat indexes of the pixels of the regions-of-interest of an arena and the region-of-interest label of each index.
+    Indexes are relative to the bounding box of all regions-of-interest, at the analysis scale.
+    Frames can be given either cropped to the box or with the full frame shape.
+    """
+    def __init__ (self, shape, pixels, labels, number_ROIs, box = None, scale = 1):
+        self.shape = tuple (shape)
+        self.pixels = pixels
+        self.labels = labels
+        self.number_ROIs = number_ROIs
+        self.scale = scale
+        if box is None:
+            box = (0, 0, self.shape [1], self.shape [0])
+        self.box = tuple (box)
+
+    @staticmethod
+    def from_masks (masks, scale = 1):
+        """
+        Create the index of the regions-of-interest represented by the given list of mask arrays.
+        """
+        if scale > 1:
+            masks = [downsample (mask, scale) for mask in masks]
+        (left, upper, right, lower) = box = mask_bounding_box (masks, MASK_THRESHOLD)
+        list_pixels = [numpy.flatnonzero (mask [upper:lower, left:right] >= MASK_THRESHOLD) for mask in masks]
+        return ROIIndex (
+            (lower - upper, right - left),
+            numpy.concatenate (list_pixels).astype (numpy.int32),
+            numpy.concatenate ([numpy.full (len (pixels), index_ROI, dtype = numpy.uint8) for index_ROI, pixels in enumerate (list_pixels)]),
+            len (masks),
+            box,
+            scale)
+
+    @staticmethod
+    def merge (indexes):
+        """
+        Return the index of the regions-of-interest of the given indexes, in order.  The indexes must have the same scale.
+        """
+        left = min ([index.box [0] for index in indexes])
+        upper = min ([index.box [1] for index in indexes])
+        right = max ([index.box [2] for index in indexes])
+        lower = max ([index.box [3] for index in indexes])
+        list_pixels = []
+        list_labels = []
+        number_ROIs = 0
+        for index in indexes:
+            rows = index.pixels // index.shape [1] + (index.box [1] - upper)
+            columns = index.pixels % index.shape [1] + (index.box [0] - left)
+            list_pixels.append (rows * (right - left) + columns)
+            list_labels.append (index.labels + number_ROIs)
+            number_ROIs += index.number_ROIs
+        return ROIIndex (
+            (lower - upper, right - left),
+            numpy.concatenate (list_pixels).astype (numpy.int32),
+            numpy.concatenate (list_labels).astype (numpy.uint8),
+            number_ROIs,
+            (left, upper, right, lower),
+            indexes [0].scale)
+
+    @staticmethod
+    def compile (ROI_filenames, index_filename, scale = 1):
+        """
+        Compile the mask images with the given file names and save the index.
+        """
+        result = ROIIndex.from_masks ([load_grey_image (filename) for filename in ROI_filenames], scale)
+        result.save (index_filename)
+        return result
+
+    @staticmethod
+    def load (filename):
+        data = numpy.load (filename)
+        # indexes saved before frames were cropped refer to the full frame
+        box = tuple (data ['box']) if 'box' in data else None
+        scale = int (data ['scale']) if 'scale' in data else 1
+        return ROIIndex (tuple (data ['shape']), data ['pixels'], data ['labels'], int (data ['number_ROIs']), box, scale)
+
+    def save (self, filename):
+        with open (filename, 'wb') as fp:
+            numpy.savez (fp, shape = numpy.array (self.shape), pixels = self.pixels, labels = self.labels, number_ROIs = self.number_ROIs, box = numpy.array (self.box), scale = self.scale)
+
+    def crop (self, frame):
+        """
+        Return the part of the given frame inside the bounding box of the regions-of-interest.
+        Frames that are already cropped are returned as they are.
+        """
+        if frame.shape == self.shape:
+            return frame
+        (left, upper, right, lower) = self.box
+        return frame [upper:lower, left:right]
+
+    def areas (self):
+        """
+        Return the number of pixels of each region-of-interest.
+        """
+        return numpy.bincount (self.labels, minlength = self.number_ROIs)
+
+    def gather (self, frame):
+        """
+        Return the values of the region-of-interest pixels of the given frame.
+        """
+        return self.crop (frame).take (self.pixels)
+
+class PixelDifferenceEngine:
+    """
+    Counts the pixels that are different between frames in each region-of-interest of an arena.
+    The background pixels are kept in memory, and all regions-of-interest are counted in a single bincount.
+    """
+    def __init__ (self, roi_index, background, same_colour_threshold):
+        self.roi_index = roi_index
+        self.same_colour_threshold = same_colour_threshold
+        self.background_pixels = roi_index.gather (background).astype (numpy.int16)
+        self.differences = numpy.empty ((2, len (roi_index.pixels)), dtype = numpy.int16)
+        labels = roi_index.labels.astype (numpy.intp)
+        # column of the compare result where each difference is counted
+        self.column_labels = numpy.concatenate ((labels * 2, labels * 2 + 1))
+        self.number_columns = 2 * roi_index.number_ROIs
+
+    def set_background (self, background):
+        """
+        Replace the background frame.  The background pixels are replaced by a new array, so that clones of this engine keep the previous background.
+        """
+        self.background_pixels = self.roi_index.gather (background).astype (numpy.int16)
+
+    def clone (self):
+        """
+        Return an engine that shares the region-of-interest index and the background pixels of this engine.
+        The new engine has its own work buffer, so it can be used in another thread.
+        """
+        result = copy.copy (self)
+        result.differences = numpy.empty_like (self.differences)
         return result
-    img_ROI = open_image (ROI_filename)
-    img_frame1 = open_image (frame1_filename)
-    img_frame2 = open_image (frame2_filename)
-    img_ROI1 = PIL.ImageChops.multiply (img_ROI, img_frame1)
-    img_ROI2 = PIL.ImageChops.multiply (img_ROI, img_frame2)
-    img_diff = PIL.ImageChops.difference (img_ROI1, img_ROI2)
-    histogram = img_diff.histogram ()
-    return sum (histogram [same_colour_threshold:256])
-
-def compare_frames (ith_frame, delta_frame, number_ROIs, frame_template, ROI_template, background_filename, same_colour_threshold):
-    """
-    Compare the background frame with the ith frame from an iteration video
-    and compare frames that are delta_frame apart.  Returns a list with
-    number of pixels that are different for each region-of-interest,
-    meaning the pixel value difference is higher than threshold.  The
-    contents of the list are:
-
-    [
-      pixel count difference background ith frame region-of-interest 1,
-      pixel count difference frames delta_frame apart region-of-interest 1,
-      pixel count difference background ith frame region-of-interest 2,
-      pixel count difference frames delta_frame apart region-of-interest 2,
-      ...
-    ]
-    """
-    frame1_filename = frame_template % (ith_frame)
-    return [
-        number_different_pixels_ROI (ROI_filename, frame1_filename, frame2_filename, same_colour_threshold)
-        if not frame2_filename is None
-        else -1
-        for ROI_filename in [ROI_template % (index_ROI) for index_ROI in xrange (number_ROIs)]
-        for frame2_filename in [
-                background_filename,
-                frame_template % (ith_frame - delta_frame)
-                if ith_frame > delta_frame
-                else None]
+
+    def absolute_differences (self, frame, previous_frame = None):
+        """
+        Return the absolute differences between the region-of-interest pixels of the given frame and those of the background and previous frames, together with the compare result column of each difference.
+        The returned differences are a view of the work buffer of this engine.
+        """
+        frame_pixels = self.roi_index.gather (frame)
+        numpy.subtract (frame_pixels, self.background_pixels, out = self.differences [0], dtype = numpy.int16)
+        if previous_frame is None:
+            differences = self.differences [0]
+            column_labels = self.column_labels [:len (differences)]
+        else:
+            numpy.subtract (frame_pixels, self.roi_index.gather (previous_frame), out = self.differences [1], dtype = numpy.int16)
+            differences = self.differences.ravel ()
+            column_labels = self.column_labels
+        numpy.absolute (differences, out = differences)
+        return (differences, column_labels)
+
+    def compare (self, frame, previous_frame = None):
+        """
+        Compare the given frame with the background frame and with the previous frame.
+        If there is no previous frame, the corresponding pixel counts are -1.
+        Returns a list with number of pixels that are different,
+        meaning the pixel value difference is higher than threshold.
+        The contents of the list are:
+
+        [
+          pixel count difference background frame region-of-interest 1,
+          pixel count difference previous frame region-of-interest 1,
+          pixel count difference background frame region-of-interest 2,
+          pixel count difference previous frame region-of-interest 2,
+          ...
         ]
+        """
+        (differences, column_labels) = self.absolute_differences (frame, previous_frame)
+        result = numpy.bincount (column_labels [differences >= self.same_colour_threshold], minlength = self.number_columns)
+        if previous_frame is None:
+            result [1::2] = -1
+        return result.tolist ()
+
+    def difference_histograms (self, frame, previous_frame = None):
+        """
+        Return the cumulative histograms of the absolute differences computed by method compare.
+        Element [c, t] is the number of pixels counted in column c when the threshold is t.
+        """
+        (differences, column_labels) = self.absolute_differences (frame, previous_frame)
+        histograms = numpy.bincount (column_labels * DIFFERENCE_LEVELS + differences, minlength = self.number_columns * DIFFERENCE_LEVELS)
+        histograms = histograms.reshape (self.number_columns, DIFFERENCE_LEVELS)
+        return histograms [:, ::-1].cumsum (axis = 1) [:, ::-1]
+
+class FrameWindow:
+    """
+    A ring buffer with the last delta_frame + 1 decoded frames of an iteration video.
+    Each frame is decoded once, into the slot of the oldest frame.  Frame numbers start at one.
+    """
+    def __init__ (self, delta_frame, frame_shape):
+        self.delta_frame = delta_frame
+        self.frames = numpy.zeros ((delta_frame + 1,) + tuple (frame_shape), dtype = numpy.uint8)
+        self.ith_frame = 0
+        self.first_frame = 1
+
+    def restart (self, first_frame):
+        """
+        Restart the window so that the next frame is the given frame.  Frames read before are forgotten.
+        This is used when only some intervals of the video are decoded.
+        """
+        self.ith_frame = first_frame - 1
+        self.first_frame = first_frame
+
+    def next_frame_buffer (self):
+        """
+        Return the slot where the next frame should be decoded.
+        """
+        return self.frames [(self.ith_frame + 1) % len (self.frames)]
+
+    def advance (self):
+        """
+        Make the frame in the next frame buffer the current frame.
+        """
+        self.ith_frame += 1
+
+    def current_frame (self):
+        return self.frames [self.ith_frame % len (self.frames)]
+
+    def previous_frame (self):
+        """
+        Return the frame delta_frame apart from the current frame or None if there is no such frame.
+        """
+        if self.ith_frame - self.delta_frame >= self.first_frame:
+            return self.frames [(self.ith_frame - self.delta_frame) % len (self.frames)]
+        else:
+            return None
+
+def read_raw_frame (stream, out):
+    """
+    Read a raw grey frame from a binary stream directly into the given contiguous uint8 array.
+    Returns False if the stream ends before the frame is complete.
+    """
+    view = memoryview (out.reshape (-1))
+    offset = 0
+    while offset < len (view):
+        size = stream.readinto (view [offset:])
+        if not size:
+            return False
+        offset += size
+    return True
+
+def stream_frames (stream, window, number_frames):
+    """
+    Generator that reads raw grey frames from a binary stream into a frame window and yields the number of each frame.
+    Stops after the given number of frames or at the end of the stream.
+    """
+    for _ in xrange (number_frames):
+        if not read_raw_frame (stream, window.next_frame_buffer ()):
+            return
+        window.advance ()
+        yield window.ith_frame
+
+def median_background (stream, number_frames, frame_shape):
+    """
+    Read a burst of raw grey frames from a binary stream and return their per-pixel lower median.
+    The padding of the rows to a multiple of four bytes is dropped.
+    Raises ValueError if the stream ends before a frame is complete.
+    """
+    (height, width) = frame_shape
+    frames = numpy.empty ((number_frames, height, -(-width // 4) * 4), dtype = numpy.uint8)
+    number_read = 0
+    while number_read < number_frames and read_raw_frame (stream, frames [number_read]):
+        number_read += 1
+    if number_read == 0:
+        raise ValueError ('The camera did not capture any background frame')
+    middle = (number_read - 1) // 2
+    return numpy.ascontiguousarray (numpy.partition (frames [:number_read, :, :width], middle, axis = 0) [middle])
+
+def raw_video (filename, frame_shape):
+    """
+    Return a read-only memory map of a raw grey video with one byte per pixel and no padding.
+    Element i of the memory map is frame i + 1.  A partial frame at the end of the file is ignored.
+    """
+    frame_size = frame_shape [0] * frame_shape [1]
+    number_frames = os.path.getsize (filename) // frame_size
+    if number_frames == 0:
+        return numpy.zeros ((0,) + tuple (frame_shape), dtype = numpy.uint8)
+    return numpy.memmap (filename, dtype = numpy.uint8, mode = 'r', shape = (number_frames,) + tuple (frame_shape))
+
+def memory_mapped_frames (video, window, number_frames, box = None):
+    """
+    Generator that copies frames of a memory mapped raw video into a frame window, from the frame after its current frame, and yields the number of each frame.
+    If a box is given, only that part of the frames is copied.
+    """
+    (left, upper, right, lower) = box if box is not None else (0, 0, video.shape [2], video.shape [1])
+    for _ in xrange (number_frames):
+        if window.ith_frame >= len (video):
+            return
+        numpy.copyto (window.next_frame_buffer (), video [window.ith_frame, upper:lower, left:right])
+        window.advance ()
+        yield window.ith_frame
+
+# side, in full resolution pixels, of the window around the centre of each region-of-interest where the LED of its CASU is
+LED_WINDOW_SIDE = 15
+
+# robust z-score of the LED window brightness above which a frame shows a LED blip
+BLIP_THRESHOLD = 6.0
+
+class BlipDetector:
+    """
+    Measures the brightness of the CASU LEDs in the frames of an iteration video.
+    The LED of each CASU is in a small window around the centroid of its region-of-interest.
+    """
+    def __init__ (self, roi_index, window_side = LED_WINDOW_SIDE):
+        self.roi_index = roi_index
+        (height, width) = roi_index.shape
+        half_side = max (1, window_side // roi_index.scale) // 2
+        rows = roi_index.pixels // width
+        columns = roi_index.pixels % width
+        list_pixels = []
+        for index_ROI in xrange (roi_index.number_ROIs):
+            select = roi_index.labels == index_ROI
+            centre_row = int (round (rows [select].mean ()))
+            centre_column = int (round (columns [select].mean ()))
+            window_rows = numpy.arange (max (0, centre_row - half_side), min (height, centre_row + half_side + 1))
+            window_columns = numpy.arange (max (0, centre_column - half_side), min (width, centre_column + half_side + 1))
+            list_pixels.append ((window_rows [:, numpy.newaxis] * width + window_columns [numpy.newaxis, :]).ravel ())
+        self.pixels = numpy.concatenate (list_pixels)
+        self.labels = numpy.concatenate ([numpy.full (len (pixels), index_ROI, dtype = numpy.intp) for index_ROI, pixels in enumerate (list_pixels)])
+        self.areas = numpy.bincount (self.labels, minlength = roi_index.number_ROIs).astype (numpy.float64)
+
+    def brightness (self, frame):
+        """
+        Return the mean brightness of the LED window of each region-of-interest in the given frame.
+        """
+        values = self.roi_index.crop (frame).take (self.pixels)
+        return numpy.bincount (self.labels, weights = values, minlength = self.roi_index.number_ROIs) / self.areas
+
+def detect_blips (brightness, threshold = BLIP_THRESHOLD):
+    """
+    Return the list of the first and last frame of the intervals where the CASU LEDs blip.
+    Row i of the brightness array is frame i + 1, rows of frames that were not decoded are NaN.
+    A frame is a blip if the average robust z-score of the LED windows is above the threshold.
+    """
+    decoded = ~numpy.isnan (brightness).any (axis = 1)
+    if not decoded.any ():
+        return []
+    values = brightness [decoded]
+    median = numpy.median (values, axis = 0)
+    deviation = numpy.maximum (1.4826 * numpy.median (numpy.abs (values - median), axis = 0), 1.0)
+    blip = numpy.zeros (len (brightness), dtype = numpy.int8)
+    blip [decoded] = ((values - median) / deviation).mean (axis = 1) > threshold
+    edges = numpy.diff (numpy.concatenate (([0], blip, [0])))
+    return [(int (first_frame), int (last_frame)) for (first_frame, last_frame) in zip (numpy.flatnonzero (edges == 1) + 1, numpy.flatnonzero (edges == -1))]
 
 def bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active (config, active_roi_index, row):
     """
@@ -147,22 +553,89 @@ def percentage_bees_IF_bees_ONLY_IN_active (config, active_roi_index, row):
     column_active_background = active_roi_index  * 2
     return float (row [column_active_previous]) / row [column_active_background] if row [column_active_background] > config.pixel_count_background_threshold else 0
 
+# The following functions are the array forms of the functions above.
+# They take a matrix with one row per frame, with the same columns as the
+# rows given to the functions above, and return a vector with the value
+# of each frame.
+
+def bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active_array (config, active_roi_index, matrix):
+    active_background = matrix [:, active_roi_index * 2]
+    active_previous = matrix [:, active_roi_index * 2 + 1]
+    return numpy.where ((active_background > config.pixel_count_background_threshold) & (active_previous < config.pixel_count_previous_frame_threshold), active_background, 0)
+
+def frames_IF_no_movement_ONLY_IN_active_array (config, active_roi_index, matrix):
+    active_previous = matrix [:, active_roi_index * 2 + 1]
+    return (active_previous < config.pixel_count_previous_frame_threshold).astype (numpy.int64)
+
+def frames_IF_no_movement_IN_active_passive_array (config, active_roi_index, matrix):
+    active_previous = matrix [:, active_roi_index * 2 + 1]
+    passive_previous = matrix [:, (1 - active_roi_index) * 2 + 1]
+    return \
+        + (active_previous  < config.pixel_count_previous_frame_threshold).astype (numpy.int64) \
+        - (passive_previous < config.pixel_count_previous_frame_threshold).astype (numpy.int64)
+
+def bee_pixels_IF_bees_AND_no_movement_IN_active_passive_array (config, active_roi_index, matrix):
+    return \
+        + bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active_array (config, active_roi_index, matrix) \
+        - bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active_array (config, 1 - active_roi_index, matrix)
+
+def frames_IF_bees_AND_no_movement_IN_active_passive_array (config, active_roi_index, matrix):
+    """
+    The scalar form of this function adds one if there are bees and no
+    movement in the active CASU ROI, and only otherwise subtracts one if
+    there are bees and no movement in the passive CASU ROI.  This array form
+    gives the same values.
+    """
+    def bees_AND_no_movement (roi_index):
+        return \
+            (matrix [:, roi_index * 2]     > config.pixel_count_background_threshold) & \
+            (matrix [:, roi_index * 2 + 1] < config.pixel_count_previous_frame_threshold)
+    return numpy.where (bees_AND_no_movement (active_roi_index), 1, numpy.where (bees_AND_no_movement (1 - active_roi_index), -1, 0))
+
+def percentage_bees_IF_bees_ONLY_IN_active_array (config, active_roi_index, matrix):
+    active_background = matrix [:, active_roi_index * 2]
+    active_previous = matrix [:, active_roi_index * 2 + 1]
+    result = numpy.zeros (len (matrix))
+    numpy.true_divide (active_previous, active_background, out = result, where = active_background > config.pixel_count_background_threshold)
+    return result
+
 # unit of the image processing functions range
 UIPF_FRAME = 1
 UIPF_BEE_PIXEL = 2
 UIPF_PERCENTAGE = 3
 
 class Function:
-    def __init__ (self, function, code, description, minimum_number_ROIs, unit, range_minmax):
+    def __init__ (self, function, array_function, code, description, minimum_number_ROIs, unit, range_minmax):
         self.function = function
+        self.array_function = array_function
         self.code = code
         self.description = description
         self.minimum_number_ROIs = minimum_number_ROIs
         self.unit = unit
         self.range_minmax = range_minmax
+        self.range_length = range_minmax [1] - range_minmax [0]
+
+    def compute_array (self, config, active_roi_index, matrix, frame_mask):
+        """
+        Return the score of an evaluation.  The matrix has the pixel counts of each frame, and the frame mask selects the frames that are scored.
+        """
+        return self.array_function (config, active_roi_index, matrix) [frame_mask].sum ().item ()
+
+    def normalise (self, score, number_frames, roi_area):
+        """
+        Map the score of an evaluation to the interval [0, 1].
+        The score is averaged over the scored frames, bee pixels are divided by the area of the region-of-interest, and the result is scaled from the range of this function.
+        """
+        if number_frames == 0:
+            return 0.0
+        result = float (score) / number_frames
+        if self.unit == UIPF_BEE_PIXEL:
+            result /= roi_area
+        return (result - self.range_minmax [0]) / self.range_length
 
 F_m_a = Function (
     function = frames_IF_no_movement_ONLY_IN_active,
+    array_function = frames_IF_no_movement_ONLY_IN_active_array,
     code = 'F_m_a',
     description = 'calculates the number of frames where is no movement in the active CASU region of interest.',
     minimum_number_ROIs = 1,
@@ -170,6 +643,7 @@ F_m_a = Function (
     range_minmax = (0, 1))
 F_m_ap = Function (
     function = frames_IF_no_movement_IN_active_passive,
+    array_function = frames_IF_no_movement_IN_active_passive_array,
     code = 'F_m_ap',
     description = 'if in the current frame there is no movement in the active CASU region of interest, it adds one; if in the current frame there is no movement in the passive CASU region of interest, it subtracts one.',
     minimum_number_ROIs = 2,
@@ -177,6 +651,7 @@ F_m_ap = Function (
     range_minmax = (-1, 1))
 F_bm_ap = Function (
     function = frames_IF_bees_AND_no_movement_IN_active_passive,
+    array_function = frames_IF_bees_AND_no_movement_IN_active_passive_array,
     code = 'F_bm_ap',
     description = 'if in the current frame there is no movement and bees in the active CASU region of interest, it adds one; if in the current frame there is no movement and bees in the passive CASU region of interest, it subtracts one.',
     minimum_number_ROIs = 2,
@@ -184,6 +659,7 @@ F_bm_ap = Function (
     range_minmax = (-1, 1))
 B_bm_a = Function (
     function = bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active,
+    array_function = bee_pixels_IF_bees_AND_no_movement_ONLY_IN_active_array,
     code = 'B_bm_a',
     description = 'if in the current frame there is no movement and bees in the active CASU region of interest, it adds the bee pixels in this region of interest.',
     minimum_number_ROIs = 1,
@@ -191,6 +667,7 @@ B_bm_a = Function (
     range_minmax = (0, 1))
 B_bm_ap = Function (
     function = bee_pixels_IF_bees_AND_no_movement_IN_active_passive,
+    array_function = bee_pixels_IF_bees_AND_no_movement_IN_active_passive_array,
     code = 'B_bm_ap',
     description = 'if in the current frame there is no movement and bees in the active CASU region of interest, it adds the bee pixels in this region of interest; if in the current frame there is no movement and bees in the passive CASU region of interest, it subtracts the bee pixels in this region of interest.',
     minimum_number_ROIs = 2,
@@ -198,6 +675,7 @@ B_bm_ap = Function (
     range_minmax = (-1, 1))
 PB_m_a = Function (
     function = percentage_bees_IF_bees_ONLY_IN_active,
+    array_function = percentage_bees_IF_bees_ONLY_IN_active_array,
     code = '%B_m_a',
     description = 'if in the current frame there are bees, then it return the ratio between the number of pixels that are different from the previous frame over the number of pixels that are different from the background frame',
     minimum_number_ROIs = 1,
@@ -230,3 +708,118 @@ def compute (config, active_roi_index, iterator):
     for row in iterator:
         result += function (config, active_roi_index, row)
     return int (result)
+
+def compute_array (config, active_roi_index, matrix, frame_mask):
+    """
+    Array form of function compute.  The frame mask selects the rows of the matrix that are scored.
+    """
+    return int (STRING_2_OBJECT [config.image_processing_function].compute_array (config, active_roi_index, matrix, frame_mask))
+
+def compute_all_array (config, active_roi_index, matrix, frame_mask, roi_area, scale_factor = 1.0):
+    """
+    Return a list with the score and the normalised score of an evaluation computed by every function in FUNCTIONs.
+    Scores are multiplied by the scale factor.  Functions that need more regions-of-interest give None.
+    """
+    number_frames = numpy.count_nonzero (frame_mask) * scale_factor
+    result = []
+    for function in FUNCTIONs:
+        if function.minimum_number_ROIs > matrix.shape [1] // 2:
+            result.append ((None, None))
+        else:
+            score = function.compute_array (config, active_roi_index, matrix, frame_mask) * scale_factor
+            result.append ((score, function.normalise (score, number_frames, roi_area)))
+    return result
+
+def vibration_frame_mask (segments, number_frames):
+    """
+    Return a boolean vector that selects the frames of the vibration segments.
+    Element i corresponds to frame i + 1.
+    """
+    result = numpy.zeros (number_frames, dtype = bool)
+    for (first_frame, last_frame) in segments.vibration_frame_intervals (number_frames):
+        result [(first_frame - 1):last_frame] = True
+    return result
+
+def save_image_processing (filename, matrix):
+    """
+    Save the image processing data of an evaluation, a matrix with the pixel counts of each frame, in NumPy binary format.
+    """
+    numpy.save (filename, matrix)
+
+def load_image_processing (filename, mmap_mode = 'r'):
+    """
+    Load the image processing data of an evaluation.  By default the file is memory-mapped and read only.
+    """
+    return numpy.load (filename, mmap_mode = mmap_mode)
+
+def threshold_histograms (histograms, same_colour_threshold):
+    """
+    Return the pixel counts of the given cumulative difference histograms for a threshold between 0 and 255.
+    The last axis of the histograms is the threshold.
+    """
+    return histograms [..., same_colour_threshold].astype (numpy.int32)
+
+def save_difference_histograms (filename, histograms, matrix):
+    """
+    Save the cumulative difference histograms of the frames of an evaluation in compressed NumPy format.
+    The histograms are stored in the smallest unsigned type that holds the region-of-interest sizes.
+    The image processing data tells which frames and columns were compared.
+    """
+    with open (filename, 'wb') as fp:
+        numpy.savez_compressed (
+            fp,
+            histograms = histograms.astype (numpy.min_scalar_type (histograms.max ())),
+            compared = matrix >= 0)
+
+def load_difference_histograms (filename):
+    """
+    Load the cumulative difference histograms of an evaluation.
+    Returns a tuple with the histograms and the flags of the compared frames and columns.
+    """
+    data = numpy.load (filename)
+    return (data ['histograms'], data ['compared'])
+
+def rethreshold_image_processing (filename, same_colour_threshold):
+    """
+    Compute the image processing data of an evaluation for another colour threshold between 0 and 255 from its difference histograms.
+    Frames and columns that were not compared are -1, as in the image processing data.
+    """
+    (histograms, compared) = load_difference_histograms (filename)
+    result = threshold_histograms (histograms, same_colour_threshold)
+    result [~compared] = -1
+    return result
+
+def export_image_processing_csv (filename, csv_filename = None, header = None):
+    """
+    Export the image processing data of an evaluation to a CSV file.
+    By default, the CSV file name is the data file name with the extension csv,
+    and the header names the columns of each region-of-interest.
+    """
+    matrix = load_image_processing (filename)
+    if csv_filename is None:
+        csv_filename = os.path.splitext (filename) [0] + '.csv'
+    if header is None:
+        header = [
+            'ROI-%d_%s' % (index_ROI, column)
+            for index_ROI in xrange (matrix.shape [1] // 2)
+            for column in ['background', 'previous_iteration']]
+    with open (csv_filename, 'w') as fp:
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        f.writerow (header)
+        f.writerows (matrix.tolist ())
+    return csv_filename
+
+if __name__ == '__main__':
+    import sys
+    if len (sys.argv) == 1:
+        print ('Usage:\npython image_processing_functions.py IMAGE_PROCESSING_FILENAME.npy ...\nExport image processing data to CSV files.')
+        print ('python image_processing_functions.py --same-colour-threshold PERCENT DIFFERENCE_HISTOGRAMS_FILENAME.npz ...\nCompute image processing data for another colour threshold and export it to CSV files.')
+    if len (sys.argv) > 2 and sys.argv [1] == '--same-colour-threshold':
+        same_colour_threshold_int = int (float (sys.argv [2]) * 255 / 100)
+        for filename in sys.argv [3:]:
+            image_processing_filename = '%s_threshold-%d.npy' % (os.path.splitext (filename) [0], same_colour_threshold_int)
+            save_image_processing (image_processing_filename, rethreshold_image_processing (filename, same_colour_threshold_int))
+            print ('Exported %s' % (export_image_processing_csv (image_processing_filename)))
+    else:
+        for filename in sys.argv [1:]:
+            print ('Exported %s' % (export_image_processing_csv (filename)))
@@ -1,12 +1,57 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import bisect
+import copy
+import ctypes
+import ctypes.util
+import os
 import time
 
 SGT_VIBRATION  = 1
 SGT_AIRFLOW    = 2
 SGT_NO_STIMULI = 3
 
+# events of an evaluation schedule, events with the same deadline are executed in this order
+EVT_SEGMENT_END   = 0
+EVT_BLIP_OFF      = 1
+EVT_BLIP_ON       = 2
+EVT_SEGMENT_START = 3
+
+CLOCK_MONOTONIC = 1
+
+class _timespec (ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def _clock_gettime_monotonic ():
+    """
+    Return a function that reads the monotonic clock of the C library, or None if it is not available.
+    """
+    try:
+        librt = ctypes.CDLL (ctypes.util.find_library ('rt') or 'librt.so.1', use_errno = True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER (_timespec)]
+    def result ():
+        t = _timespec ()
+        if clock_gettime (CLOCK_MONOTONIC, ctypes.pointer (t)) != 0:
+            errno = ctypes.get_errno ()
+            raise OSError (errno, os.strerror (errno))
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return result
+
+# clock used to schedule the evaluation protocol, it is not affected by changes of the system time
+monotonic = getattr (time, 'monotonic', None) or _clock_gettime_monotonic () or time.time
+
+def sleep_until (deadline):
+    """
+    Sleep until the monotonic clock reaches the given deadline.  Returns immediately if the deadline has passed.
+    """
+    delay = deadline - monotonic ()
+    if delay > 0:
+        time.sleep (delay)
+
 class Segment:
     '''
     A segment has a dual role:
@@ -127,9 +172,127 @@ class Segments (list):
             current_frame = sgt.compute_first_last_frame (frames_per_second, current_frame)
             current_frame += 1 + (2 if has_blip else 0)
 
+    def schedule (self, frames_per_second, has_blip):
+        '''
+        Return the schedule of the evaluation protocol, a list of tuples with the deadline, in seconds from the start of the protocol, the event type and its segment.
+        Deadlines follow the first and last frames of the segments.
+        '''
+        result = []
+        blip_length = 2.0 / frames_per_second
+        for index, sgt in enumerate (self):
+            start = sgt.first_frame / float (frames_per_second)
+            end = (sgt.last_frame + 1) / float (frames_per_second)
+            result.append ((start, EVT_SEGMENT_START, sgt))
+            result.append ((end, EVT_SEGMENT_END, sgt))
+            if has_blip:
+                if index == 0:
+                    result.append ((0.0, EVT_BLIP_ON, None))
+                    result.append ((min (start, blip_length), EVT_BLIP_OFF, None))
+                next_start = self [index + 1].first_frame / float (frames_per_second) if index + 1 < len (self) else end + blip_length
+                result.append ((end, EVT_BLIP_ON, None))
+                result.append ((min (next_start, end + blip_length), EVT_BLIP_OFF, None))
+        result.sort (key = lambda event : (event [0], event [1]))
+        return result
+
+    def realign (self, frames_per_second, segment_starts):
+        '''
+        Return a copy of these segments whose first and last frames are shifted to the given actual start of each segment, in seconds relative to the start of the protocol.
+        The number of frames of each segment is kept.
+        '''
+        result = copy.copy (self)
+        for index, (sgt, start) in enumerate (zip (self, segment_starts)):
+            new_sgt = copy.copy (sgt)
+            shift = int (round (start * frames_per_second)) - sgt.first_frame
+            new_sgt.first_frame += shift
+            new_sgt.last_frame += shift
+            result [index] = new_sgt
+        return result
+
+    def retime (self, frame_numbers):
+        '''
+        Return a copy of these segments whose first and last frames are the captured frames that fall in each segment.
+        The given list has the nominal frame number of each captured frame, see function nominal_frame_numbers.
+        '''
+        result = copy.copy (self)
+        for index, sgt in enumerate (self):
+            new_sgt = copy.copy (sgt)
+            new_sgt.first_frame = bisect.bisect_left (frame_numbers, sgt.first_frame - 0.5) + 1
+            new_sgt.last_frame = bisect.bisect_left (frame_numbers, sgt.last_frame + 0.5)
+            result [index] = new_sgt
+        return result
+
+    def blip_frame_intervals (self):
+        '''
+        Return the frame intervals reserved for LED blips by method compute_first_last_frames: one before each segment and one after the last segment.
+        '''
+        result = []
+        previous_last_frame = -1
+        for sgt in self:
+            result.append ((previous_last_frame + 1, sgt.first_frame - 1))
+            previous_last_frame = sgt.last_frame
+        result.append ((previous_last_frame + 1, previous_last_frame + 2))
+        return result
+
+    def anchor_to_blips (self, blips, tolerance):
+        '''
+        Return a tuple with a copy of these segments anchored to the given LED blips and the blip matched to each interval of method blip_frame_intervals, or None.
+        A blip matches an interval if it starts at most tolerance frames away.  If only one blip of a segment is matched, its length is kept.
+        '''
+        matched = []
+        for (first_frame, _) in self.blip_frame_intervals ():
+            candidates = [blip for blip in blips if abs (blip [0] - first_frame) <= tolerance]
+            matched.append (min (candidates, key = lambda blip : abs (blip [0] - first_frame)) if len (candidates) > 0 else None)
+        result = copy.copy (self)
+        for index, sgt in enumerate (self):
+            new_sgt = copy.copy (sgt)
+            length = sgt.last_frame - sgt.first_frame
+            (before, after) = (matched [index], matched [index + 1])
+            if before is not None:
+                new_sgt.first_frame = before [1] + 1
+                new_sgt.last_frame = after [0] - 1 if after is not None else new_sgt.first_frame + length
+            elif after is not None:
+                new_sgt.last_frame = after [0] - 1
+                new_sgt.first_frame = new_sgt.last_frame - length
+            result [index] = new_sgt
+        return (result, matched)
+
     def total_number_frames (self):
         return self [-1].last_frame + 1
 
+    def vibration_frame_intervals (self, number_frames):
+        '''
+        Return a list of tuples with the first and last frame of each vibration segment.
+        Frames are numbered from one up to the given number of frames.
+        '''
+        result = []
+        for sgt in self:
+            if sgt.type == SGT_VIBRATION:
+                first_frame = max (1, sgt.first_frame)
+                last_frame = min (number_frames, sgt.last_frame)
+                if first_frame <= last_frame:
+                    result.append ((first_frame, last_frame))
+        return result
+
+    def decoded_frame_intervals (self, delta_frame, number_frames, blip_tolerance = None):
+        '''
+        Return the merged frame intervals that have to be decoded to analyse the vibration segments, including the delta_frame frames before each one.
+        If a blip tolerance is given, the blip intervals widened by that number of frames are also decoded.
+        '''
+        intervals = [(max (1, first_frame - delta_frame), last_frame) for (first_frame, last_frame) in self.vibration_frame_intervals (number_frames)]
+        if blip_tolerance is not None:
+            for (first_frame, last_frame) in self.blip_frame_intervals ():
+                first_frame = max (1, first_frame - blip_tolerance)
+                last_frame = min (number_frames, last_frame + blip_tolerance)
+                if first_frame <= last_frame:
+                    intervals.append ((first_frame, last_frame))
+        result = []
+        for (first_frame, last_frame) in sorted (intervals):
+            if len (result) > 0 and first_frame <= result [-1][1] + 1:
+                result [-1] = (result [-1][0], max (last_frame, result [-1][1]))
+            else:
+                result.append ((first_frame, last_frame))
+        return result
+
     def execute (self, casu, chromosome, has_blip, frames_per_second):
         def blip_casu ():
             casu.set_diagnostic_led_rgb (0.125, 0, 0)
@@ -177,6 +340,28 @@ class Segments (list):
 #         if has_blip:
 #             blip_casu ()
 
+def nominal_frame_numbers (timestamps, frames_per_second):
+    '''
+    Return the number that each captured frame would have if no frame was
+    dropped or duplicated, given the capture time stamps in seconds.  The
+    first frame is number one.  Numbers are not rounded.
+    '''
+    return [1 + (t - timestamps [0]) * frames_per_second for t in timestamps]
+
+def count_dropped_frames (timestamps, frames_per_second):
+    '''
+    Return a tuple with the number of dropped frames and the number of duplicated frames, given the capture time stamps in seconds.
+    '''
+    dropped = 0
+    duplicated = 0
+    for (t1, t2) in zip (timestamps, timestamps [1:]):
+        gap = int (round ((t2 - t1) * frames_per_second))
+        if gap < 1:
+            duplicated += 1
+        else:
+            dropped += gap - 1
+    return (dropped, duplicated)
+
 STRING_2_SEGMENT_TYPE = {
     'vibration'  : SGT_VIBRATION,
     'airflow'    : SGT_AIRFLOW,
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+import csv
+import os.path
+import threading
+import time
+import zmq
+
+import zmq_sock_utils
+
+# snapshots older than this, in seconds, are not used
+DEFAULT_MAX_AGE = 3.0
+
+# how long, in milliseconds, the monitor waits for a snapshot before checking if it should stop
+POLL_TIMEOUT = 500
+
+class Snapshot:
+    """
+    A telemetry snapshot published by a worker.
+    """
+    def __init__ (self, message, time_received):
+        self.casu_number = message [1]
+        self.time = message [2]
+        self.phase = message [3]
+        self.airflow_intensity = message [4]
+        self.wax_temperature = message [5]
+        self.temperatures = message [6]
+        self.time_received = time_received
+
+    def row (self):
+        return [self.time_received, self.casu_number, self.time, self.phase, self.airflow_intensity, self.wax_temperature, ' '.join (str (t) for t in self.temperatures)]
+
+    def __repr__ (self):
+        return '(#%d %s %.2f %s)' % (self.casu_number, self.phase, self.wax_temperature, str (self.temperatures))
+
+class TelemetryMonitor (threading.Thread):
+    """
+    Subscribes to the telemetry snapshots published by the workers and keeps the most recent snapshot of each CASU.
+    Every snapshot is recorded in a CSV file, so that the thermal behaviour of the CASUs can be analysed later.
+    Workers without a telemetry address are left out.
+    """
+    def __init__ (self, list_worker_settings, filename):
+        threading.Thread.__init__ (self, name = 'telemetry')
+        self.daemon = True
+        self.addresses = dict ([(ws.casu_number, ws.tel_addr) for ws in list_worker_settings if ws.tel_addr is not None])
+        self.filename = filename
+        self.lock = threading.Lock ()
+        self.snapshots = {}
+        self.keep_going = True
+
+    def attach (self, dict_workers_stubs):
+        """
+        Make the given worker stubs use this monitor to read the state of their CASUs.
+        """
+        for ws in dict_workers_stubs.values ():
+            if ws.casu_number in self.addresses:
+                ws.telemetry = self
+
+    def snapshot (self, casu_number, max_age = DEFAULT_MAX_AGE):
+        """
+        Return the most recent snapshot of the given CASU or None if there is no snapshot received in the last max_age seconds.
+        """
+        with self.lock:
+            result = self.snapshots.get (casu_number)
+        if result is None or time.time () - result.time_received > max_age:
+            return None
+        return result
+
+    def run (self):
+        socket = zmq.Context.instance ().socket (zmq.SUB)
+        socket.setsockopt (zmq.SUBSCRIBE, b'')
+        for address in self.addresses.values ():
+            socket.connect (address)
+        new_file = not os.path.exists (self.filename)
+        fp = open (self.filename, 'a')
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        if new_file:
+            f.writerow (["time_received", "casu_number", "time", "phase", "airflow_intensity", "wax_temperature", "temperatures"])
+        while self.keep_going:
+            if socket.poll (POLL_TIMEOUT) == 0:
+                continue
+            try:
+                message = zmq_sock_utils.recv (socket)
+            except zmq_sock_utils.ProtocolError as error:
+                print ('Invalid telemetry snapshot: %s' % (str (error)))
+                continue
+            if message [0] != zmq_sock_utils.TELEMETRY:
+                continue
+            a_snapshot = Snapshot (message, time.time ())
+            with self.lock:
+                self.snapshots [a_snapshot.casu_number] = a_snapshot
+            f.writerow (a_snapshot.row ())
+            fp.flush ()
+        fp.close ()
+        socket.close ()
+
+    def stop (self):
+        """
+        Stop receiving snapshots and close the record file.
+        """
+        self.keep_going = False
+        self.join ()
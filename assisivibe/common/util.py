@@ -31,6 +31,8 @@ GNUPLOT_BIN_FILENAME = find_app ("gnuplot")
 
 FFMPEG_BIN_FILENAME = find_app ("ffmpeg")
 
+FFPROBE_BIN_FILENAME = find_app ("ffprobe")
+
 AVCONV_BIN_FILENAME = find_app ("avconv")
 
 R_BIN_FILENAME = find_app ("R")
@@ -92,6 +94,17 @@ def open_csv_writer (filename):
     fwriter = csv.writer (fpw, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
     return (fpw, fwriter)
 
+def append_csv_rows (filename, header, rows):
+    '''
+    Append the given rows to a csv file.  The header row is written first if the file does not exist.
+    '''
+    new_file = not os.path.isfile (filename)
+    with open (filename, 'a') as fpa:
+        fwriter = csv.writer (fpa, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        if new_file:
+            fwriter.writerow (header)
+        fwriter.writerows (rows)
+
 def list_runs ():
     '''
     Return a list of the run numbers.  Each run number corresponds to folder named 'run-xxx'.
@@ -102,7 +115,45 @@ def list_runs ():
             run_number = int (filename [4:7])
             yield run_number
 
-def record_video (video_filename, number_frames, frames_per_second, crop_left, crop_right, crop_top, crop_bottom, debug = False):
+# number of frames that can be queued between the camera and the frame analysis when a recording is streamed
+STREAM_QUEUE_SIZE = 16
+
+# width and height of the thumbnails of the frames used to time their capture
+THUMBNAIL_SIZE = 16
+
+class CaptureFormat:
+    '''
+    A format in which the camera frames are stored: the video file name
+    extension and the GStreamer elements that encode and mux the frames.
+    '''
+    def __init__ (self, extension, elements, description):
+        self.extension = extension
+        self.elements = elements
+        self.description = description
+
+CAPTURE_FORMATS = {
+    'mjpeg' : CaptureFormat (
+        '.avi',
+        ['jpegenc', '!', 'avimux', 'name=mux', '!'],
+        'motion JPEG in AVI, lossy, frames can be decoded at reduced scale'),
+    'ffv1' : CaptureFormat (
+        '.mkv',
+        ['ffmpegcolorspace', '!', 'ffenc_ffv1', '!', 'matroskamux', '!'],
+        'FFV1 in Matroska, lossless, with capture time stamps'),
+    'raw' : CaptureFormat (
+        '.raw',
+        ['ffmpegcolorspace', '!', 'video/x-raw-gray,bpp=8,depth=8', '!'],
+        'raw grey frames, lossless, memory mapped without decoding'),
+    }
+
+def record_video (video_filename, number_frames, frames_per_second, crop_left, crop_right, crop_top, crop_bottom, debug = False, stream = False, capture_format = 'mjpeg', timestamps = False, clock_fd = None):
+    '''
+    Start a process that records a video from the camera.  The capture format is a key of CAPTURE_FORMATS.
+    If stream is true, the frames are also written to the standard output as raw grey images.
+    If timestamps is true, frame thumbnails are muxed in Matroska to keep their time stamps, see function timestamps_filename.
+    If clock_fd is given, a raw grey thumbnail of each frame is written to that file descriptor.
+    GStreamer pads raw grey rows to a multiple of four bytes, so the frame width should be a multiple of four.
+    '''
     command =  [
         GST_LAUNCH,
         '--gst-plugin-path=/usr/local/lib/gstreamer-0.10/',
@@ -112,10 +163,39 @@ def record_video (video_filename, number_frames, frames_per_second, crop_left, c
         'aravissrc', 'num-buffers=%d' % (number_frames), '!',
         'video/x-raw-yuv,width=2048,height=2048,framerate=%d/1' % (frames_per_second), '!',
         'videocrop', 'left=%d' % (crop_left), 'right=%d' % (crop_right), 'top=%d' % (crop_top), 'bottom=%d' % (crop_bottom), '!',
-        'jpegenc', '!',
-        'avimux', 'name=mux', '!',
+        ]
+    if stream or timestamps or clock_fd is not None:
+        command += [
+            'tee', 'name=t',
+            't.', '!', 'queue', 'max-size-buffers=%d' % (STREAM_QUEUE_SIZE), 'max-size-bytes=0', 'max-size-time=0', '!',
+            ]
+    command += CAPTURE_FORMATS [capture_format].elements + [
         'filesink', 'location=%s' % (video_filename)
         ]
+    if timestamps:
+        command += [
+            't.', '!', 'queue', 'max-size-buffers=%d' % (STREAM_QUEUE_SIZE), 'max-size-bytes=0', 'max-size-time=0', '!',
+            'videoscale', '!',
+            'video/x-raw-yuv,width=%d,height=%d' % (THUMBNAIL_SIZE, THUMBNAIL_SIZE), '!',
+            'matroskamux', '!',
+            'filesink', 'location=%s' % (timestamps_filename (video_filename))
+            ]
+    if clock_fd is not None:
+        command += [
+            't.', '!', 'queue', 'max-size-buffers=%d' % (STREAM_QUEUE_SIZE), 'max-size-bytes=0', 'max-size-time=0', '!',
+            'videoscale', '!',
+            'video/x-raw-yuv,width=%d,height=%d' % (THUMBNAIL_SIZE, THUMBNAIL_SIZE), '!',
+            'ffmpegcolorspace', '!',
+            'video/x-raw-gray,bpp=8,depth=8', '!',
+            'fdsink', 'fd=%d' % (clock_fd)
+            ]
+    if stream:
+        command += [
+            't.', '!', 'queue', 'max-size-buffers=%d' % (STREAM_QUEUE_SIZE), 'max-size-bytes=0', 'max-size-time=0', '!',
+            'ffmpegcolorspace', '!',
+            'video/x-raw-gray,bpp=8,depth=8', '!',
+            'fdsink', 'fd=1'
+            ]
     if debug:
         import arena
         print
@@ -124,7 +204,68 @@ def record_video (video_filename, number_frames, frames_per_second, crop_left, c
         print ('Full command is:')
         print (' '.join (command))
         print
-    return subprocess.Popen (command)
+    if stream:
+        return subprocess.Popen (command, stdout = subprocess.PIPE)
+    else:
+        return subprocess.Popen (command)
+
+def capture_frames (number_frames, frames_per_second, crop_left, crop_right, crop_top, crop_bottom):
+    '''
+    Start a process that captures frames from the camera and writes them to its standard output as raw grey images.
+    GStreamer pads raw grey rows to a multiple of four bytes.
+    '''
+    command =  [
+        GST_LAUNCH,
+        '--gst-plugin-path=/usr/local/lib/gstreamer-0.10/',
+        '--gst-plugin-load=libgstaravis-0.4.so',
+        '--quiet',
+        'aravissrc', 'num-buffers=%d' % (number_frames), '!',
+        'video/x-raw-yuv,width=2048,height=2048,framerate=%d/1' % (frames_per_second), '!',
+        'videocrop', 'left=%d' % (crop_left), 'right=%d' % (crop_right), 'top=%d' % (crop_top), 'bottom=%d' % (crop_bottom), '!',
+        'ffmpegcolorspace', '!',
+        'video/x-raw-gray,bpp=8,depth=8', '!',
+        'fdsink', 'fd=1'
+        ]
+    return subprocess.Popen (command, stdout = subprocess.PIPE)
+
+def probe_frame_timestamps (video_filename):
+    '''
+    Return the presentation time stamps, in seconds, of the frames of the
+    given video, as reported by ffprobe.  Containers without time stamps
+    per frame, such as AVI, report nominal time stamps.
+    '''
+    command = [
+        FFPROBE_BIN_FILENAME,
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time',
+        '-of', 'csv=p=0',
+        video_filename]
+    process = subprocess.Popen (command, stdout = subprocess.PIPE)
+    out, _ = process.communicate ()
+    return sorted ([float (line) for line in out.split () if line not in ['', 'N/A']])
+
+def timestamps_filename (video_filename):
+    '''
+    Return the name of the video with the capture time stamps of the frames of the given video.
+    '''
+    return os.path.splitext (video_filename) [0] + '-timestamps.mkv'
+
+def crop_filter (box, scale = 1):
+    '''
+    Return the ffmpeg video filter options that crop grey frames exactly to the given box (left, upper, right, lower) and reduce them by the given scale.
+    The box is in reduced coordinates.  Reduced pixels are the mean of blocks of scale by scale pixels, as in image_processing_functions.downsample.
+    '''
+    if box is None and scale == 1:
+        return []
+    filters = ['format=gray']
+    if box is not None:
+        (left, upper, right, lower) = [scale * coordinate for coordinate in box]
+        # without exact, ffmpeg rounds odd boxes to the chroma subsampling
+        filters.append ('crop=%d:%d:%d:%d:exact=1' % (right - left, lower - upper, left, upper))
+    if scale > 1:
+        filters.append ('scale=iw/%d:ih/%d:flags=area' % (scale, scale))
+    return ['-vf', ','.join (filters)]
 
 def split_video (video_filename, number_frames, frames_per_second, output_template):
     command = [
@@ -138,6 +279,29 @@ def split_video (video_filename, number_frames, frames_per_second, output_templa
         ]
     return subprocess.Popen (command)
 
+def stream_video (video_filename, number_frames, frames_per_second, first_frame = 1, box = None, scale = 1):
+    '''
+    Start a process that decodes the given video, from the given frame numbered from one, and writes its frames to the standard output as raw grey images.
+    If a box is given, only that part of the frames is written.
+    The scale can be 1, 2, 4 or 8, frames are reduced as given in function crop_filter and the box is in reduced coordinates.
+    '''
+    command = [FFMPEG_BIN_FILENAME]
+    if first_frame > 1:
+        # seek half a frame early so that rounding does not skip the first frame
+        command += ['-ss', '%f' % ((first_frame - 1.5) / frames_per_second)]
+    command += [
+        '-i', video_filename,
+        # frame rate conversion would duplicate the first frame after a seek
+        '-vsync', 'passthrough',
+        '-loglevel', 'error',
+        '-frames', '%d' % (number_frames),
+        ] + crop_filter (box, scale) + [
+        '-f', 'rawvideo',
+        '-pix_fmt', 'gray',
+        '-'
+        ]
+    return subprocess.Popen (command, stdout = subprocess.PIPE)
+
 def casu_freader (log_path, casu_number):
     '''
     Return an iterator that returns CSV rows of the given CASU logs.
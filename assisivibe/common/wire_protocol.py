@@ -0,0 +1,159 @@
+"""
+Encoding of the messages exchanged by the master and the workers.
+
+Messages are lists with the message type and its fields.  They are sent as
+multipart ZMQ messages: a header with the protocol version and the message
+type, and one frame per field encoded as given in MESSAGE_TYPES.
+"""
+
+import json
+import struct
+import time
+
+# version of the wire protocol, bump it whenever MESSAGE_TYPES or the field encodings change
+PROTOCOL_VERSION = 1
+
+# header frame: protocol version and message type
+HEADER = struct.Struct ('!BH')
+
+# field formats
+FLD_DOUBLE = 'd'
+FLD_INT = 'i'
+FLD_BOOL = '?'
+FLD_STRING = 's'
+FLD_INT_ARRAY = 'a'
+FLD_DOUBLE_ARRAY = 'A'
+FLD_JSON = 'j'
+
+# message types and the formats of their fields, the codes of the worker commands must match the ones in worker.py
+# trailing fields are optional
+MESSAGE_TYPES = {
+    1    : ('INITIALISE', [FLD_DOUBLE, FLD_JSON, FLD_BOOL, FLD_STRING]),   # frames per second, evaluation proceeding, has blip, chromosome type
+    4    : ('CASU_STATUS', [FLD_DOUBLE]),                                  # the reply contains the wax temperature
+    5    : ('ACTIVE_CASU', [FLD_INT_ARRAY, FLD_DOUBLE]),                   # chromosome, start time in the worker clock
+    6    : ('PASSIVE_CASU', [FLD_DOUBLE]),                                 # start time in the worker clock
+    8    : ('STANDBY_CASU', []),
+    10   : ('SPREAD_BEES', [FLD_DOUBLE]),                                  # duration
+    12   : ('CLOCK_SYNC', [FLD_DOUBLE]),                                   # the reply contains the worker clock
+    31   : ('TERMINATE', []),
+    1000 : ('WORKER_OK', [FLD_DOUBLE, FLD_DOUBLE_ARRAY]),                  # time when the vibration pattern started, actual start of each segment
+    1001 : ('PROTOCOL_ERROR', [FLD_STRING]),                               # reason
+    1002 : ('TELEMETRY', [FLD_INT, FLD_DOUBLE, FLD_STRING, FLD_DOUBLE, FLD_DOUBLE, FLD_DOUBLE_ARRAY]), # casu number, time, command phase, airflow intensity, wax temperature, temperature sensors
+}
+
+PROTOCOL_ERROR = 1001
+TELEMETRY = 1002
+
+class ProtocolError (ValueError):
+    """
+    Raised when a message cannot be encoded or decoded, either because of an unknown message type, wrong fields or a different protocol version.
+    """
+    pass
+
+def integers (values):
+    """
+    Return the given numbers as integers.  Genes read back from CSV files are floats, a number with a fractional part is refused rather than truncated.
+    """
+    result = [int (v) for v in values]
+    if result != list (values):
+        raise ValueError ('%s are not integers' % (str (values)))
+    return result
+
+def encode_field (fmt, value):
+    if fmt == FLD_STRING:
+        # text is a str or, in Python 2 only, a unicode, which is sent as UTF-8 like the JSON fields
+        return value.encode ('utf-8') if isinstance (value, unicode) else str (value)
+    elif fmt == FLD_INT_ARRAY:
+        return struct.pack ('!%di' % (len (value)), *integers (value))
+    elif fmt == FLD_DOUBLE_ARRAY:
+        return struct.pack ('!%dd' % (len (value)), *value)
+    elif fmt == FLD_JSON:
+        return json.dumps (value, separators = (',', ':'))
+    else:
+        return struct.pack ('!' + fmt, value)
+
+def decode_field (fmt, frame):
+    if fmt == FLD_STRING:
+        return frame
+    elif fmt == FLD_INT_ARRAY:
+        return list (struct.unpack ('!%di' % (len (frame) // 4), frame))
+    elif fmt == FLD_DOUBLE_ARRAY:
+        return list (struct.unpack ('!%dd' % (len (frame) // 8), frame))
+    elif fmt == FLD_JSON:
+        return json.loads (frame)
+    else:
+        return struct.unpack ('!' + fmt, frame) [0]
+
+def encode (data):
+    """
+    Return the list of frames of the given message.
+    """
+    message_type = data [0]
+    if message_type not in MESSAGE_TYPES:
+        raise ProtocolError ('Unknown message type %s' % (str (message_type)))
+    (name, formats) = MESSAGE_TYPES [message_type]
+    fields = data [1:]
+    if len (fields) > len (formats):
+        raise ProtocolError ('Message %s has at most %d field(s), got %d' % (name, len (formats), len (fields)))
+    try:
+        return [HEADER.pack (PROTOCOL_VERSION, message_type)] + [encode_field (fmt, value) for (fmt, value) in zip (formats, fields)]
+    except (struct.error, TypeError, ValueError) as error:
+        raise ProtocolError ('Invalid field in message %s: %s' % (name, str (error)))
+
+def decode (frames):
+    """
+    Return the message represented by the given list of frames.
+    """
+    try:
+        (version, message_type) = HEADER.unpack (frames [0])
+    except struct.error:
+        raise ProtocolError ('Invalid message header')
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError ('Protocol version %d is not supported, expecting version %d' % (version, PROTOCOL_VERSION))
+    if message_type not in MESSAGE_TYPES:
+        raise ProtocolError ('Unknown message type %d' % (message_type))
+    (name, formats) = MESSAGE_TYPES [message_type]
+    if len (frames) - 1 > len (formats):
+        raise ProtocolError ('Message %s has at most %d field(s), got %d' % (name, len (formats), len (frames) - 1))
+    try:
+        return [message_type] + [decode_field (fmt, frame) for (fmt, frame) in zip (formats, frames [1:])]
+    except (struct.error, ValueError) as error:
+        raise ProtocolError ('Invalid field in message %s: %s' % (name, str (error)))
+
+def check_reply (reply):
+    """
+    Return the given reply, or raise ProtocolError if it is a protocol error reported by a worker.
+    """
+    if reply [0] == PROTOCOL_ERROR:
+        raise ProtocolError ('Worker reported a protocol error: %s' % (reply [1] if len (reply) > 1 else 'no reason given'))
+    return reply
+
+def benchmark (repeats = 10000):
+    """
+    Compare the encoding and decoding latency and the size of typical messages with pickle.
+    """
+    import pickle
+    import timeit
+    messages = [
+        [1, 30, [{'type' : 'no stimuli', 'duration' : 20}, {'type' : 'vibration', 'duration' : 20}], True, 'SinglePulse1sGenesPulse'],
+        [5, [900, 300, 50], time.time ()],
+        [4],
+        [4, 28.3125],
+        [1000, time.time (), [0.0334, 20.0668, 40.1002]],
+        [1002, 1, time.time (), 'vibration segment', 0.0, 28.0625, [28.0, 28.125, 27.9375, 28.0625, 28.5, 31.25]],
+    ]
+    print ('%-28s %8s %8s %10s %10s %10s %10s' % ('message', 'size', 'pickle', 'encode', 'pickle', 'decode', 'unpickle'))
+    for data in messages:
+        frames = encode (data)
+        pickled = pickle.dumps (data, -1)
+        print ('%-28s %8d %8d %9.2fus %9.2fus %9.2fus %9.2fus' % (
+            MESSAGE_TYPES [data [0]][0],
+            sum ([len (frame) for frame in frames]),
+            len (pickled),
+            1e6 * timeit.timeit (lambda : encode (data), number = repeats) / repeats,
+            1e6 * timeit.timeit (lambda : pickle.dumps (data, -1), number = repeats) / repeats,
+            1e6 * timeit.timeit (lambda : decode (frames), number = repeats) / repeats,
+            1e6 * timeit.timeit (lambda : pickle.loads (pickled), number = repeats) / repeats))
+
+if __name__ == '__main__':
+    benchmark ()
@@ -5,6 +5,7 @@ from __future__ import print_function
 
 import os
 import stat
+import time
 import yaml
 import zmq
 
@@ -14,12 +15,18 @@ import assisipy.collect_data
 
 import zmq_sock_utils
 
+# number of times the worker clock is sampled to estimate its offset
+CLOCK_SYNC_SAMPLES = 8
+
 class WorkerSettings:
     """
     Worker settings used by the master program to deploy the workers.
     These settings specify the CASU that the worker will control,
     the ZMQ address where the worker will listen for commands from the master,
+    the ZMQ address where the worker publishes telemetry snapshots,
     and the parameters of the RTC file.
+    The telemetry address, key tel_addr, is optional.  Without it the worker
+    does not publish snapshots and the master asks for the CASU temperature.
     """
     def __init__ (self, dictionary):
         self.casu_number = dictionary ['casu_number']
@@ -27,17 +34,21 @@ class WorkerSettings:
         self.pub_addr    = dictionary ['pub_addr']
         self.sub_addr    = dictionary ['sub_addr']
         self.msg_addr    = dictionary ['msg_addr']
+        self.tel_addr    = dictionary.get ('tel_addr')
 
     def key (self):
         return 'casu-%03d' % (self.casu_number)
 
     def to_dep (self, controller, extra):
+        args = [str (self.casu_number), 'tcp://*:%s' % (self.wrk_addr.split (':') [2])]
+        if self.tel_addr is not None:
+            args.append ('tcp://*:%s' % (self.tel_addr.split (':') [2]))
         return (
             self.key () ,
             {
                 'controller' : controller
               , 'extra'      : extra
-              , 'args'       : [str (self.casu_number), 'tcp://*:%s' % (self.wrk_addr.split (':') [2])]
+              , 'args'       : args
               , 'hostname'   : self.wrk_addr.split (':') [1][2:]
               , 'user'       : 'assisi'
               , 'prefix'     : 'pedro/patvibe'
@@ -64,14 +75,35 @@ class WorkerSettings:
         return socket
 
     def __str__ (self):
-        return 'casu_number : %d , wrk_addr : %s , pub_addr : %s , sub_addr : %s , msg_addr : %s' % (
-            self.casu_number, self.wrk_addr, self.pub_addr, self.sub_addr, self.msg_addr)
+        return 'casu_number : %d , wrk_addr : %s , pub_addr : %s , sub_addr : %s , msg_addr : %s , tel_addr : %s' % (
+            self.casu_number, self.wrk_addr, self.pub_addr, self.sub_addr, self.msg_addr, self.tel_addr)
 
 class BasicWorkerStub:
-    def __init__ (self, casu_number, socket):
+    """
+    The master side of the connection with a worker.  The worker address is kept so that the socket can be reconnected.
+    If attribute telemetry is set, it is the telemetry monitor that receives the snapshots published by the worker.
+    Attributes clock_offset and clock_round_trip have the last estimate of the worker clock relative to the master clock, see function synchronise_clocks.
+    """
+    def __init__ (self, casu_number, socket, address = None):
         self.casu_number = casu_number
         self.socket = socket
+        self.address = address
         self.in_use = False
+        self.telemetry = None
+        self.clock_offset = None
+        self.clock_round_trip = None
+
+    def master_time (self, worker_time):
+        """
+        Convert an instant of the worker clock to the master clock.
+        """
+        return worker_time if self.clock_offset is None else worker_time - self.clock_offset
+
+    def worker_time (self, master_time):
+        """
+        Convert an instant of the master clock to the worker clock.
+        """
+        return master_time if self.clock_offset is None else master_time + self.clock_offset
 
     def key (self):
         return 'casu-%03d' % (self.casu_number)
@@ -79,6 +111,22 @@ class BasicWorkerStub:
     def __repr__ (self):
         return '(%d %s %s)' % (self.casu_number, self.socket.__repr__ (), self.in_use.__repr__ ())
 
+def synchronise_clocks (stubs, number_samples = CLOCK_SYNC_SAMPLES):
+    """
+    Estimate the clock offset of the given workers, as NTP does, and store it in their stubs.
+    All workers are sampled at once, and the sample with the shortest round trip of each worker is kept.
+    """
+    import worker
+    samples = [[] for _ in stubs]
+    for _ in xrange (number_samples):
+        times_received = [None] * len (stubs)
+        time_sent = time.time ()
+        replies = zmq_sock_utils.fan_out (stubs, [[worker.CLOCK_SYNC]] * len (stubs), reply_times = times_received)
+        for (ws_samples, reply, time_received) in zip (samples, replies, times_received):
+            ws_samples.append ((time_received - time_sent, reply [1] - (time_sent + time_received) / 2))
+    for (ws, ws_samples) in zip (stubs, samples):
+        (ws.clock_round_trip, ws.clock_offset) = min (ws_samples)
+
 def load_worker_settings (filename):
     """
     Return a list with the worker settings loaded from a file with the given name.
@@ -126,7 +174,7 @@ def connect_workers (list_worker_settings, worker_stub_constructor):
     Connect to workers and return a dictionary with each casu number associated with a worker stub.
     '''
     return dict (
-        [(ws.casu_number, worker_stub_constructor (ws.casu_number, ws.connect_to_worker ()))
+        [(ws.casu_number, worker_stub_constructor (ws.casu_number, ws.connect_to_worker (), ws.wrk_addr))
         for ws in list_worker_settings])
 
 def convert_dummy_workers_stub (list_worker_settings):
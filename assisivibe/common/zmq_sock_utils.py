@@ -4,19 +4,112 @@ Utility functions to send and receive data through ZMQ sockets.
 From the ZMQ Guide:
 
 ZeroMQ doesn't know anything about the data you send except its size in bytes. That means you are responsible for formatting it safely so that applications can read it back. Doing this for objects and complex data types is a job for specialized libraries like Protocol Buffers. But even for strings, you need to take care.
+
+The messages are encoded as given in module wire_protocol.
 """
 
-import pickle
+import time
+import zmq
+
+from wire_protocol import PROTOCOL_ERROR, TELEMETRY, ProtocolError, check_reply, decode, encode
+
+# how long, in milliseconds, to wait for a worker reply
+DEFAULT_TIMEOUT = 10000
+
+# how many times a request is sent again to a worker that did not reply
+DEFAULT_RETRIES = 3
+
+class WorkerTimeout (Exception):
+    """
+    Raised when workers do not reply to a request.  The stubs of these workers are in attribute stubs.
+    """
+    def __init__ (self, stubs):
+        Exception.__init__ (self, 'No reply from the worker(s) responsible for casu(s) %s' % (', '.join (['#%d' % (ws.casu_number) for ws in stubs])))
+        self.stubs = stubs
 
 def send (socket, data):
-    data_bytes = pickle.dumps (data, -1)
-    socket.send (data_bytes)
+    socket.send_multipart (encode (data))
 
 def recv (socket):
-    data_bytes = socket.recv ()
-    data = pickle.loads (data_bytes)
-    return data
+    return decode (socket.recv_multipart ())
 
 def send_recv (socket, data):
     send (socket, data)
-    return recv (socket)
+    return check_reply (recv (socket))
+
+def reconnect (stub):
+    """
+    Close the socket of a worker stub and connect a new one to the worker address, so that a worker that did not reply can be asked again.
+    """
+    stub.socket.setsockopt (zmq.LINGER, 0)
+    stub.socket.close ()
+    stub.socket = zmq.Context.instance ().socket (zmq.REQ)
+    stub.socket.connect (stub.address)
+
+def gather (stubs, timeout = DEFAULT_TIMEOUT, reply_times = None):
+    """
+    Receive a reply from each of the given worker stubs, waiting at most the given time in milliseconds.
+    Returns a tuple with the list of replies, None for the stubs that did not reply, and the list of these stubs.
+    If a list of reply times is given, the time each reply is received is stored in it.
+    Raises ProtocolError if a worker replied with a protocol error or an invalid message, after reconnecting the stubs still waiting for a reply.
+    """
+    poller = zmq.Poller ()
+    pending = {}
+    for index, ws in enumerate (stubs):
+        poller.register (ws.socket, zmq.POLLIN)
+        pending [ws.socket] = index
+    result = [None] * len (stubs)
+    deadline = time.time () + timeout / 1000.0
+    try:
+        while len (pending) > 0:
+            remaining = deadline - time.time ()
+            if remaining <= 0:
+                break
+            for (socket, _) in poller.poll (remaining * 1000):
+                index = pending.pop (socket)
+                poller.unregister (socket)
+                result [index] = recv (socket)
+                if reply_times is not None:
+                    reply_times [index] = time.time ()
+        for reply in result:
+            if reply is not None:
+                check_reply (reply)
+    except ProtocolError:
+        # the sockets still waiting for a reply cannot send again
+        for index in pending.values ():
+            reconnect (stubs [index])
+        raise
+    missing = [stubs [index] for index in sorted (pending.values ())]
+    return (result, missing)
+
+def fan_out (stubs, requests, timeout = DEFAULT_TIMEOUT, retries = DEFAULT_RETRIES, reply_times = None, verbose = False):
+    """
+    Send a request to each of the given worker stubs and return their replies, see function gather.
+    Workers that do not reply within the timeout are reconnected and asked again, as in the lazy pirate pattern of the ZMQ Guide.
+    Raises WorkerTimeout if they still do not reply after the given number of retries.  Retries are only reported if verbose is true.
+    """
+    for (ws, request) in zip (stubs, requests):
+        send (ws.socket, request)
+    result = [None] * len (stubs)
+    pending = range (len (stubs))
+    for attempt in xrange (retries + 1):
+        times = [None] * len (pending)
+        (replies, missing) = gather ([stubs [index] for index in pending], timeout, times)
+        still_pending = []
+        for (index, reply, reply_time) in zip (pending, replies, times):
+            if stubs [index] in missing:
+                still_pending.append (index)
+            else:
+                result [index] = reply
+                if reply_times is not None:
+                    reply_times [index] = reply_time
+        pending = still_pending
+        if len (pending) == 0:
+            return result
+        for index in pending:
+            reconnect (stubs [index])
+            if attempt < retries:
+                if verbose:
+                    print ('No reply from worker responsible for casu #%d, retrying...' % (stubs [index].casu_number))
+                send (stubs [index].socket, requests [index])
+    raise WorkerTimeout ([stubs [index] for index in pending])
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Compare the pixel counts computed at a reduced analysis scale with the
+# full resolution pixel counts stored by an experimental run.
+
+from __future__ import print_function
+
+import argparse
+import csv
+import numpy
+import os.path
+
+import assisivibe.common.image_processing_functions as image_processing_functions
+import assisivibe.common.util as util
+
+import config
+import evaluator
+
+COMPARISONS = ['background', 'previous']
+
+def parse_arguments ():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser (
+        description = 'Compare pixel counts at a reduced analysis scale with the full resolution pixel counts of a run.',
+        argument_default = None
+    )
+    parser.add_argument (
+        '--config',
+        default = 'config',
+        metavar = 'FILENAME',
+        type = str,
+        help = 'configuration file of the run')
+    parser.add_argument (
+        '--run',
+        required = True,
+        metavar = 'N',
+        type = int,
+        help = "run number to analyse")
+    parser.add_argument (
+        '--scale',
+        required = True,
+        type = int,
+        choices = image_processing_functions.ANALYSIS_SCALES [1:],
+        help = 'analysis scale to validate')
+    parser.add_argument (
+        '--output',
+        default = 'analysis-scale-report.csv',
+        metavar = 'FILENAME',
+        type = str,
+        help = 'CSV file where the report is written')
+    return parser.parse_args ()
+
+def scaled_image_processing (cfg, video_filename, img_path, background_filename, number_ROIs, number_frames, scale):
+    """
+    Compute the image processing data of an iteration video at the given analysis scale.
+    """
+    roi_index = image_processing_functions.ROIIndex.from_masks (
+        [image_processing_functions.load_grey_image ('%sMask-%d.jpg' % (img_path, index_ROI)) for index_ROI in xrange (number_ROIs)],
+        scale)
+    engine = image_processing_functions.PixelDifferenceEngine (
+        roi_index,
+        image_processing_functions.load_grey_image (background_filename, scale = scale),
+        int (cfg.same_colour_threshold * 255 / 100))
+    delta_frame = int (cfg.frames_per_second / cfg.interval_current_previous_frame)
+    window = image_processing_functions.FrameWindow (delta_frame, roi_index.shape)
+    result = numpy.full ((number_frames, 2 * number_ROIs), -1, dtype = numpy.int32)
+    process = util.stream_video (video_filename, number_frames, cfg.frames_per_second, box = roi_index.box, scale = scale)
+    evaluator.compare_frames_in_window (engine, window, process.stdout, number_frames, result, [True] * number_frames, 1)
+    process.stdout.close ()
+    process.wait ()
+    return result
+
+def report_rows (cfg, evaluation_row, full, scaled, scale):
+    """
+    Return the report rows of an evaluation, one per region-of-interest and comparison.
+    Scaled pixel counts are multiplied by the square of the scale, so that they are comparable with full resolution counts.
+    """
+    area = scale ** 2
+    full_background_threshold = cfg.parameters_as_dict ['pixel_count_background_threshold'].value
+    full_previous_threshold = cfg.parameters_as_dict ['pixel_count_previous_frame_threshold'].value
+    result = []
+    for column in xrange (full.shape [1]):
+        valid = (full [:, column] >= 0) & (scaled [:, column] >= 0)
+        full_counts = full [valid, column].astype (numpy.float64)
+        scaled_counts = scaled [valid, column].astype (numpy.float64)
+        if column % 2 == 0:
+            full_test = full_counts > full_background_threshold
+            scaled_test = scaled_counts > int (round (full_background_threshold / float (area)))
+        else:
+            full_test = full_counts < full_previous_threshold
+            scaled_test = scaled_counts < int (round (full_previous_threshold / float (area)))
+        scaled_counts *= area
+        number_frames = len (full_counts)
+        if number_frames > 1 and full_counts.std () > 0 and scaled_counts.std () > 0:
+            correlation = numpy.corrcoef (full_counts, scaled_counts) [0, 1]
+        else:
+            correlation = float ('nan')
+        mean_absolute_error = numpy.abs (scaled_counts - full_counts).mean () if number_frames > 0 else float ('nan')
+        result.append (evaluation_row [:(evaluator.EVA_SELECTED_ARENA + 1)] + [
+            column // 2,
+            COMPARISONS [column % 2],
+            number_frames,
+            full_counts.mean () if number_frames > 0 else float ('nan'),
+            scaled_counts.mean () if number_frames > 0 else float ('nan'),
+            mean_absolute_error,
+            correlation,
+            (full_test == scaled_test).mean () if number_frames > 0 else float ('nan')])
+    return result
+
+def main ():
+    args = parse_arguments ()
+    cfg = config.Config (args.config)
+    experiment_folder = 'run-%03d/' % (args.run)
+    with open (args.output, 'w') as fp:
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        f.writerow (["generation", "episode", "iteration", "selected_arena", "ROI", "comparison", "frames", "full_mean", "scaled_mean", "mean_absolute_error", "correlation", "threshold_agreement"])
+        for evaluation_row in util.load_csv (experiment_folder + "evaluation2.csv", True):
+            episode_path = '%sepisodes/%03d/' % (experiment_folder, int (evaluation_row [evaluator.EVA_EPISODE]))
+            iteration = int (evaluation_row [evaluator.EVA_ITERATION])
+            image_processing_filename = '%simage-processing_%d.npy' % (episode_path, iteration)
+            if not os.path.isfile (image_processing_filename):
+                # arenas evaluated with the same iteration video
+                image_processing_filename = '%simage-processing_%d_arena-%d.npy' % (episode_path, iteration, int (evaluation_row [evaluator.EVA_SELECTED_ARENA]))
+            if not os.path.isfile (image_processing_filename):
+                print ('Skipping %s, there is no full resolution image processing data' % (image_processing_filename))
+                continue
+            full = image_processing_functions.load_image_processing (image_processing_filename, None)
+            background_filename = episode_path + 'Background.png'
+            if not os.path.isfile (background_filename):
+                # runs made before the background image was stored losslessly
+                background_filename = episode_path + 'Background.jpg'
+            scaled = scaled_image_processing (
+                cfg,
+                '%siterationVideo_%d.avi' % (episode_path, iteration),
+                '%sarena-%d/' % (episode_path, int (evaluation_row [evaluator.EVA_SELECTED_ARENA])),
+                background_filename,
+                full.shape [1] // 2,
+                full.shape [0],
+                args.scale)
+            for row in report_rows (cfg, evaluation_row, full, scaled, args.scale):
+                f.writerow (row)
+            print ('Compared iteration %d of episode %s' % (iteration, episode_path))
+    print ('Report written to %s' % (args.output))
+
+if __name__ == '__main__':
+    main ()
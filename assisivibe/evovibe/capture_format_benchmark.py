@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Record the same number of frames from the camera in each capture format
+# and compare the disk bytes per evaluation, the capture CPU time and the
+# decode throughput of the matching frame reader.
+
+from __future__ import print_function
+
+import argparse
+import csv
+import io
+import os
+import os.path
+import resource
+import time
+
+import assisivibe.common.image_processing_functions as image_processing_functions
+import assisivibe.common.segments as segments
+import assisivibe.common.util as util
+
+import config
+
+def parse_arguments ():
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser (
+        description = 'Compare the disk usage, capture CPU time and decode throughput of the capture formats.',
+        argument_default = None
+    )
+    parser.add_argument (
+        '--config',
+        default = 'config',
+        metavar = 'FILENAME',
+        type = str,
+        help = 'configuration file with the video parameters')
+    parser.add_argument (
+        '--frames',
+        default = 300,
+        metavar = 'N',
+        type = int,
+        help = 'number of frames recorded in each format')
+    parser.add_argument (
+        '--folder',
+        default = 'tmp/',
+        metavar = 'PATH',
+        type = str,
+        help = 'folder where the videos are recorded')
+    parser.add_argument (
+        '--keep',
+        action = 'store_true',
+        help = 'keep the recorded videos')
+    parser.add_argument (
+        '--output',
+        default = 'capture-format-benchmark.csv',
+        metavar = 'FILENAME',
+        type = str,
+        help = 'CSV file where the benchmark is written')
+    return parser.parse_args ()
+
+def children_cpu_time ():
+    """
+    Return the user and system time, in seconds, used by the terminated child processes.
+    """
+    usage = resource.getrusage (resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def capture (cfg, capture_format, video_filename, number_frames):
+    """
+    Record a video in the given capture format and return a tuple with the wall time and the CPU time of the recording.
+    """
+    cpu_start = children_cpu_time ()
+    wall_start = time.time ()
+    process = util.record_video (video_filename, number_frames, cfg.frames_per_second, cfg.crop_left, cfg.crop_right, cfg.crop_top, cfg.crop_bottom, capture_format = capture_format)
+    process.wait ()
+    return (time.time () - wall_start, children_cpu_time () - cpu_start)
+
+def decode (cfg, capture_format, video_filename, number_frames):
+    """
+    Read every frame of a video with the frame reader of its capture format.
+    Returns a tuple with the number of frames read, the wall time and the CPU time of this process and of the decoder.
+    """
+    frame_shape = (cfg.image_height, cfg.image_width)
+    window = image_processing_functions.FrameWindow (1, frame_shape)
+    cpu_start = children_cpu_time () + time.clock ()
+    wall_start = time.time ()
+    if capture_format == 'raw':
+        video = image_processing_functions.raw_video (video_filename, frame_shape)
+        number_read = len (list (image_processing_functions.memory_mapped_frames (video, window, number_frames)))
+        del video
+    else:
+        process = util.stream_video (video_filename, number_frames, cfg.frames_per_second)
+        stream = io.open (process.stdout.fileno (), 'rb', closefd = False)
+        number_read = len (list (image_processing_functions.stream_frames (stream, window, number_frames)))
+        process.stdout.close ()
+        process.wait ()
+    return (number_read, time.time () - wall_start, children_cpu_time () + time.clock () - cpu_start)
+
+def main ():
+    args = parse_arguments ()
+    cfg = config.Config (args.config)
+    evaluation_segments = segments.Segments (cfg.evaluation_proceeding)
+    evaluation_segments.compute_first_last_frames (cfg.frames_per_second, cfg.has_blip)
+    frames_per_evaluation = evaluation_segments.total_number_frames ()
+    if not os.path.isdir (args.folder):
+        os.makedirs (args.folder)
+    with open (args.output, 'w') as fp:
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        f.writerow (["capture_format", "frames", "bytes", "bytes_per_evaluation", "capture_wall_time", "capture_cpu_time", "decoded_frames", "decode_wall_time", "decode_cpu_time", "decoded_frames_per_second"])
+        for capture_format in sorted (util.CAPTURE_FORMATS.keys ()):
+            video_filename = os.path.join (args.folder, 'benchmark' + util.CAPTURE_FORMATS [capture_format].extension)
+            print ('Recording %d frames in %s format...' % (args.frames, capture_format))
+            (capture_wall_time, capture_cpu_time) = capture (cfg, capture_format, video_filename, args.frames)
+            size = os.path.getsize (video_filename)
+            (decoded_frames, decode_wall_time, decode_cpu_time) = decode (cfg, capture_format, video_filename, args.frames)
+            f.writerow ([
+                capture_format,
+                args.frames,
+                size,
+                size * frames_per_evaluation // args.frames,
+                capture_wall_time,
+                capture_cpu_time,
+                decoded_frames,
+                decode_wall_time,
+                decode_cpu_time,
+                decoded_frames / decode_wall_time if decode_wall_time > 0 else float ('nan')])
+            print ('  %.1f MB per evaluation, %.1fs capture CPU, %.0f decoded frames per second' % (
+                size * frames_per_evaluation / float (args.frames) / 1e6,
+                capture_cpu_time,
+                decoded_frames / decode_wall_time if decode_wall_time > 0 else float ('nan')))
+            if not args.keep:
+                os.remove (video_filename)
+    print ('Benchmark written to %s' % (args.output))
+
+if __name__ == '__main__':
+    main ()
@@ -12,6 +12,7 @@ from assisivibe.common.best_config import ParameterIntBounded
 from assisivibe.common.best_config import ParameterSetValues
 import assisivibe.common.image_processing_functions as image_processing_functions
 import assisivibe.common.segments as segments
+import assisivibe.common.util as util
 
 import chromosome
 
@@ -63,6 +64,25 @@ class Config (best_config.Config):
                 parse_data = bool,
                 default_value = True,
                 path_in_dictionary = ['fitness_function']),
+            Parameter (
+                'concurrent_arenas',
+                'Evaluate chromosomes in every arena with a suitable temperature at the same time, with a single iteration video',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['fitness_function']),
+            Parameter (
+                'pipelined_evaluations',
+                'Analyse an evaluation while the next evaluation is running on the CASUs',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['fitness_function']),
+            ParameterIntBounded (
+                'synchronous_start_delay',
+                'Delay (in milliseconds) of the common instant when the CASUs and the iteration video start, after synchronising the worker clocks (0 starts them when asked)',
+                min_value = 0,
+                max_value = 10000,
+                path_in_dictionary = ['fitness_function'],
+                default_value = 0),
             ParameterIntBounded (
                 'interval_current_previous_frame',
                 'Time interval (in seconds) between compared frames',
@@ -88,6 +108,51 @@ class Config (best_config.Config):
                 max_value = 100,
                 default_value = 25,
                 path_in_dictionary = ['fitness_function', 'image_processing']),
+            Parameter (
+                'selective_frame_decoding',
+                'Only decode the frames of vibration segments and the frames they are compared with',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            Parameter (
+                'blip_alignment',
+                'Detect the LED blips in the iteration video and anchor the segments to them',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            Parameter (
+                'difference_histograms',
+                'Save the histograms of pixel differences of each frame so that other colour thresholds can be applied later',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            ParameterIntBounded (
+                'frame_stride',
+                'Compare only every k-th frame of the vibration segments',
+                min_value = 1,
+                max_value = None,
+                default_value = 1,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            ParameterIntBounded (
+                'stride_validation_period',
+                'Compare every frame in one out of this many evaluations to estimate the frame stride error (0 means never)',
+                min_value = 0,
+                max_value = None,
+                default_value = 10,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            ParameterIntBounded (
+                'frame_analysis_workers',
+                'Number of threads or processes that compare the frames of an iteration video',
+                min_value = 1,
+                max_value = None,
+                default_value = 1,
+                path_in_dictionary = ['fitness_function', 'image_processing']),
+            ParameterSetValues (
+                'frame_analysis_backend',
+                'How frame analysis workers run',
+                [('thread', 'threads of the master process'), ('process', 'separate processes')],
+                default_value = 'thread',
+                path_in_dictionary = ['fitness_function', 'image_processing']),
             ParameterSetValues (
                 'image_processing_function',
                 'Function used to process frames',
@@ -150,6 +215,31 @@ class Config (best_config.Config):
                 min_value = 0,
                 max_value = None,
                 path_in_dictionary = ['video']),
+            Parameter (
+                'streaming_analysis',
+                'Analyse the frames while the iteration video is being recorded',
+                parse_data = bool,
+                default_value = False,
+                path_in_dictionary = ['video']),
+            ParameterSetValues (
+                'frame_timestamps',
+                'How frames are mapped to segments',
+                [('nominal', 'by frame count, assuming no dropped frames'),
+                 ('capture', 'by capture time, read from the GStreamer buffer time stamps')],
+                default_value = 'nominal',
+                path_in_dictionary = ['video']),
+            ParameterSetValues (
+                'capture_format',
+                'Format in which the iteration videos are stored',
+                [(key, util.CAPTURE_FORMATS [key].description) for key in sorted (util.CAPTURE_FORMATS.keys ())],
+                default_value = 'mjpeg',
+                path_in_dictionary = ['video']),
+            ParameterSetValues (
+                'analysis_scale',
+                'Scale at which frames are decoded and compared',
+                [(scale, 'full resolution' if scale == 1 else '1/%d of the resolution' % (scale)) for scale in image_processing_functions.ANALYSIS_SCALES],
+                default_value = 1,
+                path_in_dictionary = ['video']),
             ParameterIntBounded (
                 'bee_area_pixels',
                 'Number of pixels occupied by a bee',
@@ -162,6 +252,20 @@ class Config (best_config.Config):
                 min_value = 0,
                 max_value = None,
                 path_in_dictionary = ['video']),
+            ParameterIntBounded (
+                'background_frames',
+                'Number of frames whose median is the background image',
+                min_value = 1,
+                max_value = None,
+                default_value = 15,
+                path_in_dictionary = ['video']),
+            ParameterIntBounded (
+                'background_refresh_interval',
+                'Number of evaluations between refreshes of the background image, which happen when there are no bees in the regions-of-interest (0 never refreshes it)',
+                min_value = 0,
+                max_value = None,
+                default_value = 0,
+                path_in_dictionary = ['video']),
             ])
         if os.path.isfile (filename):
             self.load_from_yaml_file (filename)
@@ -169,6 +273,26 @@ class Config (best_config.Config):
             self.ask_user ()
         self.crop_right = arena.CAMERA_RESOLUTION_X - self.image_width - self.crop_left
         self.crop_bottom = arena.CAMERA_RESOLUTION_Y - self.image_height - self.crop_top
+        if self.streaming_analysis and self.image_width % 4 != 0:
+            raise ValueError ('Streaming analysis requires an image width that is a multiple of four')
+        if self.streaming_analysis and self.analysis_scale > 1:
+            raise ValueError ('Streaming analysis requires full resolution analysis')
+        if self.capture_format == 'raw' and self.image_width % 4 != 0:
+            raise ValueError ('Raw capture format requires an image width that is a multiple of four')
+        if self.image_width % self.analysis_scale != 0 or self.image_height % self.analysis_scale != 0:
+            raise ValueError ('Reduced scale analysis requires an image size that is a multiple of the analysis scale')
+        if self.frame_stride > 1 and not (self.selective_frame_decoding or self.streaming_analysis):
+            raise ValueError ('A frame stride requires selective frame decoding or streaming analysis, otherwise every frame is still decoded')
+        if self.background_refresh_interval > 0 and self.pipelined_evaluations:
+            raise ValueError ('Background refresh cannot be used with pipelined evaluations')
+        if self.blip_alignment and not self.has_blip:
+            raise ValueError ('Blip alignment requires LED blips between segments')
+        # pixel counts at reduced analysis scale cover an area that is scale squared times smaller
+        if self.analysis_scale > 1:
+            area = float (self.analysis_scale ** 2)
+            self.pixel_count_background_threshold = int (round (self.parameters_as_dict ['pixel_count_background_threshold'].value / area))
+            self.pixel_count_previous_frame_threshold = int (round (self.parameters_as_dict ['pixel_count_previous_frame_threshold'].value / area))
+            self.bee_area_pixels = max (1, int (round (self.parameters_as_dict ['bee_area_pixels'].value / area)))
 
     def status (self):
         """
@@ -6,10 +6,10 @@ from __future__ import print_function
 import worker
 
 import assisivibe.common.arena as arena
+import assisivibe.common.image_processing_functions as image_processing_functions
 import assisivibe.common.util as util
 import assisivibe.common.zmq_sock_utils as zmq_sock_utils
 
-import subprocess
 import os
 import os.path
 import PySide.QtGui
@@ -49,6 +49,10 @@ class Episode:
         """
         print ("\n\n* New Episode *")
         self.current_path = "%sepisodes/%03d/" % (self.experiment_folder, self.episode_index)
+        # engines of the arena groups evaluated with the current background image
+        self.arena_group_engines = {}
+        # evaluation when the background image was last captured
+        self.background_evaluation = 1
 #        try:
         os.makedirs (self.current_path)
  #       except OSError:
@@ -78,7 +82,7 @@ class Episode:
         """
         Increment the evaluation counter.  If we have reached the end of an episode, we finish it and start a new episode.
         """
-        if (self.current_evaluation_in_episode == self.config.number_fitness_evaluations_per_episode):
+        if self.is_last_evaluation ():
             self.finish ()
             self.episode_index += 1
             self.initialise ()
@@ -86,29 +90,79 @@ class Episode:
         else:
             self.current_evaluation_in_episode += 1
 
+    def is_last_evaluation (self):
+        """
+        Return whether the current evaluation is the last one of the episode, in which case the next evaluation starts a new episode and prompts the user.
+        """
+        return self.current_evaluation_in_episode == self.config.number_fitness_evaluations_per_episode
+
     def make_background_image (self):
         """
-        Create the background video and image.
+        Create the background image.
 
-        These are used by the bee
+        This is used by the bee
         aggregation functions to compute how bees are stopped.  The
-        background video and images are created at start of an experiment
+        background image is created at start of an experiment
         and everytime we change bees.  Whenever we change bees, we may
         disturb the arena.  The bee aggregation is sensitive to changes between the background image and evaluation images.
+        The median of a burst of frames is stored in Background.png, with a copy in Background.jpg for the region-of-interest picker.
         """
         print ("\n* ** Creating background image...")
-        filename = self.current_path + 'Background.avi'
-        p = util.record_video (filename, 1, 1, self.config.crop_left, self.config.crop_right, self.config.crop_top, self.config.crop_bottom)
-        p.wait ()
-        bashCommandSplit = "ffmpeg" + \
-            " -i " + filename + \
-            " -r 0.1" + \
-            " -loglevel error" + \
-            " -f image2 " + self.current_path + "Background.jpg" #definition to extract the single image for background from the video
-        p = subprocess.Popen (bashCommandSplit, shell = True, executable = '/bin/bash') #run the script of the extracting
-        p.wait ()
+        self.save_background (self.current_path + 'Background.png', self.capture_background ())
         print ("     background image is ready")
 
+    def save_background (self, filename, background):
+        """
+        Save the background image in the given PNG file and its copy in Background.jpg.
+        """
+        image_processing_functions.save_grey_image (filename, background)
+        image_processing_functions.save_grey_image (self.current_path + 'Background.jpg', background)
+
+    def capture_background (self):
+        """
+        Capture a burst of frames from the camera and return their per-pixel median.
+        """
+        p = util.capture_frames (self.config.background_frames, self.config.frames_per_second, self.config.crop_left, self.config.crop_right, self.config.crop_top, self.config.crop_bottom)
+        try:
+            return image_processing_functions.median_background (p.stdout, self.config.background_frames, (self.config.image_height, self.config.image_width))
+        finally:
+            p.stdout.close ()
+            p.wait ()
+
+    def refresh_background (self):
+        """
+        Every background refresh interval, capture a new background image and use it if the regions-of-interest of every arena do not differ from the current one above the background threshold.
+        Returns whether the background image was refreshed.
+        """
+        if not self.background_refresh_due ():
+            return False
+        self.background_evaluation = self.current_evaluation_in_episode
+        print ("\n* ** Refreshing background image...")
+        background = self.capture_background ()
+        for an_arena in self.arenas:
+            if an_arena.analysis_scale > 1:
+                frame = image_processing_functions.downsample (background, an_arena.analysis_scale)
+            else:
+                frame = background
+            if max (an_arena.get_pixel_difference_engine ().compare (frame) [0::2]) > self.config.pixel_count_background_threshold:
+                print ("     There are bees in the regions-of-interest of arena #%d, keeping the background image." % (an_arena.index))
+                return False
+        filename = '%sBackground_%d.png' % (self.current_path, self.current_evaluation_in_episode)
+        self.save_background (filename, background)
+        for an_arena in self.arenas:
+            an_arena.set_background (filename)
+        self.arena_group_engines.clear ()
+        print ("     background image is refreshed")
+        return True
+
+    def background_refresh_due (self):
+        """
+        Return whether the background image is refreshed before the current evaluation.
+        The first evaluation of an episode uses the background image created at the start of the episode.
+        """
+        interval = self.config.background_refresh_interval
+        return interval > 0 and self.current_evaluation_in_episode - self.background_evaluation >= interval
+
     def ask_arenas (self):
         """
         Ask the user how many arenas are going to be used and their characteristics.
@@ -129,6 +183,7 @@ class Episode:
             self.app.exec_ ()
             os.makedirs (img_path)
             roi_picker.create_mask_images (img_path)
+            new_arena.compile_ROI_index ()
             roi_picker.create_region_of_interests_image (img_path)
             roi_picker.write_properties (img_path)
             new_arena.write_properties ()
@@ -146,8 +201,7 @@ class Episode:
         while not ok:
             status = []
             total_sum = 0
-            for index, an_arena in enumerate (self.arenas):
-                (value, temps) = an_arena.status ()
+            for index, (value, temps) in enumerate (arena.arenas_status (self.arenas)):
                 total_sum += value
                 status.append (value)
                 print ("     Arena #%d temperature status: %s." % (index + 1, str (temps)))
@@ -164,6 +218,24 @@ class Episode:
                 picked += 1
             print ("     Picked arena #%d." % (picked + 1))
         return self.arenas [picked]
+
+    def select_arenas (self):
+        """
+        Check the status of the arenas and select every arena whose temperature is suitable to run a vibration pattern.
+        Returns the list of selected arenas.
+        """
+        print ('\n* ** Checking Arena Temperature...')
+        while True:
+            result = []
+            for index, (an_arena, (value, temps)) in enumerate (zip (self.arenas, arena.arenas_status (self.arenas))):
+                print ("     Arena #%d temperature status: %s." % (index + 1, str (temps)))
+                if value > 0:
+                    result.append (an_arena)
+            if len (result) > 0:
+                print ("     Picked arena(s) %s." % (', '.join (['#%d' % (an_arena.index) for an_arena in result])))
+                return result
+            print ("     All arenas have a temperature above the minimum threshold!")
+            raw_input ("     Press ENTER to try again. ")
         
     def finish (self, end_evolutionary_algorithm = False):
         """
@@ -4,17 +4,24 @@
 from __future__ import print_function
 
 import time
-import subprocess #spawn new processes
 import csv
+import io
 import numpy
+import multiprocessing
+import multiprocessing.pool
+import os.path
 import random
 import sys
+import threading
+import traceback
 
 import assisipy
 
+import assisivibe.common.arena as arena
 import assisivibe.common.image_processing_functions as image_processing_functions
 import assisivibe.common.segments as segments
 import assisivibe.common.util as util
+import assisivibe.common.worker_settings as worker_settings
 
 import chromosome
 
@@ -38,6 +45,240 @@ PRT_EPISODE          = 1
 PRT_FITNESS          = 2
 PRT_CHROMOSOME_GENES = 3
 
+class Evaluation:
+    """
+    The data needed to analyse the iteration video of a chromosome evaluation after it has been recorded.
+    When several arenas share the iteration video, the file names of the image processing data have the arena index.
+    """
+    def __init__ (self, candidate, picked_arena, episode, generation_number, filename_real):
+        self.candidate = candidate
+        self.picked_arena = picked_arena
+        self.episode_index = episode.episode_index
+        self.evaluation_in_episode = episode.current_evaluation_in_episode
+        self.episode_path = episode.current_path
+        self.generation_number = generation_number
+        self.filename_real = filename_real
+        self.time_start_vibration_pattern = None
+        self.segment_starts = None
+        self.first_frame_offset = None
+        self.frame_timestamps = None
+        self.led_brightness = None
+        self.anchored_segments = None
+        self.image_processing = None
+        self.difference_histograms = None
+        self.full_rate = True
+        self.filename_suffix = ''
+
+    def image_processing_filename (self):
+        return self.episode_path + "image-processing_" + str (self.evaluation_in_episode) + self.filename_suffix + ".npy"
+
+    def difference_histograms_filename (self):
+        return self.episode_path + "difference-histograms_" + str (self.evaluation_in_episode) + self.filename_suffix + ".npz"
+
+    def frame_timestamps_filename (self):
+        return self.episode_path + "frame-timestamps_" + str (self.evaluation_in_episode) + self.filename_suffix + ".npy"
+
+    def timestamps_filename (self):
+        return util.timestamps_filename (self.filename_real)
+
+    def video_segment_starts (self):
+        """
+        Return the actual start of each segment, in seconds relative to the first frame of the iteration video if the offset of that frame to the start of the protocol is known, otherwise relative to the start of the protocol.
+        """
+        if self.first_frame_offset is None:
+            return self.segment_starts
+        return [start - self.first_frame_offset for start in self.segment_starts]
+
+class FrameChunk:
+    """
+    A part of an iteration video that is analysed by one task of the frame analysis backend.
+    Frames before the first frame only fill the frame window.  If the frame shape is given, the video is a raw grey video.
+    """
+    def __init__ (self, engine, filename_real, frames_per_second, delta_frame, first_decoded_frame, first_frame, last_frame, compared_frames, difference_histograms, blip_detector = None, frame_shape = None):
+        self.engine = engine
+        self.filename_real = filename_real
+        self.frames_per_second = frames_per_second
+        self.delta_frame = delta_frame
+        self.first_decoded_frame = first_decoded_frame
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.compared_frames = compared_frames
+        self.difference_histograms = difference_histograms
+        self.blip_detector = blip_detector
+        self.frame_shape = frame_shape
+
+def compare_frames_in_window (engine, window, pipe, number_frames, matrix, compared_frames, first_frame, difference_histograms = None, blip_detector = None, led_brightness = None):
+    """
+    Read raw grey frames from the given pipe into a frame window and compare the flagged ones.
+    Row i of the matrix, of the optional difference histograms and LED brightness, and element i of the compared frames correspond to frame first_frame + i.
+    Returns the number of frames read.
+    """
+    stream = io.open (pipe.fileno (), 'rb', closefd = False)
+    return compare_window_frames (
+        engine, window, image_processing_functions.stream_frames (stream, window, number_frames),
+        matrix, compared_frames, first_frame, difference_histograms, blip_detector, led_brightness)
+
+def compare_window_frames (engine, window, frame_numbers, matrix, compared_frames, first_frame, difference_histograms = None, blip_detector = None, led_brightness = None):
+    """
+    Compare the frames that the given iterator puts in a frame window.  The iterator yields the number of each frame after it is in the window.
+    See function compare_frames_in_window for the meaning of the other arguments.
+    Returns the number of frames compared or only decoded.
+    """
+    result = 0
+    for ith_frame in frame_numbers:
+        index = ith_frame - first_frame
+        if index >= 0 and blip_detector is not None:
+            led_brightness [index] = blip_detector.brightness (window.current_frame ())
+        if index >= 0 and compared_frames [index]:
+            if difference_histograms is None:
+                matrix [index] = engine.compare (window.current_frame (), window.previous_frame ())
+            else:
+                previous_frame = window.previous_frame ()
+                difference_histograms [index] = engine.difference_histograms (window.current_frame (), previous_frame)
+                matrix [index] = image_processing_functions.threshold_histograms (difference_histograms [index], engine.same_colour_threshold)
+                if previous_frame is None:
+                    matrix [index, 1::2] = -1
+        result += 1
+    return result
+
+def compare_frame_chunk (chunk):
+    """
+    Decode and compare the frames of a chunk, possibly in another process.
+    Returns a tuple with the image processing data, the difference histograms or None, the LED brightness or None, and the number of decoded frames.
+    """
+    engine = chunk.engine.clone ()
+    window = image_processing_functions.FrameWindow (chunk.delta_frame, engine.roi_index.shape)
+    window.restart (chunk.first_decoded_frame)
+    matrix = numpy.full ((chunk.last_frame - chunk.first_frame + 1, 2 * engine.roi_index.number_ROIs), -1, dtype = numpy.int32)
+    if chunk.difference_histograms:
+        difference_histograms = new_difference_histograms (len (matrix), engine.roi_index.number_ROIs)
+    else:
+        difference_histograms = None
+    if chunk.blip_detector is not None:
+        led_brightness = new_led_brightness (len (matrix), engine.roi_index.number_ROIs)
+    else:
+        led_brightness = None
+    number_frames = chunk.last_frame - chunk.first_decoded_frame + 1
+    if chunk.frame_shape is not None:
+        video = image_processing_functions.raw_video (chunk.filename_real, chunk.frame_shape)
+        frame_numbers = image_processing_functions.memory_mapped_frames (video, window, number_frames, engine.roi_index.box)
+        result = compare_window_frames (engine, window, frame_numbers, matrix, chunk.compared_frames, chunk.first_frame, difference_histograms, chunk.blip_detector, led_brightness)
+        del video
+        return (matrix, difference_histograms, led_brightness, result)
+    process = util.stream_video (chunk.filename_real, number_frames, chunk.frames_per_second, chunk.first_decoded_frame, engine.roi_index.box, engine.roi_index.scale)
+    result = compare_frames_in_window (engine, window, process.stdout, number_frames, matrix, chunk.compared_frames, chunk.first_frame, difference_histograms, chunk.blip_detector, led_brightness)
+    process.stdout.close ()
+    process.wait ()
+    return (matrix, difference_histograms, led_brightness, result)
+
+class StreamAnalysis (threading.Thread):
+    """
+    Thread that compares the frames streamed by the recording process.
+    If the analysis fails, the rest of the stream is drained so that the recording process does not block, and the error is raised by method check.
+    """
+    def __init__ (self, compare_frame_stream, evaluation, pipe):
+        threading.Thread.__init__ (self, name = 'stream-analysis')
+        self.compare_frame_stream = compare_frame_stream
+        self.evaluation = evaluation
+        self.pipe = pipe
+        self.error = None
+
+    def run (self):
+        try:
+            self.compare_frame_stream (self.evaluation, self.pipe)
+        except Exception as error:
+            traceback.print_exc ()
+            self.error = error
+            while self.pipe.read (io.DEFAULT_BUFFER_SIZE):
+                pass
+
+    def check (self):
+        """
+        Raise the error of the analysis, if any.
+        """
+        if self.error is not None:
+            raise self.error
+
+class FrameClock (threading.Thread):
+    """
+    Thread that reads the frame thumbnails written by the recording process to a pipe and keeps the time when the first one arrives.
+    """
+    def __init__ (self):
+        threading.Thread.__init__ (self, name = 'frame-clock')
+        self.daemon = True
+        (self.read_fd, self.write_fd) = os.pipe ()
+        self.first_frame_time = None
+
+    def run (self):
+        with io.open (self.read_fd, 'rb') as pipe:
+            if pipe.read (1):
+                self.first_frame_time = time.time ()
+            while pipe.read (io.DEFAULT_BUFFER_SIZE):
+                pass
+
+    def first_frame_offset (self, start_time):
+        """
+        Return how long after the given instant the first frame arrived, or None if either is unknown.
+        """
+        if self.first_frame_time is None or start_time is None:
+            return None
+        return self.first_frame_time - start_time
+
+def wait_until (instant):
+    """
+    Sleep until the given instant of the master clock.
+    """
+    delay = instant - time.time ()
+    if delay > 0:
+        time.sleep (delay)
+
+def wait_analyses (analyses):
+    """
+    Wait for the given analyses running in the background to finish, so that they do not print while the user is prompted.
+    Analyses that are None ran in the foreground.
+    """
+    for analysis in analyses:
+        if analysis is not None:
+            analysis.wait ()
+
+def new_led_brightness (number_frames, number_ROIs):
+    """
+    Return the array where the brightness of the CASU LEDs is stored, one row per frame.
+    Frames that are not decoded keep NaN values.
+    """
+    return numpy.full ((number_frames, number_ROIs), numpy.nan)
+
+def new_difference_histograms (number_frames, number_ROIs):
+    """
+    Return the difference histograms of frames before any frame is compared.
+    """
+    return numpy.zeros ((number_frames, 2 * number_ROIs, image_processing_functions.DIFFERENCE_LEVELS), dtype = numpy.uint32)
+
+class AnalysisPools:
+    """
+    Pools of threads or processes that compare the frames of an iteration video and analyse evaluations in the background.
+    They are created before the workers are connected and before the Qt application exists, so that no process is forked with their state.
+    """
+    def __init__ (self, config):
+        if config.frame_analysis_workers <= 1:
+            self.frame_analysis_pool = None
+        elif config.frame_analysis_backend == 'process':
+            self.frame_analysis_pool = multiprocessing.Pool (config.frame_analysis_workers)
+        else:
+            self.frame_analysis_pool = multiprocessing.pool.ThreadPool (config.frame_analysis_workers)
+        if config.pipelined_evaluations:
+            self.analysis_pool = multiprocessing.pool.ThreadPool (1)
+        else:
+            self.analysis_pool = None
+
+    def close (self):
+        """
+        Wait for the pending tasks and stop the pools.
+        """
+        for pool in [self.analysis_pool, self.frame_analysis_pool]:
+            if pool is not None:
+                pool.close ()
+                pool.join ()
 
 class Evaluator:
     """
@@ -52,7 +293,7 @@ class Evaluator:
 
     :param config: A Python object with the following attributes
     """
-    def __init__ (self, config, episode, experiment_folder, generation_number = 0):
+    def __init__ (self, config, episode, experiment_folder, pools, generation_number = 0):
         self.config = config
         self.episode = episode
         self.experiment_folder = experiment_folder
@@ -60,6 +301,26 @@ class Evaluator:
         self.segments = segments.Segments (config.evaluation_proceeding)
         self.segments.compute_first_last_frames (config.frames_per_second, config.has_blip)
         self.number_analysed_frames = self.segments.total_number_frames ()
+        # which frames, numbered from one, are compared
+        self.compared_frames = [not config.selective_frame_decoding] * (self.number_analysed_frames + 1)
+        if config.selective_frame_decoding:
+            for (first_frame, last_frame) in self.segments.vibration_frame_intervals (self.number_analysed_frames):
+                self.compared_frames [first_frame:(last_frame + 1)] = [True] * (last_frame - first_frame + 1)
+        self.vibration_frame_mask = image_processing_functions.vibration_frame_mask (self.segments, self.number_analysed_frames)
+        # with a frame stride, only every k-th frame of a vibration segment is compared, except in stride validation evaluations
+        self.strided_compared_frames = list (self.compared_frames)
+        self.strided_frame_mask = self.vibration_frame_mask
+        self.stride_scale_factor = 1.0
+        if config.frame_stride > 1:
+            self.strided_compared_frames = [False] * (self.number_analysed_frames + 1)
+            for (first_frame, last_frame) in self.segments.vibration_frame_intervals (self.number_analysed_frames):
+                for ith_frame in xrange (first_frame, last_frame + 1):
+                    self.strided_compared_frames [ith_frame] = (ith_frame - first_frame) % config.frame_stride == 0
+            self.strided_frame_mask = self.vibration_frame_mask & numpy.array (self.strided_compared_frames [1:], dtype = bool)
+            if self.strided_frame_mask.any ():
+                self.stride_scale_factor = float (numpy.count_nonzero (self.vibration_frame_mask)) / numpy.count_nonzero (self.strided_frame_mask)
+        self.number_evaluations = 0
+        self.stride_validation_errors = []
         # initialise the evaluation values reduce function
         self.EVALUATION_VALUES_REDUCE_FUNCTION = {
             'average'                             : self.evr_average ,
@@ -69,12 +330,17 @@ class Evaluator:
             'standard_deviation_weighted_average' : self.evr_standard_deviation_weighted_average }
         self._evaluation_values_reduce = self.EVALUATION_VALUES_REDUCE_FUNCTION ['average']
         # initialise the evaluation image processing function
-        self.image_processing_function = image_processing_functions.STRING_2_OBJECT [config.image_processing_function].function
+        self.image_processing_function = image_processing_functions.STRING_2_OBJECT [config.image_processing_function]
+        # frames of an iteration video can be compared by a pool of threads or processes
+        self.frame_analysis_pool = pools.frame_analysis_pool
+        # the analysis of an evaluation can run in the background while the next evaluation is running
+        self.analysis_pool = pools.analysis_pool
 
     def population_evaluator (self, candidates, args = None):
         """
         Evaluate a population.  This is the main method of this class and the one that is used by the evaluator function of the ES class of inspyred package.
         Chromosomes are evaluated in random order, even each fitness evaluation repetition.
+        Evaluations may be analysed while the next one runs, and may run concurrently in every suitable arena.
         """
         self.save_population (candidates)
         evaluation_sequence = []
@@ -84,8 +350,36 @@ class Evaluator:
         fitness_evaluations = []
         for _ in xrange (len (candidates)):
             fitness_evaluations.append ([])
-        for (index, chromosome) in evaluation_sequence:
-            fitness_evaluations [index].append (self.iteration_step (chromosome, len (fitness_evaluations [index])))
+        if self.config.concurrent_arenas:
+            pending_analyses = []
+            while len (evaluation_sequence) > 0:
+                if self.episode.is_last_evaluation ():
+                    wait_analyses ([analysis for (_, analysis, _) in pending_analyses])
+                (video_evaluation, evaluations) = self.run_concurrent_evaluations ([chromosome for (_, chromosome) in evaluation_sequence])
+                indexes = [index for (index, _) in evaluation_sequence [:len (evaluations)]]
+                evaluation_sequence = evaluation_sequence [len (evaluations):]
+                if self.analysis_pool is None:
+                    scores = self.analyse_concurrent_evaluations (video_evaluation, evaluations)
+                    pending_analyses.append ((indexes, None, scores))
+                else:
+                    pending_analyses.append ((indexes, self.analysis_pool.apply_async (self.analyse_concurrent_evaluations, (video_evaluation, evaluations)), None))
+            for (indexes, analysis, scores) in pending_analyses:
+                if analysis is not None:
+                    scores = analysis.get ()
+                for (index, score) in zip (indexes, scores):
+                    fitness_evaluations [index].append (score)
+        elif self.analysis_pool is None:
+            for (index, chromosome) in evaluation_sequence:
+                fitness_evaluations [index].append (self.iteration_step (chromosome, len (fitness_evaluations [index])))
+        else:
+            pending_analyses = []
+            for (index, chromosome) in evaluation_sequence:
+                if self.episode.is_last_evaluation ():
+                    wait_analyses ([analysis for (_, analysis) in pending_analyses])
+                evaluation = self.run_evaluation (chromosome)
+                pending_analyses.append ((index, self.analysis_pool.apply_async (self.analyse_evaluation, (evaluation,))))
+            for (index, analysis) in pending_analyses:
+                fitness_evaluations [index].append (analysis.get ())
         result = [self._evaluation_values_reduce (fe) for fe in fitness_evaluations]
         self.save_partial (candidates, result)
         print ('\n\n* End Of Generation *')
@@ -144,112 +438,513 @@ class Evaluator:
         """
         Experimental step where a candidate chromosome evaluation is done.
         """
+        return self.analyse_evaluation (self.run_evaluation (candidate))
+
+    def run_evaluation (self, candidate):
+        """
+        Run the vibration model of a candidate chromosome in an arena and record the iteration video.
+        In streaming analysis mode, frames are compared while the video is recorded.
+        Returns the evaluation data.
+        """
         c2s = chromosome.STRING_2_CLASS [self.config.chromosome_type].to_string (candidate)
         self.episode.increment_evaluation_counter ()
         print ("\n\n* Fitness Evaluation *\n  Episode %d - Evaluation %d" % (self.episode.episode_index, self.episode.current_evaluation_in_episode))
+        self.episode.refresh_background ()
         picked_arena = self.episode.select_arena ()
-        (recording_process, filename_real) = self.start_iteration_video ()
-        print ("     Starting vibration model: %s" % (c2s))
-        time_start_vibration_pattern = picked_arena.run_vibration_model (self.config, candidate)
+        start_time = self.synchronised_start_time ([picked_arena])
+        frame_clock = None
+        if start_time is not None:
+            print ("     Starting vibration model: %s" % (c2s))
+            picked_arena.start_vibration_model (self.config, candidate, start_time)
+            frame_clock = FrameClock ()
+            wait_until (start_time)
+        (recording_process, filename_real) = self.start_iteration_video (frame_clock)
+        evaluation = Evaluation (candidate, picked_arena, self.episode, self.generation_number, filename_real)
+        evaluation.full_rate = self.next_video_full_rate ()
+        if self.config.streaming_analysis:
+            analysis_thread = StreamAnalysis (self.compare_frame_stream, evaluation, recording_process.stdout)
+            analysis_thread.start ()
+        if start_time is None:
+            print ("     Starting vibration model: %s" % (c2s))
+            (evaluation.time_start_vibration_pattern, evaluation.segment_starts) = picked_arena.run_vibration_model (self.config, candidate)
+        else:
+            (evaluation.time_start_vibration_pattern, evaluation.segment_starts) = picked_arena.wait_vibration_model (self.config)
+            evaluation.first_frame_offset = frame_clock.first_frame_offset (evaluation.time_start_vibration_pattern)
+            self.write_clock_offsets (evaluation)
         print ("     Vibration model finished!")
+        if self.config.streaming_analysis:
+            analysis_thread.join ()
+            recording_process.stdout.close ()
         recording_process.wait ()
+        if frame_clock is not None:
+            frame_clock.join ()
+        if self.config.streaming_analysis:
+            analysis_thread.check ()
         print ("     Iteration video finished!")
-        self.split_iteration_video (filename_real)
-        self.compare_images (picked_arena)
-        evaluation_score = self.compute_evaluation (picked_arena)
-        self.write_evaluation (picked_arena, candidate, evaluation_score, time_start_vibration_pattern)
-        print ("\n  Evaluation of %s is %.1f" % (c2s, evaluation_score))
+        return evaluation
+
+    def run_concurrent_evaluations (self, candidates):
+        """
+        Run the vibration models of the first candidates in all the arenas with a suitable temperature and record a single iteration video.
+        Candidates are assigned to arenas in order, there are as many evaluations as arenas, candidates or evaluations left in the episode, whichever is smaller.
+        Each evaluation counts towards the episode.
+        Returns a tuple with the evaluation of the iteration video, whose arena is the group of selected arenas, and the list of the evaluations of each arena.
+        """
+        self.episode.increment_evaluation_counter ()
+        print ("\n\n* Fitness Evaluation *\n  Episode %d - Evaluation %d" % (self.episode.episode_index, self.episode.current_evaluation_in_episode))
+        self.episode.refresh_background ()
+        picked_arenas = self.episode.select_arenas ()
+        number_evaluations = min (len (candidates), self.config.number_fitness_evaluations_per_episode - self.episode.current_evaluation_in_episode + 1)
+        if len (picked_arenas) > number_evaluations:
+            picked_arenas = random.sample (picked_arenas, number_evaluations)
+        arena_group = arena.ArenaGroup (picked_arenas, self.episode.arena_group_engines)
+        start_time = self.synchronised_start_time (picked_arenas)
+        for (picked_arena, candidate) in zip (picked_arenas, candidates):
+            if start_time is not None:
+                print ("     Starting vibration model in arena #%d: %s" % (picked_arena.index, chromosome.STRING_2_CLASS [self.config.chromosome_type].to_string (candidate)))
+                picked_arena.start_vibration_model (self.config, candidate, start_time)
+        frame_clock = None
+        if start_time is not None:
+            frame_clock = FrameClock ()
+            wait_until (start_time)
+        (recording_process, filename_real) = self.start_iteration_video (frame_clock)
+        video_evaluation = Evaluation (None, arena_group, self.episode, self.generation_number, filename_real)
+        video_evaluation.full_rate = self.next_video_full_rate ()
+        evaluations = []
+        for (picked_arena, candidate) in zip (picked_arenas, candidates):
+            evaluation = Evaluation (candidate, picked_arena, self.episode, self.generation_number, filename_real)
+            evaluation.full_rate = video_evaluation.full_rate
+            evaluation.filename_suffix = '_arena-%d' % (picked_arena.index)
+            evaluation.evaluation_in_episode += len (evaluations)
+            evaluations.append (evaluation)
+        if self.config.streaming_analysis:
+            analysis_thread = StreamAnalysis (self.compare_frame_stream, video_evaluation, recording_process.stdout)
+            analysis_thread.start ()
+        if start_time is None:
+            for evaluation in evaluations:
+                print ("     Starting vibration model in arena #%d: %s" % (evaluation.picked_arena.index, chromosome.STRING_2_CLASS [self.config.chromosome_type].to_string (evaluation.candidate)))
+                evaluation.picked_arena.start_vibration_model (self.config, evaluation.candidate)
+        for evaluation in evaluations:
+            (evaluation.time_start_vibration_pattern, evaluation.segment_starts) = evaluation.picked_arena.wait_vibration_model (self.config)
+            if start_time is not None:
+                evaluation.first_frame_offset = frame_clock.first_frame_offset (evaluation.time_start_vibration_pattern)
+                self.write_clock_offsets (evaluation)
+        print ("     Vibration models finished!")
+        if self.config.streaming_analysis:
+            analysis_thread.join ()
+            recording_process.stdout.close ()
+        recording_process.wait ()
+        if frame_clock is not None:
+            frame_clock.join ()
+        if self.config.streaming_analysis:
+            analysis_thread.check ()
+        print ("     Iteration video finished!")
+        for _ in xrange (len (evaluations) - 1):
+            self.episode.increment_evaluation_counter ()
+        return (video_evaluation, evaluations)
+
+    def synchronised_start_time (self, arenas):
+        """
+        Estimate the clock offsets of the workers of the given arenas and return the instant, in the master clock, when the vibration patterns and the iteration video start.
+        Returns None if the start is not synchronised.
+        """
+        if self.config.synchronous_start_delay == 0:
+            return None
+        worker_settings.synchronise_clocks ([ws for an_arena in arenas for ws in an_arena.list_workers_stubs])
+        return time.time () + self.config.synchronous_start_delay / 1000.0
+
+    def next_video_full_rate (self):
+        """
+        Count a new iteration video and return whether every frame of it is compared, which happens in stride validation evaluations.
+        """
+        self.number_evaluations += 1
+        return self.config.frame_stride == 1 or \
+            (self.config.stride_validation_period > 0 and self.number_evaluations % self.config.stride_validation_period == 0)
+
+    def analyse_concurrent_evaluations (self, video_evaluation, evaluations):
+        """
+        Compare the images of an iteration video recorded with several arenas, and compute and save the score of each arena evaluation.
+        The frames are compared once for all the arenas.
+        Returns the list of evaluation scores.
+        """
+        if not self.config.streaming_analysis:
+            self.compare_images (video_evaluation)
+        self.load_frame_timestamps (video_evaluation)
+        result = []
+        for (evaluation, columns) in zip (evaluations, video_evaluation.picked_arena.column_slices ()):
+            evaluation.frame_timestamps = video_evaluation.frame_timestamps
+            evaluation.image_processing = video_evaluation.image_processing [:, columns]
+            if video_evaluation.difference_histograms is not None:
+                evaluation.difference_histograms = video_evaluation.difference_histograms [:, columns]
+            if video_evaluation.led_brightness is not None:
+                evaluation.led_brightness = video_evaluation.led_brightness [:, (columns.start // 2):(columns.stop // 2)]
+            result.append (self.score_evaluation (evaluation))
+        return result
+
+    def analyse_evaluation (self, evaluation):
+        """
+        Compare the images of an evaluation iteration video, compute the evaluation score and save it.
+        """
+        if not self.config.streaming_analysis:
+            self.compare_images (evaluation)
+        self.load_frame_timestamps (evaluation)
+        return self.score_evaluation (evaluation)
+
+    def load_frame_timestamps (self, evaluation):
+        """
+        Keep in the evaluation the capture time stamps of the frames of its iteration video, when frames are mapped to segments by capture time.
+        The time stamps are the GStreamer buffer time stamps kept in the companion time stamps video.
+        """
+        if self.config.frame_timestamps != 'capture':
+            return
+        if os.path.isfile (evaluation.timestamps_filename ()):
+            evaluation.frame_timestamps = util.probe_frame_timestamps (evaluation.timestamps_filename ())
+        if not evaluation.frame_timestamps:
+            print ("     There are no time stamps of the frames of %s, frames are mapped to segments by frame count." % (evaluation.filename_real))
+            evaluation.frame_timestamps = None
+
+    def score_evaluation (self, evaluation):
+        """
+        Save the image processing data of an evaluation, and compute and save its score.
+        """
+        self.write_image_processing (evaluation)
+        if evaluation.frame_timestamps is not None:
+            self.write_frame_timestamps (evaluation)
+        if evaluation.led_brightness is not None:
+            self.align_to_blips (evaluation)
+        evaluation_score = self.compute_evaluation (evaluation)
+        self.write_evaluation (evaluation, evaluation_score)
+        self.write_function_scores (evaluation)
+        c2s = chromosome.STRING_2_CLASS [self.config.chromosome_type].to_string (evaluation.candidate)
+        print ("\n  Evaluation of %s in arena #%d is %.1f" % (c2s, evaluation.picked_arena.index, evaluation_score))
         return evaluation_score
-                    
-    def start_iteration_video (self):
+
+    def start_iteration_video (self, frame_clock = None):
         """
         Starts the iteration video.  This video will record a chromosome evaluation and the bee spreading period.
 
+        In streaming analysis mode, the process also writes the frames to its standard output.
+        If a frame clock is given, it measures when the first frame arrives.
+
         :return: a tuple with the process that records the iteration the video filename
         """
         print ("\n* ** Starting Iteration Video...")
-        filename_real = self.episode.current_path + 'iterationVideo_' + str (self.episode.current_evaluation_in_episode) + '.avi'
-        p = util.record_video (filename_real, self.number_analysed_frames, self.config.frames_per_second, self.config.crop_left, self.config.crop_right, self.config.crop_top, self.config.crop_bottom)
+        filename_real = self.episode.current_path + 'iterationVideo_' + str (self.episode.current_evaluation_in_episode) + util.CAPTURE_FORMATS [self.config.capture_format].extension
+        p = util.record_video (filename_real, self.number_analysed_frames, self.config.frames_per_second, self.config.crop_left, self.config.crop_right, self.config.crop_top, self.config.crop_bottom, stream = self.config.streaming_analysis, capture_format = self.config.capture_format, timestamps = self.config.frame_timestamps == 'capture', clock_fd = None if frame_clock is None else frame_clock.write_fd)
+        if frame_clock is not None:
+            os.close (frame_clock.write_fd)
+            frame_clock.start ()
         return (p, filename_real)
 
 
-    def split_iteration_video (self, filename_real):
+    def compare_images (self, evaluation):
+        """
+        Compare images created in a chromosome evaluation and keep the image processing data in the evaluation.
+        The frames are split in chunks that are analysed by the frame analysis backend.
+        See method write_image_processing for the contents of the image processing data.
+        """
+        print ("\n* ** Comparing Images...")
+        evaluation.image_processing = self.new_image_processing_matrix (evaluation.picked_arena)
+        if self.config.difference_histograms:
+            evaluation.difference_histograms = new_difference_histograms (self.number_analysed_frames, evaluation.picked_arena.number_ROIs)
+        if self.config.blip_alignment:
+            evaluation.led_brightness = new_led_brightness (self.number_analysed_frames, evaluation.picked_arena.number_ROIs)
+        chunks = self.frame_chunks (evaluation)
+        if self.frame_analysis_pool is None:
+            results = map (compare_frame_chunk, chunks)
+        else:
+            results = self.frame_analysis_pool.map (compare_frame_chunk, chunks, 1)
+        number_decoded_frames = 0
+        for chunk, (matrix, difference_histograms, led_brightness, number_frames) in zip (chunks, results):
+            evaluation.image_processing [(chunk.first_frame - 1):chunk.last_frame] = matrix
+            if difference_histograms is not None:
+                evaluation.difference_histograms [(chunk.first_frame - 1):chunk.last_frame] = difference_histograms
+            if led_brightness is not None:
+                evaluation.led_brightness [(chunk.first_frame - 1):chunk.last_frame] = led_brightness
+            number_decoded_frames += number_frames
+        number_frames = sum ([chunk.last_frame - chunk.first_decoded_frame + 1 for chunk in chunks])
+        if number_decoded_frames < number_frames:
+            print ("     Iteration video only has %d frames out of %d!" % (number_decoded_frames, number_frames))
+        print ("     Finished comparing images from iteration " + str (evaluation.evaluation_in_episode) + " video.")
+
+    def frame_chunks (self, evaluation):
+        """
+        Split the frames of an evaluation iteration video that have to be decoded into chunks.
+        There are about as many chunks as frame analysis workers.
+        Each chunk also decodes the delta_frame frames before it, unless it starts an interval of decoded frames.
+        """
+        picked_arena = evaluation.picked_arena
+        delta_frame = picked_arena.delta_frame
+        if self.config.selective_frame_decoding:
+            intervals = self.segments.decoded_frame_intervals (delta_frame, self.number_analysed_frames, int (self.config.frames_per_second) if self.config.blip_alignment else None)
+        else:
+            intervals = [(1, self.number_analysed_frames)]
+        total_number_frames = sum ([last_frame - first_frame + 1 for (first_frame, last_frame) in intervals])
+        chunk_length = max (4 * delta_frame, -(-total_number_frames // self.config.frame_analysis_workers))
+        engine = picked_arena.get_pixel_difference_engine ()
+        compared_frames = self.evaluation_compared_frames (evaluation)
+        blip_detector = image_processing_functions.BlipDetector (engine.roi_index) if self.config.blip_alignment else None
+        frame_shape = (self.config.image_height, self.config.image_width) if self.config.capture_format == 'raw' else None
+        result = []
+        for (first_decoded_frame, last_decoded_frame) in intervals:
+            first_frame = first_decoded_frame
+            while first_frame <= last_decoded_frame:
+                last_frame = min (last_decoded_frame, first_frame + chunk_length - 1)
+                result.append (FrameChunk (
+                    engine, evaluation.filename_real, self.config.frames_per_second, delta_frame,
+                    max (first_decoded_frame, first_frame - delta_frame),
+                    first_frame,
+                    last_frame,
+                    compared_frames [first_frame:(last_frame + 1)],
+                    self.config.difference_histograms,
+                    blip_detector,
+                    frame_shape))
+                first_frame = last_frame + 1
+        return result
+
+    def compare_frame_stream (self, evaluation, pipe):
+        """
+        Compare the raw grey frames of a chromosome evaluation read from the given pipe and keep the image processing data in the evaluation.
+        In streaming analysis mode this method runs in a thread while the iteration video is recorded.
+        See method write_image_processing for the contents of the image processing data.
+        """
+        print ("\n* ** Comparing Images...")
+        picked_arena = evaluation.picked_arena
+        evaluation.image_processing = self.new_image_processing_matrix (picked_arena)
+        if self.config.difference_histograms:
+            evaluation.difference_histograms = new_difference_histograms (self.number_analysed_frames, picked_arena.number_ROIs)
+        engine = picked_arena.get_pixel_difference_engine ()
+        if self.config.blip_alignment:
+            blip_detector = image_processing_functions.BlipDetector (engine.roi_index)
+            evaluation.led_brightness = new_led_brightness (self.number_analysed_frames, picked_arena.number_ROIs)
+        else:
+            blip_detector = None
+        window = image_processing_functions.FrameWindow (picked_arena.delta_frame, (self.config.image_height, self.config.image_width))
+        number_decoded_frames = compare_frames_in_window (
+            engine, window, pipe, self.number_analysed_frames,
+            evaluation.image_processing, self.evaluation_compared_frames (evaluation) [1:], 1, evaluation.difference_histograms,
+            blip_detector, evaluation.led_brightness)
+        if number_decoded_frames < self.number_analysed_frames:
+            print ("     Iteration video only has %d frames out of %d!" % (number_decoded_frames, self.number_analysed_frames))
+        print ("     Finished comparing images from iteration " + str (evaluation.evaluation_in_episode) + " video.")
+
+    def evaluation_compared_frames (self, evaluation):
+        """
+        Return the flags of the frames, numbered from one, that are compared in the given evaluation.
         """
-        Split the iteration video into images.  We only need the images from the evaluation run time period.
+        if evaluation.full_rate:
+            return self.compared_frames
+        else:
+            return self.strided_compared_frames
 
-        The images are written in folder tmp relative to 
+    def new_image_processing_matrix (self, picked_arena):
         """
-        print ("\n* ** Starting Video Split...")
-        # bashCommandSplit = "avconv" + \
-        #                    " -i " + filename_real + \
-        #                    " -r " + str (self.config.frames_per_second) + \
-        #                    " -loglevel error" + \
-        #                    " -frames:v " + str (self.number_analysed_frames) + \
-        #                    " -f image2 tmp/iteration-image-%4d.jpg"
-        bashCommandSplit = "ffmpeg" + \
-                           " -i " + filename_real + \
-                           " -r " + str (self.config.frames_per_second) + \
-                           " -loglevel error" + \
-                           " -frames " + str (self.number_analysed_frames) + \
-                           " -f image2 tmp/iteration-frame-%4d.jpg"
-        p = subprocess.Popen (bashCommandSplit, shell=True, executable='/bin/bash') #to create and save the real images from the video depending on the iteration number
-        p.wait ()
-        print ("     Finished spliting iteration " + str (self.episode.current_evaluation_in_episode) + " video.")
+        Return the image processing data of an evaluation before any frame is compared.
+        This is an integer matrix with one row per frame.
+        Frames that are not compared keep pixel counts of -1.
+        """
+        return numpy.full ((self.number_analysed_frames, 2 * picked_arena.number_ROIs), -1, dtype = numpy.int32)
 
-    def compare_images (self, picked_arena):
+    def write_image_processing (self, evaluation):
         """
-        Compare images created in a chromosome evaluation and generate a CSV file.
+        Save the image processing data of an evaluation in NumPy binary format.
         The first column has the pixel difference between the current iteration image and the background image in the first CASU.
         The second column has the pixel difference between the current iteration image and the previous iteration image in the first CASU.
         The third column has the pixel difference between the current iteration image and the background image in the second CASU.
         The fourth column has the pixel difference between the current iteration image and the previous iteration image in the second CASU.
+
+        Function image_processing_functions.export_image_processing_csv converts this file to CSV.
+        Difference histograms, if computed, are saved in a companion file.
         """
-        print ("\n* ** Comparing Images...")
-        fp = open (self.episode.current_path + "image-processing_" + str (self.episode.current_evaluation_in_episode) + ".csv", 'w')
-        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-        f.writerow (picked_arena.image_processing_header ())
-        for i in xrange (1, self.number_analysed_frames + 1):
-            f.writerow (picked_arena.compare_frames (i))
-        fp.close ()
-        print ("     Finished comparing images from iteration " + str (self.episode.current_evaluation_in_episode) + " video.")
+        image_processing_functions.save_image_processing (evaluation.image_processing_filename (), evaluation.image_processing)
+        if evaluation.difference_histograms is not None:
+            image_processing_functions.save_difference_histograms (evaluation.difference_histograms_filename (), evaluation.difference_histograms, evaluation.image_processing)
 
-    def compute_evaluation (self, picked_arena):
+    def compute_evaluation (self, evaluation):
         '''
         Compute the evaluation of the current chromosome.
-        The fitness value depends on the image processing function. This function is applied to each processed frame.
-        
+        The fitness value depends on the image processing function. This function is applied to each processed frame of the vibration segments.
+        With a frame stride, the score of the compared frames is scaled up to all vibration frames.
+
         See method compare_images(self,arena) for information about how frames are processed.
         '''
-        result = 0
-        index_segment = 0
-        asegment = self.segments [index_segment]
-        with open (self.episode.current_path + "image-processing_" + str (self.episode.current_evaluation_in_episode) + ".csv", 'r') as fp:
-            freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-            freader.next () # skip header row
-            for index_frame in xrange (1, self.number_analysed_frames + 1):
-                row = freader.next ()
-                if asegment.last_frame < index_frame:
-                    index_segment += 1
-                    if index_segment < len (self.segments):
-                        asegment = self.segments [index_segment]
-                    else:
-                        break
-                if asegment.first_frame <= index_frame <= asegment.last_frame and asegment.type == segments.SGT_VIBRATION:
-                    result += self.image_processing_function (self.config, picked_arena.selected_region_of_interest_index, row)
+        active_roi_index = evaluation.picked_arena.selected_region_of_interest_index
+        (strided_frame_mask, stride_scale_factor) = self.scored_frames (evaluation, True)
+        strided_score = self.image_processing_function.compute_array (
+            self.config,
+            active_roi_index,
+            evaluation.image_processing,
+            strided_frame_mask) * stride_scale_factor
+        if self.config.frame_stride == 1:
+            # keep integer scores, the scale factor is one unless realigned frames were not compared
+            return int (round (strided_score))
+        if evaluation.full_rate:
+            result = self.image_processing_function.compute_array (
+                self.config,
+                active_roi_index,
+                evaluation.image_processing,
+                self.scored_frames (evaluation, False) [0])
+            self.stride_validation_errors.append (strided_score - result)
+            self.write_stride_validation (evaluation, result, strided_score)
+        else:
+            result = strided_score
+        if len (self.stride_validation_errors) > 0:
+            print ("     Frame stride %d error estimate is %.1f (root mean square of %d validation evaluations)" % (
+                self.config.frame_stride,
+                numpy.sqrt (numpy.mean (numpy.square (self.stride_validation_errors))),
+                len (self.stride_validation_errors)))
         return result
 
-    def write_evaluation (self, picked_arena, candidate, evaluation_score, time_start_vibration_pattern):
+    def scored_frames (self, evaluation, strided):
+        '''
+        Return a tuple with the mask of the vibration frames that are scored in an evaluation and the factor that scales their score up to all vibration frames.
+        Segments are anchored to the LED blips, or realigned with the segment starts reported by the worker when the start is synchronised and mapped by capture time, when these are known.
+        '''
+        realigned = evaluation.segment_starts is not None and self.config.synchronous_start_delay > 0
+        if evaluation.anchored_segments is None and not realigned and evaluation.frame_timestamps is None:
+            if strided:
+                return (self.strided_frame_mask, self.stride_scale_factor)
+            else:
+                return (self.vibration_frame_mask, 1.0)
+        if evaluation.anchored_segments is not None:
+            evaluation_segments = evaluation.anchored_segments
+        else:
+            evaluation_segments = self.segments
+            if realigned:
+                evaluation_segments = evaluation_segments.realign (self.config.frames_per_second, evaluation.video_segment_starts ())
+            if evaluation.frame_timestamps is not None:
+                evaluation_segments = evaluation_segments.retime (segments.nominal_frame_numbers (evaluation.frame_timestamps, self.config.frames_per_second))
+        vibration_frame_mask = image_processing_functions.vibration_frame_mask (evaluation_segments, self.number_analysed_frames)
+        compared_frames = self.strided_compared_frames if strided else self.evaluation_compared_frames (evaluation)
+        frame_mask = vibration_frame_mask & numpy.array (compared_frames [1:], dtype = bool)
+        if not frame_mask.any ():
+            return (frame_mask, 1.0)
+        return (frame_mask, float (numpy.count_nonzero (vibration_frame_mask)) / numpy.count_nonzero (frame_mask))
+
+    def write_function_scores (self, evaluation):
+        """
+        Save the scores of an evaluation computed by every image processing function, side by side with their normalised scores.
+        These scores do not drive evolution, they allow comparing the image processing functions without reprocessing the iteration videos.
+        """
+        picked_arena = evaluation.picked_arena
+        active_roi_index = picked_arena.selected_region_of_interest_index
+        (frame_mask, scale_factor) = self.scored_frames (evaluation, not evaluation.full_rate)
+        scores = image_processing_functions.compute_all_array (
+            self.config,
+            active_roi_index,
+            evaluation.image_processing,
+            frame_mask,
+            picked_arena.get_pixel_difference_engine ().roi_index.areas () [active_roi_index],
+            scale_factor)
+        header = ["generation", "episode", "iteration", "selected_arena", "active_casu"]
+        for function in image_processing_functions.FUNCTIONs:
+            header += [function.code, function.code + " normalised"]
+        row = [
+            evaluation.generation_number,
+            evaluation.episode_index,
+            evaluation.evaluation_in_episode,
+            picked_arena.index,
+            picked_arena.list_workers_stubs [active_roi_index].casu_number]
+        for (score, normalised_score) in scores:
+            row += [score, normalised_score]
+        util.append_csv_rows (self.experiment_folder + "function-scores.csv", header, [row])
+
+    def write_stride_validation (self, evaluation, evaluation_score, strided_score):
+        """
+        Save the score of a stride validation evaluation together with the score estimated from the strided frames.
+        """
+        util.append_csv_rows (
+            self.experiment_folder + "stride-validation.csv",
+            ["generation", "episode", "iteration", "frame_stride", "value", "strided_value", "error"],
+            [[
+                evaluation.generation_number,
+                evaluation.episode_index,
+                evaluation.evaluation_in_episode,
+                self.config.frame_stride,
+                evaluation_score,
+                strided_score,
+                strided_score - evaluation_score]])
+
+    def write_frame_timestamps (self, evaluation):
+        """
+        Save the capture time stamps of the frames of an evaluation in NumPy binary format, and report its dropped and duplicated frames.
+        """
+        numpy.save (evaluation.frame_timestamps_filename (), numpy.array (evaluation.frame_timestamps, dtype = numpy.float64))
+        (dropped, duplicated) = segments.count_dropped_frames (evaluation.frame_timestamps, self.config.frames_per_second)
+        if dropped > 0 or duplicated > 0:
+            print ("     Iteration video has %d dropped and %d duplicated frames." % (dropped, duplicated))
+        util.append_csv_rows (
+            self.experiment_folder + "dropped-frames.csv",
+            ["generation", "episode", "iteration", "selected_arena", "expected_frames", "captured_frames", "dropped_frames", "duplicated_frames"],
+            [[
+                evaluation.generation_number,
+                evaluation.episode_index,
+                evaluation.evaluation_in_episode,
+                evaluation.picked_arena.index,
+                self.number_analysed_frames,
+                len (evaluation.frame_timestamps),
+                dropped,
+                duplicated]])
+
+    def align_to_blips (self, evaluation):
+        """
+        Detect the LED blips in the iteration video of an evaluation and anchor the vibration segments to them.
+        A blip is matched to the nominal blip frames if it starts at most one second away.
+        The nominal and anchored frames of each segment are saved, so that the alignment can be checked.
+        """
+        blips = image_processing_functions.detect_blips (evaluation.led_brightness)
+        (evaluation.anchored_segments, matched) = self.segments.anchor_to_blips (blips, int (self.config.frames_per_second))
+        number_matched = len ([blip for blip in matched if blip is not None])
+        if number_matched < len (matched):
+            print ("     Only %d LED blips out of %d were found in the iteration video." % (number_matched, len (matched)))
+        util.append_csv_rows (
+            self.experiment_folder + "blip-alignment.csv",
+            ["generation", "episode", "iteration", "selected_arena", "segment", "nominal_first_frame", "nominal_last_frame", "anchored_first_frame", "anchored_last_frame", "blips_detected", "blips_expected"],
+            [[
+                evaluation.generation_number,
+                evaluation.episode_index,
+                evaluation.evaluation_in_episode,
+                evaluation.picked_arena.index,
+                index,
+                nominal.first_frame,
+                nominal.last_frame,
+                anchored.first_frame,
+                anchored.last_frame,
+                len (blips),
+                len (matched)]
+             for index, (nominal, anchored) in enumerate (zip (self.segments, evaluation.anchored_segments))])
+
+    def write_clock_offsets (self, evaluation):
+        """
+        Save the clock offsets of the workers of an evaluation arena that were used to start the evaluation.
+        """
+        util.append_csv_rows (
+            self.experiment_folder + "clock-offsets.csv",
+            ["generation", "episode", "iteration", "selected_arena", "casu_number", "clock_offset", "round_trip", "first_frame_offset"],
+            [[
+                evaluation.generation_number,
+                evaluation.episode_index,
+                evaluation.evaluation_in_episode,
+                evaluation.picked_arena.index,
+                ws.casu_number,
+                ws.clock_offset,
+                ws.clock_round_trip,
+                evaluation.first_frame_offset]
+             for ws in evaluation.picked_arena.list_workers_stubs])
+
+    def write_evaluation (self, evaluation, evaluation_score):
         """
         Save the result of a chromosome evaluation.
         """
         with open (self.experiment_folder + "evaluation2.csv", 'a') as fp:
             f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+            picked_arena = evaluation.picked_arena
             f.writerow ([
-                self.generation_number,
-                self.episode.episode_index,
-                self.episode.current_evaluation_in_episode,
+                evaluation.generation_number,
+                evaluation.episode_index,
+                evaluation.evaluation_in_episode,
                 picked_arena.index,
                 picked_arena.list_workers_stubs [picked_arena.selected_region_of_interest_index].casu_number,
-                time_start_vibration_pattern,
-                evaluation_score] + candidate)
+                evaluation.time_start_vibration_pattern,
+                evaluation_score] + evaluation.candidate)
             fp.close ()
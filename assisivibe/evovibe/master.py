@@ -17,6 +17,7 @@ import random
 import subprocess
 
 import assisivibe.common.arena as arena
+import assisivibe.common.telemetry as telemetry
 import assisivibe.common.util as util
 import assisivibe.common.worker_settings as worker_settings
 import assisivibe.common.zmq_sock_utils as zmq_sock_utils
@@ -28,27 +29,17 @@ FIT_FITNESS = 1
 FIT_CHROMOSOME_GENES = 2
 
 class EvovibeWorkerStub (worker_settings.BasicWorkerStub):
-    def __init__ (self, casu_number, socket):
-        worker_settings.BasicWorkerStub.__init__ (self, casu_number, socket)
+    def __init__ (self, casu_number, socket, address = None):
+        worker_settings.BasicWorkerStub.__init__ (self, casu_number, socket, address)
 
-    def initialise (self, config):
-        print ("Initializing worker responsible for casu #%d..." % (self.casu_number))
-        answer = zmq_sock_utils.send_recv (self.socket, [
+    @staticmethod
+    def initialise_request (config):
+        return [
             worker.INITIALISE,
             config.frames_per_second,
             config.evaluation_proceeding,
             config.has_blip,
-            config.chromosome_type])
-        print ("Worker responded with: %s" % (str (answer)))
-        return (self.casu_number, self)
-
-    def terminate_session (self):
-        """
-        Terminate the session with the worker, which causes the worker process to finish.
-        """
-        print ("Sending terminate command to worker responsible for casu #%d..." % (self.casu_number))
-        answer = zmq_sock_utils.send_recv (self.socket, [worker.TERMINATE])
-        print ("Worker responded with: %s" % (str (answer)))
+            config.chromosome_type]
 
 def parse_arguments ():
     """
@@ -225,10 +216,10 @@ def user_termination (population, num_generations, num_evaluations, args):
     print ('  Generation %d has finished.' % (num_generations))
     return util.is_answer_yes ('  Do you want to terminate the program')
 
-def initialise_data_for_inspyred (config, worker_stubs, experiment_folder, current_generation = 0, episode_index = 1):
+def initialise_data_for_inspyred (config, worker_stubs, experiment_folder, pools, current_generation = 0, episode_index = 1):
     epsd = episode.Episode (config, worker_stubs, experiment_folder, episode_index)
     epsd.initialise ()
-    evltr = evaluator.Evaluator (config, epsd, experiment_folder, current_generation)
+    evltr = evaluator.Evaluator (config, epsd, experiment_folder, pools, current_generation)
     evolutionary_algorithm = inspyred.ec.ES (random.Random ())
     evolutionary_algorithm.terminator = [inspyred.ec.terminators.generation_termination, user_termination]
     evolutionary_algorithm.observer = [fitness_save_observer]
@@ -236,8 +227,8 @@ def initialise_data_for_inspyred (config, worker_stubs, experiment_folder, curre
     generator = chromosome.CHROMOSOME_METHODS [config.chromosome_type].generator
     return (epsd, evltr, evolutionary_algorithm, generator)
 
-def new_run (config, worker_stubs, experiment_folder):
-    epsd, evltr, evolutionary_algorithm, generator = initialise_data_for_inspyred (config, worker_stubs, experiment_folder)
+def new_run (config, worker_stubs, experiment_folder, pools):
+    epsd, evltr, evolutionary_algorithm, generator = initialise_data_for_inspyred (config, worker_stubs, experiment_folder, pools)
     evolutionary_algorithm.evolve (
         generator = generator,
         evaluator = evltr.population_evaluator,
@@ -251,7 +242,7 @@ def new_run (config, worker_stubs, experiment_folder):
     terminate_workers_get_data (worker_stubs, experiment_folder)
     print ("Evolutionary Strategy algorithm finished!")
 
-def continue_run (config, worker_stubs, experiment_folder):
+def continue_run (config, worker_stubs, experiment_folder, pools):
     number_genes = len (chromosome.CHROMOSOME_METHODS [config.chromosome_type].get_genes ())
     rows_partial = util.load_csv (experiment_folder + "partial2.csv", True)
     rows_fitness = util.load_csv (experiment_folder + "fitness2.csv", True)
@@ -290,7 +281,7 @@ def continue_run (config, worker_stubs, experiment_folder):
     # report and GO
     report_previous_run_data (parents_pop, offspring_pop, last_generation_number, parents_fit, offspring_fit, last_episode_number)
     epsd, evltr, evolutionary_algorithm, generator = initialise_data_for_inspyred (
-        config, worker_stubs, experiment_folder,
+        config, worker_stubs, experiment_folder, pools,
         current_generation_number,
         last_episode_number + 1)
     continue_inspyred.continue_evolution (
@@ -334,20 +325,49 @@ def report_previous_run_data (population_parents, population_offsprings, last_ge
     raw_input ("Press ENTER to continue")
 
 def terminate_workers_get_data (worker_stubs, experiment_folder):
-    for ws in worker_stubs.values ():
-        ws.terminate_session ()
+    """
+    Send the terminate command to all workers at the same time and collect their data.
+    Workers that do not respond are reported, but their data is still collected.
+    """
+    print ("Sending terminate command to workers...")
+    try:
+        answers = zmq_sock_utils.fan_out (worker_stubs.values (), [[worker.TERMINATE]] * len (worker_stubs), retries = 0)
+        print ("Workers responded with: %s" % (str (answers)))
+    except zmq_sock_utils.WorkerTimeout as error:
+        print (str (error))
     worker_settings.collect_data_from_workers (worker_stubs.values (), experiment_folder + "logs")
 
-def connect_to_workers (workers_filename, config):
+def initialise_workers (worker_stubs, config):
+    """
+    Send the initialise command to all workers at the same time.
+    """
+    print ("Initializing workers responsible for casus %s..." % (', '.join (['#%d' % (casu_number) for casu_number in sorted (worker_stubs.keys ())])))
+    answers = zmq_sock_utils.fan_out (
+        worker_stubs.values (),
+        [EvovibeWorkerStub.initialise_request (config)] * len (worker_stubs))
+    print ("Workers responded with: %s" % (str (answers)))
+
+def connect_to_workers (list_worker_settings, config):
     '''
     Connect to workers and send the initialise command.
     '''
     print ('\n\n* Connecting to Workers...')
-    worker_stubs = worker_settings.connect_workers (worker_settings.load_worker_settings (workers_filename), EvovibeWorkerStub)
-    for evws in worker_stubs.values ():
-        evws.initialise (config)
+    worker_stubs = worker_settings.connect_workers (list_worker_settings, EvovibeWorkerStub)
+    initialise_workers (worker_stubs, config)
     print ('  Workers are ready')
     return worker_stubs
+
+def start_telemetry (list_worker_settings, worker_stubs, experiment_folder):
+    '''
+    Start receiving the telemetry snapshots published by the workers.  The snapshots are recorded in the experiment folder.
+    Returns None if no worker has a telemetry address.
+    '''
+    if all ([ws.tel_addr is None for ws in list_worker_settings]):
+        return None
+    monitor = telemetry.TelemetryMonitor (list_worker_settings, experiment_folder + 'telemetry.csv')
+    monitor.attach (worker_stubs)
+    monitor.start ()
+    return monitor
    
 def run_command_deploy (workers):
     command = [
@@ -370,28 +390,40 @@ def main ():
         process = run_command_deploy (args.workers)
         cfg = config.Config (args.config)
         cfg.status ()
-        worker_stubs = connect_to_workers (args.workers, cfg)
+        pools = evaluator.AnalysisPools (cfg)
+        list_worker_settings = worker_settings.load_worker_settings (args.workers)
+        worker_stubs = connect_to_workers (list_worker_settings, cfg)
         experiment_folder = calculate_experiment_folder_for_new_run ()
         create_directories_for_experimental_run (experiment_folder)
         run_pylon_config (cfg, experiment_folder)
         create_experimental_run_files (cfg, experiment_folder)
-        new_run (cfg, worker_stubs, experiment_folder)
+        monitor = start_telemetry (list_worker_settings, worker_stubs, experiment_folder)
+        new_run (cfg, worker_stubs, experiment_folder, pools)
+        pools.close ()
+        if monitor is not None:
+            monitor.stop ()
         process.wait ()
     elif args.command == 'continue-run':
         process = run_command_deploy (args.workers)
         cfg = config.Config (args.config)
         cfg.status ()
+        pools = evaluator.AnalysisPools (cfg)
         experiment_folder = check_run (args)
-        worker_stubs = worker_settings.connect_workers (worker_settings.load_worker_settings (args.workers), EvovibeWorkerStub)
+        list_worker_settings = worker_settings.load_worker_settings (args.workers)
+        worker_stubs = worker_settings.connect_workers (list_worker_settings, EvovibeWorkerStub)
         run_pylon_config (cfg, experiment_folder)
-        for evws in worker_stubs.values ():
-            evws.initialise (cfg)
-        continue_run (cfg, worker_stubs, experiment_folder)
+        initialise_workers (worker_stubs, cfg)
+        monitor = start_telemetry (list_worker_settings, worker_stubs, experiment_folder)
+        continue_run (cfg, worker_stubs, experiment_folder, pools)
+        pools.close ()
+        if monitor is not None:
+            monitor.stop ()
         process.wait ()
     elif args.command == 'deploy':
         worker_settings.deploy_workers (args.workers, os.path.join (os.path.dirname (os.path.abspath (__file__)), 'worker.py'), [
             os.path.join (os.path.dirname (os.path.abspath (__file__)), 'chromosome.py'),
             os.path.join (os.path.dirname (os.path.dirname (os.path.abspath (__file__))), 'common/segments.py'),
+            os.path.join (os.path.dirname (os.path.dirname (os.path.abspath (__file__))), 'common/wire_protocol.py'),
             os.path.join (os.path.dirname (os.path.dirname (os.path.abspath (__file__))), 'common/zmq_sock_utils.py')
         ])
 
@@ -5,6 +5,7 @@ from __future__ import print_function
 
 import signal
 import sys
+import threading
 import time
 import zmq
 
@@ -14,25 +15,76 @@ INITIALISE                   = 1
 ACTIVE_CASU                  = 5
 PASSIVE_CASU                 = 6
 CASU_STATUS                  = 4
-VIBRATION_PATTERN_440_09_01  = 7
 STANDBY_CASU                 = 8
 SPREAD_BEES                  = 10
+CLOCK_SYNC                   = 12
 TERMINATE                    = 31
 WORKER_OK              = 1000
 
 CASU_TEMPERATURE = 28
 
+# period in seconds between telemetry snapshots
+TELEMETRY_PERIOD = 1.0
+
 frames_per_second = None
 list_segments = None
+schedule = None
 has_blip = None
 run_vibration_model = None
 
 keep_going = True
 
-def blip_casu ():
-    a_casu.set_diagnostic_led_rgb (0.125, 0, 0)
-    time.sleep (2.0 / frames_per_second)
-    a_casu.diagnostic_led_standby ()
+# state reported in the telemetry snapshots
+phase = 'idle'
+airflow_intensity = 0
+
+class SynchronisedCasu:
+    """
+    CASU whose methods are called by one thread at a time, as the CASU object is used by the main loop and the telemetry thread.
+    The lock is reentrant because the signal handler can stop the CASU while the main loop is calling it.
+    """
+    def __init__ (self, a_casu):
+        self.casu = a_casu
+        self.lock = threading.RLock ()
+
+    def __getattr__ (self, name):
+        method = getattr (self.casu, name)
+        def synchronised (*args, **kargs):
+            with self.lock:
+                return method (*args, **kargs)
+        return synchronised
+
+def airflow_on ():
+    global airflow_intensity
+    a_casu.set_airflow_intensity (1)
+    airflow_intensity = 1
+
+def airflow_off ():
+    global airflow_intensity
+    a_casu.airflow_standby ()
+    airflow_intensity = 0
+
+def publish_telemetry (address):
+    """
+    Periodically publish a snapshot with the CASU temperatures, airflow state and the phase of the current command.
+    The master reads these snapshots instead of asking the temperature, which the worker cannot answer while it is running a command.
+    """
+    pub_socket = context.socket (zmq.PUB)
+    pub_socket.bind (address)
+    while keep_going:
+        try:
+            zmq_sock_utils.send (pub_socket, [
+                zmq_sock_utils.TELEMETRY,
+                casu_number,
+                time.time (),
+                phase,
+                airflow_intensity,
+                a_casu.get_temp (casu.TEMP_WAX),
+                a_casu.get_temp (casu.ARRAY)])
+        except zmq_sock_utils.ProtocolError as error:
+            print ("W%dC Invalid telemetry snapshot: %s" % (casu_number, str (error)))
+        time.sleep (TELEMETRY_PERIOD)
+    pub_socket.close ()
 
 def cmd_initialise ():
     if len (message) != 5:
@@ -41,98 +93,117 @@ def cmd_initialise ():
         sys.exit (3)
     global frames_per_second
     global list_segments
+    global schedule
     global has_blip
     global run_vibration_model
+    global phase
+    phase = 'initialise'
     print ("W%dC Initialisation message..." % casu_number)
     frames_per_second     = message [1]
     evaluation_proceeding = message [2]
     has_blip              = message [3]
     chromosome_type       = message [4]
     list_segments = segments.Segments (evaluation_proceeding)
+    list_segments.compute_first_last_frames (frames_per_second, has_blip)
+    schedule = list_segments.schedule (frames_per_second, has_blip)
     run_vibration_model = chromosome.CHROMOSOME_METHODS [chromosome_type].run_vibration_model
     a_casu.set_temp (CASU_TEMPERATURE)
     a_casu.diagnostic_led_standby ()
-    a_casu.airflow_standby ()
+    airflow_off ()
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
     print ("W%dC Done!" % (casu_number))
+    phase = 'idle'
     zmq_sock_utils.send (socket, [WORKER_OK])
 
-def evaluation_proceeding (chromosome):
-    if has_blip:
-        blip_casu ()
-    for sgt in list_segments:
-        if sgt.type == segments.SGT_AIRFLOW:
-            print ('W%dC   airflow segment' % casu_number)
-            a_casu.set_airflow_intensity (1)
-            time.sleep (sgt.duration)
-            a_casu.airflow_standby ()
-        elif sgt.type == segments.SGT_VIBRATION:
-            print ('W%dC   vibration segment' % casu_number)
-            if chromosome is not None:
-                run_vibration_model (chromosome, a_casu)
-            time.sleep (sgt.duration)
-            if chromosome is not None:
+def evaluation_proceeding (chromosome, start_time = None):
+    """
+    Execute the evaluation protocol on the deadlines of the segment schedule, starting at the given instant of the worker clock or immediately.
+    Returns a tuple with the start time of the protocol and the actual start of each segment relative to it.
+    """
+    global phase
+    result = []
+    start = segments.monotonic ()
+    if start_time is not None:
+        start += start_time - time.time ()
+        segments.sleep_until (start)
+    time_start = time.time ()
+    for (deadline, event, sgt) in schedule:
+        segments.sleep_until (start + deadline)
+        if event == segments.EVT_BLIP_ON:
+            a_casu.set_diagnostic_led_rgb (0.125, 0, 0)
+        elif event == segments.EVT_BLIP_OFF:
+            a_casu.diagnostic_led_standby ()
+        elif event == segments.EVT_SEGMENT_START:
+            if sgt.type == segments.SGT_AIRFLOW:
+                print ('W%dC   airflow segment' % casu_number)
+                phase = 'airflow segment'
+                airflow_on ()
+            elif sgt.type == segments.SGT_VIBRATION:
+                print ('W%dC   vibration segment' % casu_number)
+                phase = 'vibration segment'
+                if chromosome is not None:
+                    run_vibration_model (chromosome, a_casu)
+            elif sgt.type == segments.SGT_NO_STIMULI:
+                print ('W%dC   no stimuli segment' % casu_number)
+                phase = 'no stimuli segment'
+            result.append (segments.monotonic () - start)
+        elif event == segments.EVT_SEGMENT_END:
+            if sgt.type == segments.SGT_AIRFLOW:
+                airflow_off ()
+            elif sgt.type == segments.SGT_VIBRATION and chromosome is not None:
                 a_casu.speaker_standby ()
-        elif sgt.type == segments.SGT_NO_STIMULI:
-            print ('W%dC   no stimuli segment' % casu_number)
-            time.sleep (sgt.duration)
-        if has_blip:
-            blip_casu ()
+    return (time_start, result)
 
 def cmd_active_casu ():
+    global phase
+    phase = 'active'
     print ("W%dC active" % casu_number)
-    time_start_vibration_pattern = time.time ()
-    evaluation_proceeding (message [1])
+    (time_start_vibration_pattern, segment_starts) = evaluation_proceeding (message [1], message [2] if len (message) == 3 else None)
     print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK, time_start_vibration_pattern])
+    phase = 'idle'
+    zmq_sock_utils.send (socket, [WORKER_OK, time_start_vibration_pattern, segment_starts])
 
 def cmd_passive_casu ():
+    global phase
+    phase = 'passive'
     print ("W%dC passive" % casu_number)
-    evaluation_proceeding (None)
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
-
-def cmd_vibration_pattern_440_09_01 ():
-    print ("W%dC Running vibration pattern: frequency 440Hz, duration 0.9s, pause 0.1s" % (casu_number))
-    number_repeats = message [1]
-    for n in xrange (number_repeats):
-        print ("W%dC Repeat #%d" % (casu_number, n + 1))
-        blip_casu ()
-        vibe_periods = [900,  100]
-        vibe_freqs   = [440,    1]
-        vibe_amps    = [ 50,    0]
-        el_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
-        time.sleep (evaluation_run_time)
-        blip_casu ()
-        a_casu.speaker_standby ()
-        time.sleep (spreading_waiting_time)
+    evaluation_proceeding (None, message [1] if len (message) == 2 else None)
     print ("W%dC Done!" % (casu_number))
+    phase = 'idle'
     zmq_sock_utils.send (socket, [WORKER_OK])
 
 def cmd_standby_casu ():
+    global phase
+    phase = 'standby'
     print ("W%dC Putting CASU in standby" % (casu_number))
     a_casu.set_temp (CASU_TEMPERATURE)
     a_casu.diagnostic_led_standby ()
-    a_casu.airflow_standby ()
+    airflow_off ()
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
     print ("W%dC Done!" % (casu_number))
+    phase = 'idle'
     zmq_sock_utils.send (socket, [WORKER_OK])
 
 def cmd_spread_bees ():
+    global phase
+    phase = 'spreading bees'
     print ("W%dC Spreading bees..." % (casu_number))
     a_casu.set_temp (CASU_TEMPERATURE)
-    a_casu.set_airflow_intensity (1)
+    airflow_on ()
     time.sleep (message [1])
-    a_casu.airflow_standby ()
+    airflow_off ()
     print ("W%dC Done!" % (casu_number))
+    phase = 'idle'
     zmq_sock_utils.send (socket, [WORKER_OK])
 
 def cmd_terminate ():
     global keep_going
+    global phase
+    phase = 'terminate'
     print ("W%dC Terminating..." % (casu_number))
-    a_casu.airflow_standby () # this is not done by casu.stop()
+    airflow_off () # this is not done by casu.stop()
     a_casu.stop ()
     keep_going = False
     print ("W%dC Done!" % (casu_number))
@@ -143,7 +214,7 @@ def signal_handler (signum, frame):
         print ('W%dC You pressed Ctrl+C!' % (casu_number))
     else:
         print ("W%dC Received signal number %d!" % (casu_number, signum))
-    a_casu.airflow_standby () # this is not done by casu.stop()
+    airflow_off () # this is not done by casu.stop()
     a_casu.stop ()
     sys.exit (0)
 
@@ -153,11 +224,12 @@ if __name__ == '__main__':
     import zmq_sock_utils
 
     # parse arguments
-    usage = 'Usage:\npython worker.py RTC_FILENAME CASU_NUMBER ZMQ_ADDRESS\n'
-    if len (sys.argv) != 4:
+    usage = 'Usage:\npython worker.py RTC_FILENAME CASU_NUMBER ZMQ_ADDRESS [TELEMETRY_ADDRESS]\n'
+    if len (sys.argv) not in [4, 5]:
         print ('Invalid number of options!\n' + usage)
         sys.exit (1)
     zmq_address = sys.argv [3]
+    telemetry_address = sys.argv [4] if len (sys.argv) == 5 else None
     try:
         casu_number = int (sys.argv [2])
     except:
@@ -167,10 +239,10 @@ if __name__ == '__main__':
     # connect to CASU
     rtc_file_name = sys.argv [1]
     try:
-        a_casu = casu.Casu (
+        a_casu = SynchronisedCasu (casu.Casu (
             rtc_file_name = rtc_file_name,
             log = True,
-            log_folder = '.')
+            log_folder = '.'))
     except:
         print ("Failed connecting to casu #%d." % (casu_number))
         sys.exit (2)
@@ -183,9 +255,15 @@ if __name__ == '__main__':
     # prepare the CASU (turn the IR sensor off to make the background image)
     a_casu.set_temp (CASU_TEMPERATURE)
     a_casu.diagnostic_led_standby ()
-    a_casu.airflow_standby ()
+    airflow_off ()
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
+
+    # publish telemetry snapshots
+    if telemetry_address is not None:
+        telemetry_thread = threading.Thread (target = publish_telemetry, args = (telemetry_address,))
+        telemetry_thread.daemon = True
+        telemetry_thread.start ()
     
     # install signal handler to exit worker gracefully
     signal.signal (signal.SIGINT, signal_handler)
@@ -196,7 +274,12 @@ if __name__ == '__main__':
     # main loop
     print ("W%dC Entering main loop." % (casu_number))
     while keep_going:
-        message = zmq_sock_utils.recv (socket)
+        try:
+            message = zmq_sock_utils.recv (socket)
+        except zmq_sock_utils.ProtocolError as error:
+            print ("W%dC Invalid request: %s" % (casu_number, str (error)))
+            zmq_sock_utils.send (socket, [zmq_sock_utils.PROTOCOL_ERROR, str (error)])
+            continue
         print ("W%dC Received request: %s" % (casu_number, str (message)))
         command = message [0]
         if command == INITIALISE:
@@ -207,9 +290,9 @@ if __name__ == '__main__':
             cmd_passive_casu ()
         elif command == CASU_STATUS:
             print ("W%dC temperature readins: %s" % (casu_number, str (a_casu.get_temp (casu.ARRAY))))
-            zmq_sock_utils.send (socket, a_casu.get_temp (casu.TEMP_WAX))
-        elif command == VIBRATION_PATTERN_440_09_01:
-            cmd_vibration_pattern_440_09_01 ()
+            zmq_sock_utils.send (socket, [CASU_STATUS, a_casu.get_temp (casu.TEMP_WAX)])
+        elif command == CLOCK_SYNC:
+            zmq_sock_utils.send (socket, [CLOCK_SYNC, time.time ()])
         elif command == STANDBY_CASU:
             cmd_standby_casu ()
         elif command == SPREAD_BEES:
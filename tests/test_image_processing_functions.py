@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+import assisivibe.common.image_processing_functions as image_processing_functions
+
+def rectangle_mask (shape, upper, lower, left, right):
+    result = numpy.zeros (shape, dtype = numpy.uint8)
+    result [upper:lower, left:right] = 255
+    return result
+
+class TestROIIndex (unittest.TestCase):
+
+    def setUp (self):
+        self.shape = (40, 50)
+        self.masks = [
+            rectangle_mask (self.shape, 3, 9, 5, 12),
+            rectangle_mask (self.shape, 20, 31, 1, 7),
+            rectangle_mask (self.shape, 11, 18, 25, 40)]
+
+    def test_merge_matches_index_of_all_masks (self):
+        expected = image_processing_functions.ROIIndex.from_masks (self.masks)
+        merged = image_processing_functions.ROIIndex.merge ([
+            image_processing_functions.ROIIndex.from_masks (self.masks [:1]),
+            image_processing_functions.ROIIndex.from_masks (self.masks [1:])])
+        self.assertEqual (merged.box, expected.box)
+        self.assertEqual (merged.shape, expected.shape)
+        self.assertEqual (merged.number_ROIs, 3)
+        frame = numpy.arange (self.shape [0] * self.shape [1]).reshape (self.shape) % 251
+        for index_ROI in xrange (3):
+            self.assertEqual (
+                sorted (merged.gather (frame) [merged.labels == index_ROI]),
+                sorted (expected.gather (frame) [expected.labels == index_ROI]))
+
+    def test_from_masks (self):
+        index = image_processing_functions.ROIIndex.from_masks (self.masks)
+        self.assertEqual (index.box, (1, 3, 40, 31))
+        self.assertEqual (index.shape, (28, 39))
+        self.assertEqual (index.areas ().tolist (), [6 * 7, 11 * 6, 7 * 15])
+
+    def test_compile_load_round_trip (self):
+        folder = tempfile.mkdtemp ()
+        try:
+            ROI_filenames = []
+            for index_ROI, mask in enumerate (self.masks):
+                filename = os.path.join (folder, 'ROI-%d.png' % (index_ROI))
+                image_processing_functions.save_grey_image (filename, mask)
+                ROI_filenames.append (filename)
+            index_filename = os.path.join (folder, 'ROIs.npz')
+            compiled = image_processing_functions.ROIIndex.compile (ROI_filenames, index_filename, 2)
+            loaded = image_processing_functions.ROIIndex.load (index_filename)
+        finally:
+            shutil.rmtree (folder)
+        self.assertEqual (loaded.shape, compiled.shape)
+        self.assertEqual (loaded.box, compiled.box)
+        self.assertEqual (loaded.scale, 2)
+        self.assertEqual (loaded.number_ROIs, 3)
+        self.assertEqual (loaded.pixels.tolist (), compiled.pixels.tolist ())
+        self.assertEqual (loaded.labels.tolist (), compiled.labels.tolist ())
+
+    def test_engine_matches_masked_frame_counts (self):
+        random = numpy.random.RandomState (3)
+        background = random.randint (0, 256, self.shape).astype (numpy.uint8)
+        previous = random.randint (0, 256, self.shape).astype (numpy.uint8)
+        frame = random.randint (0, 256, self.shape).astype (numpy.uint8)
+        threshold = 40
+        engine = image_processing_functions.PixelDifferenceEngine (
+            image_processing_functions.ROIIndex.from_masks (self.masks), background, threshold)
+        expected = []
+        for mask in self.masks:
+            mask = mask.astype (numpy.uint16)
+            for other in [background, previous]:
+                expected.append (image_processing_functions.count_different_pixels (
+                    image_processing_functions.mask_frame (mask, frame),
+                    image_processing_functions.mask_frame (mask, other),
+                    threshold))
+        self.assertEqual (engine.compare (frame, previous), expected)
+        self.assertEqual (engine.compare (frame) [1::2], [-1, -1, -1])
+
+def numbered_frames (number_frames, shape):
+    """
+    Return an array of frames whose pixels are the frame number, which starts at one.
+    """
+    return numpy.arange (1, number_frames + 1, dtype = numpy.uint8).reshape (-1, 1, 1) * numpy.ones (shape, dtype = numpy.uint8)
+
+class TestFrameWindow (unittest.TestCase):
+
+    def setUp (self):
+        self.shape = (4, 8)
+        self.window = image_processing_functions.FrameWindow (3, self.shape)
+
+    def read (self, frames, number_frames):
+        return image_processing_functions.stream_frames (io.BytesIO (frames.tobytes ()), self.window, number_frames)
+
+    def test_previous_frame_is_delta_frame_apart (self):
+        frame_numbers = []
+        for ith_frame in self.read (numbered_frames (10, self.shape), 10):
+            frame_numbers.append (ith_frame)
+            self.assertTrue ((self.window.current_frame () == ith_frame).all ())
+            if ith_frame <= 3:
+                self.assertIsNone (self.window.previous_frame ())
+            else:
+                self.assertTrue ((self.window.previous_frame () == ith_frame - 3).all ())
+        self.assertEqual (frame_numbers, range (1, 11))
+
+    def test_restart (self):
+        list (self.read (numbered_frames (5, self.shape), 5))
+        self.window.restart (20)
+        frame_numbers = list (self.read (numbered_frames (5, self.shape) + 19, 5))
+        self.assertEqual (frame_numbers, range (20, 25))
+        self.assertTrue ((self.window.current_frame () == 24).all ())
+        self.assertTrue ((self.window.previous_frame () == 21).all ())
+
+    def test_stream_ends_before_last_frame (self):
+        frames = numbered_frames (4, self.shape).tobytes ()
+        stream = io.BytesIO (frames [:-1])
+        self.assertEqual (list (image_processing_functions.stream_frames (stream, self.window, 10)), [1, 2, 3])
+
+class TestMedianBackground (unittest.TestCase):
+
+    def setUp (self):
+        # rows are padded to a multiple of four bytes by GStreamer
+        self.shape = (5, 6)
+        self.padded_shape = (5, 8)
+
+    def stream (self, frames):
+        return io.BytesIO (numpy.ascontiguousarray (frames).tobytes ())
+
+    def test_moving_object_is_removed (self):
+        frames = numpy.full ((5,) + self.padded_shape, 100, dtype = numpy.uint8)
+        for index in xrange (5):
+            frames [index, index, index] = 255
+        frames [:, :, 6:] = 7
+        background = image_processing_functions.median_background (self.stream (frames), 5, self.shape)
+        self.assertEqual (background.shape, self.shape)
+        self.assertTrue ((background == 100).all ())
+
+    def test_lower_median_of_even_number_of_frames (self):
+        frames = numbered_frames (4, self.padded_shape)
+        background = image_processing_functions.median_background (self.stream (frames), 4, self.shape)
+        self.assertTrue ((background == 2).all ())
+
+    def test_short_stream (self):
+        frames = numbered_frames (3, self.padded_shape)
+        background = image_processing_functions.median_background (self.stream (frames), 10, self.shape)
+        self.assertTrue ((background == 2).all ())
+
+    def test_empty_stream (self):
+        self.assertRaises (ValueError, image_processing_functions.median_background, io.BytesIO (b''), 10, self.shape)
+
+    def test_png_round_trip (self):
+        image = numpy.random.RandomState (5).randint (0, 256, self.shape).astype (numpy.uint8)
+        folder = tempfile.mkdtemp ()
+        try:
+            filename = os.path.join (folder, 'Background.png')
+            image_processing_functions.save_grey_image (filename, image)
+            self.assertTrue ((image_processing_functions.load_grey_image (filename) == image).all ())
+        finally:
+            shutil.rmtree (folder)
+
+    def test_set_background_keeps_clones (self):
+        mask = rectangle_mask (self.shape, 0, 5, 0, 6)
+        engine = image_processing_functions.PixelDifferenceEngine (
+            image_processing_functions.ROIIndex.from_masks ([mask]), numpy.zeros (self.shape, dtype = numpy.uint8), 10)
+        clone = engine.clone ()
+        engine.set_background (numpy.full (self.shape, 200, dtype = numpy.uint8))
+        frame = numpy.full (self.shape, 200, dtype = numpy.uint8)
+        self.assertEqual (engine.compare (frame) [0], 0)
+        self.assertEqual (clone.compare (frame) [0], 30)
+
+class TestRawVideo (unittest.TestCase):
+
+    def setUp (self):
+        self.shape = (6, 10)
+        self.folder = tempfile.mkdtemp ()
+        self.filename = os.path.join (self.folder, 'iterationVideo_1.raw')
+
+    def tearDown (self):
+        shutil.rmtree (self.folder)
+
+    def write (self, data):
+        with open (self.filename, 'wb') as fp:
+            fp.write (data)
+
+    def test_partial_frame_is_ignored (self):
+        self.write (numbered_frames (4, self.shape).tobytes () [:-5])
+        video = image_processing_functions.raw_video (self.filename, self.shape)
+        self.assertEqual (video.shape, (3,) + self.shape)
+        self.assertTrue ((video [2] == 3).all ())
+        del video
+
+    def test_empty_video (self):
+        self.write (b'')
+        self.assertEqual (len (image_processing_functions.raw_video (self.filename, self.shape)), 0)
+
+    def test_frames_from_window_position (self):
+        frames = numbered_frames (8, self.shape)
+        frames [:, 2, 3] = 200
+        self.write (frames.tobytes ())
+        video = image_processing_functions.raw_video (self.filename, self.shape)
+        box = (3, 2, 7, 5)
+        window = image_processing_functions.FrameWindow (2, (3, 4))
+        window.restart (4)
+        frame_numbers = []
+        for ith_frame in image_processing_functions.memory_mapped_frames (video, window, 10, box):
+            frame_numbers.append (ith_frame)
+            self.assertTrue ((window.current_frame () == frames [ith_frame - 1, 2:5, 3:7]).all ())
+        self.assertEqual (frame_numbers, range (4, 9))
+        self.assertEqual (window.previous_frame ().tolist (), frames [5, 2:5, 3:7].tolist ())
+        del video
+
+class TestBlips (unittest.TestCase):
+
+    def test_detect_blips (self):
+        brightness = 50 + numpy.random.RandomState (7).normal (0, 2, (80, 2))
+        brightness [20:22] = 200
+        brightness [60:63] = 180
+        brightness [40:50] = numpy.nan
+        blips = image_processing_functions.detect_blips (brightness)
+        self.assertEqual (blips, [(21, 22), (61, 63)])
+        self.assertTrue (all ([type (frame) is int for blip in blips for frame in blip]))
+
+    def test_detect_blips_without_decoded_frames (self):
+        self.assertEqual (image_processing_functions.detect_blips (numpy.full ((10, 2), numpy.nan)), [])
+
+    def test_led_window_brightness (self):
+        shape = (60, 80)
+        masks = [rectangle_mask (shape, 0, 30, 0, 40), rectangle_mask (shape, 30, 60, 40, 80)]
+        detector = image_processing_functions.BlipDetector (image_processing_functions.ROIIndex.from_masks (masks), 5)
+        frame = numpy.full (shape, 10, dtype = numpy.uint8)
+        frame [13:18, 18:23] = 250
+        self.assertEqual (detector.brightness (frame).tolist (), [250.0, 10.0])
+
+if __name__ == '__main__':
+    unittest.main ()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import unittest
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+import assisivibe.common.segments as segments
+
+FRAMES_PER_SECOND = 10
+
+def new_segments ():
+    result = segments.Segments ([
+        {'type' : 'no stimuli', 'duration' : 2},
+        {'type' : 'vibration', 'duration' : 3},
+        {'type' : 'no stimuli', 'duration' : 2}])
+    result.compute_first_last_frames (FRAMES_PER_SECOND, True)
+    return result
+
+class TestDecodedFrameIntervals (unittest.TestCase):
+
+    def setUp (self):
+        self.segments = new_segments ()
+
+    def test_vibration_segments_and_delta_frames (self):
+        self.assertEqual (self.segments.decoded_frame_intervals (2, 80), [(21, 52)])
+
+    def test_blip_windows (self):
+        self.assertEqual (self.segments.blip_frame_intervals (), [(0, 0), (21, 22), (53, 54), (75, 76)])
+        self.assertEqual (self.segments.decoded_frame_intervals (2, 80, 3), [(1, 3), (18, 57), (72, 79)])
+
+    def test_blip_windows_are_clipped (self):
+        self.assertEqual (self.segments.decoded_frame_intervals (2, 74, 3), [(1, 3), (18, 57), (72, 74)])
+
+class TestSchedule (unittest.TestCase):
+
+    def setUp (self):
+        self.segments = new_segments ()
+
+    def test_segment_deadlines_follow_frames (self):
+        schedule = self.segments.schedule (FRAMES_PER_SECOND, True)
+        deadlines = [deadline for (deadline, _, _) in schedule]
+        self.assertEqual (deadlines, sorted (deadlines))
+        for sgt in self.segments:
+            (start,) = [deadline for (deadline, event, other) in schedule if other is sgt and event == segments.EVT_SEGMENT_START]
+            (end,) = [deadline for (deadline, event, other) in schedule if other is sgt and event == segments.EVT_SEGMENT_END]
+            self.assertAlmostEqual (start, sgt.first_frame / float (FRAMES_PER_SECOND))
+            self.assertAlmostEqual (end, (sgt.last_frame + 1) / float (FRAMES_PER_SECOND))
+
+    def test_blips_fill_the_gaps (self):
+        schedule = self.segments.schedule (FRAMES_PER_SECOND, True)
+        blips = [(deadline, event) for (deadline, event, _) in schedule if event in [segments.EVT_BLIP_ON, segments.EVT_BLIP_OFF]]
+        self.assertEqual ([event for (_, event) in blips], [segments.EVT_BLIP_ON, segments.EVT_BLIP_OFF] * 4)
+        for (expected, (deadline, _)) in zip ([0.0, 0.1, 2.1, 2.3, 5.3, 5.5, 7.5, 7.7], blips):
+            self.assertAlmostEqual (deadline, expected)
+
+    def test_no_blips (self):
+        schedule = self.segments.schedule (FRAMES_PER_SECOND, False)
+        self.assertEqual (len (schedule), 2 * len (self.segments))
+
+    def test_realign (self):
+        realigned = self.segments.realign (FRAMES_PER_SECOND, [0.1, 2.5, 5.5])
+        self.assertEqual ([(sgt.first_frame, sgt.last_frame) for sgt in realigned], [(1, 20), (25, 54), (55, 74)])
+        self.assertEqual (self.segments [1].first_frame, 23)
+
+class TestCaptureTime (unittest.TestCase):
+
+    def setUp (self):
+        self.segments = new_segments ()
+        # frame 31 was dropped
+        self.timestamps = [ith_frame / float (FRAMES_PER_SECOND) for ith_frame in xrange (80) if ith_frame != 30]
+
+    def test_nominal_frame_numbers (self):
+        numbers = segments.nominal_frame_numbers ([t + 100.0 for t in self.timestamps], FRAMES_PER_SECOND)
+        self.assertAlmostEqual (numbers [0], 1)
+        self.assertAlmostEqual (numbers [29], 30)
+        self.assertAlmostEqual (numbers [30], 32)
+
+    def test_retime (self):
+        retimed = self.segments.retime (segments.nominal_frame_numbers (self.timestamps, FRAMES_PER_SECOND))
+        self.assertEqual ([(sgt.first_frame, sgt.last_frame) for sgt in retimed], [(1, 20), (23, 51), (54, 73)])
+
+    def test_count_dropped_frames (self):
+        self.assertEqual (segments.count_dropped_frames (self.timestamps, FRAMES_PER_SECOND), (1, 0))
+        duplicated = self.timestamps [:10] + [self.timestamps [9]] + self.timestamps [10:]
+        self.assertEqual (segments.count_dropped_frames (duplicated, FRAMES_PER_SECOND), (1, 1))
+
+class TestAnchorToBlips (unittest.TestCase):
+
+    def setUp (self):
+        self.segments = new_segments ()
+        # every blip is two frames late
+        self.blips = [(1, 2), (23, 24), (55, 56), (77, 78)]
+
+    def frames (self, anchored):
+        return [(sgt.first_frame, sgt.last_frame) for sgt in anchored]
+
+    def test_all_blips_matched (self):
+        (anchored, matched) = self.segments.anchor_to_blips (self.blips, FRAMES_PER_SECOND)
+        self.assertEqual (matched, self.blips)
+        self.assertEqual (self.frames (anchored), [(3, 22), (25, 54), (57, 76)])
+
+    def test_missing_blips_keep_segment_length (self):
+        blips = [self.blips [0], self.blips [2]]
+        (anchored, matched) = self.segments.anchor_to_blips (blips, FRAMES_PER_SECOND)
+        self.assertEqual (matched, [self.blips [0], None, self.blips [2], None])
+        self.assertEqual (self.frames (anchored), [(3, 22), (25, 54), (57, 76)])
+
+    def test_distant_blips_are_not_matched (self):
+        (anchored, matched) = self.segments.anchor_to_blips ([(40, 41)], FRAMES_PER_SECOND)
+        self.assertEqual (matched, [None] * 4)
+        self.assertEqual (self.frames (anchored), self.frames (self.segments))
+
+if __name__ == '__main__':
+    unittest.main ()
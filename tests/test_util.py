@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+import PIL.Image
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+import assisivibe.common.image_processing_functions as image_processing_functions
+import assisivibe.common.util as util
+
+HAS_FFMPEG = util.FFMPEG_BIN_FILENAME != '/bin/true'
+
+FRAMES_PER_SECOND = 10
+
+def make_frames (number_frames, shape):
+    """
+    Return frames whose grey levels identify them, even after JPEG compression.
+    """
+    result = numpy.zeros ((number_frames,) + shape, dtype = numpy.uint8)
+    for index in xrange (number_frames):
+        result [index] = 10 + 8 * index
+        result [index, :, :(index % shape [1])] = 250
+    return result
+
+def make_mjpeg_video (filename, frames):
+    """
+    Encode the given frames in a motion JPEG AVI video.
+    """
+    (_, height, width) = frames.shape
+    process = subprocess.Popen ([
+        util.FFMPEG_BIN_FILENAME,
+        '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'gray', '-s', '%dx%d' % (width, height), '-r', '%d' % (FRAMES_PER_SECOND),
+        '-i', '-',
+        '-c:v', 'mjpeg', '-pix_fmt', 'yuvj420p', '-q:v', '2',
+        filename], stdin = subprocess.PIPE)
+    process.communicate (frames.tobytes ())
+
+def decode (filename, number_frames, shape, first_frame = 1, box = None, scale = 1):
+    """
+    Return the frames written by util.stream_video.
+    """
+    process = util.stream_video (filename, number_frames, FRAMES_PER_SECOND, first_frame, box, scale)
+    stream = io.open (process.stdout.fileno (), 'rb', closefd = False)
+    result = []
+    frame = numpy.empty (shape, dtype = numpy.uint8)
+    while len (result) < number_frames and image_processing_functions.read_raw_frame (stream, frame):
+        result.append (frame.copy ())
+    process.stdout.close ()
+    process.wait ()
+    return numpy.array (result)
+
+class TestCropFilter (unittest.TestCase):
+
+    def test_no_box (self):
+        self.assertEqual (util.crop_filter (None), [])
+
+    def test_odd_box_is_exact (self):
+        self.assertEqual (util.crop_filter ((3, 5, 10, 8)), ['-vf', 'format=gray,crop=7:3:3:5:exact=1'])
+
+    def test_box_in_reduced_coordinates (self):
+        self.assertEqual (util.crop_filter ((3, 5, 10, 8), 2), ['-vf', 'format=gray,crop=14:6:6:10:exact=1,scale=iw/2:ih/2:flags=area'])
+
+@unittest.skipUnless (HAS_FFMPEG, 'ffmpeg is not installed')
+class TestStreamVideo (unittest.TestCase):
+
+    def setUp (self):
+        self.folder = tempfile.mkdtemp ()
+        self.filename = os.path.join (self.folder, 'video.avi')
+        self.shape = (24, 32)
+        make_mjpeg_video (self.filename, make_frames (30, self.shape))
+        self.serial = decode (self.filename, 30, self.shape)
+
+    def tearDown (self):
+        shutil.rmtree (self.folder)
+
+    def test_serial_decode (self):
+        self.assertEqual (len (self.serial), 30)
+        self.assertFalse ((self.serial [1:] == self.serial [:-1]).all (axis = (1, 2)).any ())
+
+    def test_interval_matches_serial_decode (self):
+        for first_frame in [2, 7, 16, 29]:
+            interval = decode (self.filename, 5, self.shape, first_frame)
+            expected = self.serial [(first_frame - 1):(first_frame + 4)]
+            self.assertEqual (len (interval), len (expected))
+            self.assertTrue ((interval == expected).all (), 'interval starting at frame %d' % (first_frame))
+
+    def test_odd_box_matches_serial_decode (self):
+        mask = numpy.zeros (self.shape, dtype = numpy.uint8)
+        mask [5:16, 3:14] = 255
+        roi_index = image_processing_functions.ROIIndex.from_masks ([mask])
+        self.assertEqual (roi_index.box, (3, 5, 14, 16))
+        cropped = decode (self.filename, 30, roi_index.shape, box = roi_index.box)
+        self.assertEqual (cropped.shape, (30,) + roi_index.shape)
+        self.assertTrue ((cropped == self.serial [:, 5:16, 3:14]).all ())
+        interval = decode (self.filename, 5, roi_index.shape, 11, roi_index.box)
+        self.assertTrue ((interval == self.serial [10:15, 5:16, 3:14]).all ())
+
+    def test_box_pixel_counts_match_pil_crop (self):
+        random_state = numpy.random.RandomState (3)
+        frame = random_state.randint (0, 256, self.shape).astype (numpy.uint8)
+        frame_filename = os.path.join (self.folder, 'frame.png')
+        PIL.Image.fromarray (frame, mode = 'L').save (frame_filename)
+        masks = [numpy.zeros (self.shape, dtype = numpy.uint8) for _ in xrange (2)]
+        masks [0][5:16, 3:9] = 255
+        masks [1][7:12, 9:14] = 255
+        roi_index = image_processing_functions.ROIIndex.from_masks (masks)
+        engine = image_processing_functions.PixelDifferenceEngine (roi_index, random_state.randint (0, 256, self.shape).astype (numpy.uint8), 20)
+        pil_frame = numpy.asarray (PIL.Image.open (frame_filename).crop (roi_index.box), dtype = numpy.uint8)
+        ffmpeg_frame = decode (frame_filename, 1, roi_index.shape, box = roi_index.box) [0]
+        self.assertEqual (list (engine.compare (ffmpeg_frame)), list (engine.compare (pil_frame)))
+
+    def test_reduced_scale_matches_downsample (self):
+        mask = numpy.zeros (self.shape, dtype = numpy.uint8)
+        mask [5:16, 3:14] = 255
+        roi_index = image_processing_functions.ROIIndex.from_masks ([mask], 2)
+        (left, upper, right, lower) = roi_index.box
+        reduced = decode (self.filename, 30, roi_index.shape, box = roi_index.box, scale = 2)
+        self.assertEqual (reduced.shape, (30,) + roi_index.shape)
+        for (frame, full_frame) in zip (reduced, self.serial):
+            expected = image_processing_functions.downsample (full_frame, 2) [upper:lower, left:right]
+            # the fixed point area filter of ffmpeg can be one grey level away from the rounded mean
+            self.assertLessEqual (numpy.abs (frame.astype (int) - expected).max (), 1)
+
+class TestAppendCsvRows (unittest.TestCase):
+
+    def test_header_is_written_once (self):
+        folder = tempfile.mkdtemp ()
+        try:
+            filename = os.path.join (folder, 'scores.csv')
+            util.append_csv_rows (filename, ["generation", "value"], [[1, 0.5]])
+            util.append_csv_rows (filename, ["generation", "value"], [[2, 1.5], [3, 2.5]])
+            with open (filename, 'r') as fp:
+                self.assertEqual (fp.read ().splitlines (), ['"generation","value"', '1,0.5', '2,1.5', '3,2.5'])
+            self.assertEqual (util.load_csv (filename, True), [[1, 0.5], [2, 1.5], [3, 2.5]])
+        finally:
+            shutil.rmtree (folder)
+
+if __name__ == '__main__':
+    unittest.main ()
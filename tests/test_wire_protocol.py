@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import unittest
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+import assisivibe.common.wire_protocol as wire_protocol
+
+class TestCodec (unittest.TestCase):
+
+    def round_trip (self, data):
+        return wire_protocol.decode (wire_protocol.encode (data))
+
+    def test_round_trip (self):
+        messages = [
+            [1, 30.0, [{'type' : 'vibration', 'duration' : 20}], True, 'SinglePulse1sGenesPulse'],
+            [4, 28.3125],
+            [5, [900, 300, 50], 1234.5],
+            [8],
+            [1000, 1234.5, [0.0, 20.0, 40.0]],
+            [1002, 1, 1234.5, 'vibration segment', 0.0, 28.0, [28.0, 28.125]]]
+        for data in messages:
+            self.assertEqual (self.round_trip (data), data)
+
+    def test_trailing_fields_are_optional (self):
+        self.assertEqual (self.round_trip ([5, [1, 2]]), [5, [1, 2]])
+        self.assertEqual (self.round_trip ([6]), [6])
+
+    def test_one_frame_per_field (self):
+        frames = wire_protocol.encode ([5, [1, 2], 3.0])
+        self.assertEqual (len (frames), 3)
+        self.assertEqual (wire_protocol.HEADER.unpack (frames [0]), (wire_protocol.PROTOCOL_VERSION, 5))
+
+    def test_unknown_message_type (self):
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.encode, [999])
+
+    def test_too_many_fields (self):
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.encode, [8, 1.0])
+
+    def test_integral_genes (self):
+        self.assertEqual (self.round_trip ([5, [900.0, 300.0, 50.0]]), [5, [900, 300, 50]])
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.encode, [5, [900.5, 300, 50]])
+
+    def test_invalid_field (self):
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.encode, [4, 'hot'])
+
+    def test_other_protocol_version (self):
+        frames = wire_protocol.encode ([4, 28.0])
+        frames [0] = wire_protocol.HEADER.pack (wire_protocol.PROTOCOL_VERSION + 1, 4)
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.decode, frames)
+
+    def test_truncated_header (self):
+        self.assertRaises (wire_protocol.ProtocolError, wire_protocol.decode, ['\x04'])
+
+if __name__ == '__main__':
+    unittest.main ()
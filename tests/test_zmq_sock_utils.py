@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+import unittest
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), '..'))
+
+import assisivibe.common.wire_protocol as wire_protocol
+
+try:
+    import zmq
+    import assisivibe.common.zmq_sock_utils as zmq_sock_utils
+except ImportError:
+    zmq = None
+
+class Stub:
+    def __init__ (self, casu_number, socket, address):
+        self.casu_number = casu_number
+        self.socket = socket
+        self.address = address
+
+@unittest.skipIf (zmq is None, 'pyzmq is not installed')
+class TestGather (unittest.TestCase):
+
+    # closed inproc addresses are released asynchronously, so each test binds new ones
+    number_tests = 0
+
+    def setUp (self):
+        TestGather.number_tests += 1
+        context = zmq.Context.instance ()
+        self.workers = []
+        self.stubs = []
+        for index in xrange (2):
+            address = 'inproc://test-gather-%d-%d' % (TestGather.number_tests, index)
+            worker = context.socket (zmq.REP)
+            worker.bind (address)
+            socket = context.socket (zmq.REQ)
+            socket.connect (address)
+            self.workers.append (worker)
+            self.stubs.append (Stub (index + 1, socket, address))
+
+    def tearDown (self):
+        for socket in self.workers + [ws.socket for ws in self.stubs]:
+            socket.close (linger = 0)
+
+    def test_replies_in_stub_order (self):
+        for ws in self.stubs:
+            zmq_sock_utils.send (ws.socket, [4])
+        for (worker, temperature) in zip (reversed (self.workers), [30.0, 28.0]):
+            zmq_sock_utils.recv (worker)
+            zmq_sock_utils.send (worker, [4, temperature])
+        (replies, missing) = zmq_sock_utils.gather (self.stubs, 1000)
+        self.assertEqual (replies, [[4, 28.0], [4, 30.0]])
+        self.assertEqual (missing, [])
+
+    def test_missing_reply (self):
+        for ws in self.stubs:
+            zmq_sock_utils.send (ws.socket, [4])
+        zmq_sock_utils.recv (self.workers [0])
+        zmq_sock_utils.send (self.workers [0], [4, 28.0])
+        (replies, missing) = zmq_sock_utils.gather (self.stubs, 100)
+        self.assertEqual (replies, [[4, 28.0], None])
+        self.assertEqual (missing, [self.stubs [1]])
+
+    def test_protocol_error_reply_is_raised (self):
+        for ws in self.stubs:
+            zmq_sock_utils.send (ws.socket, [4])
+        for worker in self.workers:
+            zmq_sock_utils.recv (worker)
+        zmq_sock_utils.send (self.workers [0], [4, 28.0])
+        zmq_sock_utils.send (self.workers [1], [zmq_sock_utils.PROTOCOL_ERROR, 'Unknown message type 99'])
+        self.assertRaises (zmq_sock_utils.ProtocolError, zmq_sock_utils.gather, self.stubs, 1000)
+
+    def test_invalid_reply_reconnects_pending_stubs (self):
+        for ws in self.stubs:
+            zmq_sock_utils.send (ws.socket, [4])
+        zmq_sock_utils.recv (self.workers [0])
+        self.workers [0].send_multipart ([wire_protocol.HEADER.pack (wire_protocol.PROTOCOL_VERSION + 1, 4)])
+        pending_socket = self.stubs [1].socket
+        self.assertRaises (zmq_sock_utils.ProtocolError, zmq_sock_utils.gather, self.stubs, 1000)
+        self.assertNotEqual (self.stubs [1].socket, pending_socket)
+        zmq_sock_utils.send (self.stubs [1].socket, [4])
+
+if __name__ == '__main__':
+    unittest.main ()